@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+"""
+Reproducible performance baseline for redisimp.
+
+Generates a synthetic dataset in redislite, saves matching rdb files and
+times copy() in every mode plus the rdb parser, crc64 and lzf_decompress on
+their own, and how long a fresh interpreter takes to import redisimp and
+run the cli. Results are written as json so runs can be compared across
+commits:
+
+    python benchmark.py --keys 20000 --output before.json
+    python benchmark.py --keys 20000 --output after.json --compare before.json
+"""
+
+# std lib
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import shutil
+import subprocess
+import tempfile
+
+# 3rd party
+import redislite
+
+# our package
+import redisimp
+from redisimp import rdbparser
+from redisimp.crc64 import crc64
+
+TYPES = ['string', 'hash', 'zset', 'set', 'list']
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='redisimp benchmarks')
+    parser.add_argument('--keys', type=int, default=10000,
+                        help='how many keys to generate')
+    parser.add_argument('--types', type=str,
+                        default='string:60,hash:15,zset:10,set:10,list:5',
+                        help='type mix as comma separated type:weight')
+    parser.add_argument('--value-size', type=int, default=64,
+                        help='median size of string values and members')
+    parser.add_argument('--value-size-sigma', type=float, default=1.0,
+                        help='sigma of the lognormal value size distribution')
+    parser.add_argument('--elements', type=int, default=10,
+                        help='median number of elements in collections')
+    parser.add_argument('--ttl-ratio', type=float, default=0.1,
+                        help='fraction of keys with a ttl')
+    parser.add_argument('--compressible-ratio', type=float, default=0.2,
+                        help='fraction of keys with long repetitive names '
+                             'and values that redis stores lzf compressed')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed for the dataset')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='how many times to run each benchmark')
+    parser.add_argument('--only', type=str, default=None,
+                        help='comma separated benchmark names to run')
+    parser.add_argument('--output', type=str, default=None,
+                        help='write json results to this file')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='json results of a previous run to compare to')
+    return parser.parse_args(args=args)
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, weight = part.split(':')
+        if name not in TYPES:
+            raise SystemExit('unknown type %s' % name)
+        weights[name] = float(weight)
+    return weights
+
+
+class DatasetGenerator(object):
+    """
+    Writes a deterministic synthetic dataset into a redis connection.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.rand = random.Random(args.seed)
+        mix = parse_mix(args.types)
+        self.types = list(mix)
+        self.weights = [mix[t] for t in self.types]
+
+    def size(self):
+        size = self.rand.lognormvariate(0, self.args.value_size_sigma)
+        return max(1, int(self.args.value_size * size))
+
+    def value(self, compressible):
+        if compressible:
+            return b'abcd' * max(6, self.size() // 4)
+        n = self.size()
+        return self.rand.getrandbits(n * 8).to_bytes(n, 'little')
+
+    def elements(self):
+        return max(1, int(self.rand.expovariate(1.0 / self.args.elements)))
+
+    def key(self, i, compressible):
+        if compressible:
+            return ('K{%d}' % i + ':compressible' * 4).encode('utf-8')
+        return ('K{%d}' % i).encode('utf-8')
+
+    def write(self, conns):
+        """
+        spread the keys across the connections round robin.
+        """
+        pipes = [conn.pipeline(transaction=False) for conn in conns]
+        for i in range(self.args.keys):
+            pipe = pipes[i % len(pipes)]
+            compressible = self.rand.random() < self.args.compressible_ratio
+            key = self.key(i, compressible)
+            t = self.rand.choices(self.types, self.weights)[0]
+            if t == 'string':
+                pipe.set(key, self.value(compressible))
+            elif t == 'hash':
+                pipe.hset(key, mapping={
+                    b'f%d' % n: self.value(compressible)
+                    for n in range(self.elements())})
+            elif t == 'zset':
+                pipe.zadd(key, {self.value(compressible) + b'%d' % n: n
+                                for n in range(self.elements())})
+            elif t == 'set':
+                pipe.sadd(key, *[self.value(compressible) + b'%d' % n
+                                 for n in range(self.elements())])
+            elif t == 'list':
+                pipe.rpush(key, *[self.value(compressible)
+                                  for _ in range(self.elements())])
+            if self.rand.random() < self.args.ttl_ratio:
+                pipe.expire(key, 86400)
+            if i % 1000 == 999:
+                for p in pipes:
+                    p.execute()
+        for p in pipes:
+            p.execute()
+
+
+class Environment(object):
+    def __init__(self, args):
+        self.dir = tempfile.mkdtemp(prefix='redisimp-bench-')
+        self.src = redislite.StrictRedis(os.path.join(self.dir, 'src.db'))
+        self.alt = redislite.StrictRedis(os.path.join(self.dir, 'alt.db'))
+        self.both = redislite.StrictRedis(os.path.join(self.dir, 'both.db'))
+        self.dst = redislite.StrictRedis(os.path.join(self.dir, 'dst.db'))
+
+        DatasetGenerator(args).write([self.src])
+        DatasetGenerator(args).write([self.both, self.alt])
+        for conn in (self.src, self.alt, self.both):
+            conn.save()
+        self.rdb = os.path.join(self.dir, 'src.db')
+        self.keys = self.src.dbsize()
+        self.bytes = os.path.getsize(self.rdb)
+
+    def close(self):
+        for conn in (self.src, self.alt, self.both, self.dst):
+            conn.shutdown()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def drain(iterable):
+    n = 0
+    for _ in iterable:
+        n += 1
+    return n
+
+
+def backfill_setup(env):
+    # half the keys already exist in the destination
+    env.dst.flushall()
+    drain(redisimp.copy(env.src, env.dst))
+    keys = list(env.dst.scan_iter(count=1000))
+    if keys[::2]:
+        env.dst.delete(*keys[::2])
+
+
+def copied(results):
+    return sum(len(result.keys) for result in results)
+
+
+def bench_copies(env):
+    def flush():
+        env.dst.flushall()
+
+    # set up once and reused by every run, the way an embedding program would
+    copier = redisimp.Copier(env.dst)
+
+    return [
+        ('copy_clobber', flush, lambda: drain(redisimp.copy(env.src, env.dst))),
+        ('copy_backfill', lambda: backfill_setup(env),
+         lambda: drain(redisimp.copy(env.src, env.dst, backfill=True))),
+        ('copy_dryrun', flush, lambda: drain(redisimp.copy(env.src, None))),
+        ('copy_rdb_clobber', flush,
+         lambda: drain(redisimp.copy(env.rdb, env.dst))),
+        ('copy_rdb_clobber_fast', flush,
+         lambda: drain(redisimp.copy(env.rdb, redisimp.fast_restore(env.dst)))),
+        ('copy_rdb_backfill', lambda: backfill_setup(env),
+         lambda: drain(redisimp.copy(env.rdb, env.dst, backfill=True))),
+        ('copy_rdb_dryrun', flush, lambda: drain(redisimp.copy(env.rdb, None))),
+        ('copier_clobber', flush,
+         lambda: copied(copier.copy_batches(env.src))),
+        ('copier_rdb_clobber', flush,
+         lambda: copied(copier.copy_batches(env.rdb))),
+        ('copy_multi_source', flush,
+         lambda: drain(redisimp.multi_copy([env.both, env.alt], env.dst))),
+    ]
+
+
+def capture_lzf(env):
+    """
+    collect the lzf compressed strings the parser decompresses.
+    """
+    captured = []
+    original = rdbparser.lzf_decompress
+
+    def capture(compressed, length):
+        captured.append((compressed, length))
+        return original(compressed, length)
+
+    rdbparser.lzf_decompress = capture
+    try:
+        drain(rdbparser.parse_rdb(env.rdb))
+    finally:
+        rdbparser.lzf_decompress = original
+    return captured
+
+
+def bench_components(env):
+    blob = os.urandom(1 << 20)
+    compressed = capture_lzf(env)
+
+    def python_lzf():
+        lzf, rdbparser.lzf = rdbparser.lzf, None
+        try:
+            for c, n in compressed:
+                rdbparser.lzf_decompress(c, n)
+        finally:
+            rdbparser.lzf = lzf
+        return len(compressed)
+
+    def noop():
+        pass
+
+    def crc():
+        crc64(blob)
+        return 1
+
+    return [
+        ('rdb_parse', noop, lambda: drain(rdbparser.parse_rdb(env.rdb))),
+        ('crc64_1mb', noop, crc),
+        ('lzf_decompress_python', noop, python_lzf),
+    ]
+
+
+def python(*args):
+    """
+    run a fresh interpreter in the repo root.
+    """
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(
+            [sys.executable] + list(args),
+            cwd=os.path.dirname(os.path.abspath(__file__)), stdout=devnull)
+    return 1
+
+
+def bench_startup(env):
+    """
+    what a short invocation pays before it copies anything.
+    """
+    empty = os.path.join(env.dir, 'empty.rdb')
+    with open(empty, 'wb') as f:
+        f.write(b'REDIS0009\xff' + b'\x00' * 8)
+    cli = 'import sys; from redisimp.cli import main; main(sys.argv[1:])'
+
+    def noop():
+        pass
+
+    return [
+        ('startup_import', noop, lambda: python('-c', 'import redisimp')),
+        ('startup_import_cli', noop,
+         lambda: python('-c', 'import redisimp.cli')),
+        ('startup_cli_empty_rdb', noop,
+         lambda: python('-c', cli, '-s', empty, '-d', 'resp://' + os.devnull)),
+    ]
+
+
+def run(name, setup, fn, repeat, env):
+    times = []
+    count = 0
+    for _ in range(repeat):
+        setup()
+        start = time.time()
+        count = fn()
+        times.append(time.time() - start)
+    times.sort()
+    best = times[0]
+    result = {
+        'best': best,
+        'median': times[len(times) // 2],
+        'runs': times,
+        'items': count,
+        'items_per_sec': count / best if best else None,
+    }
+    if name.startswith('copy') or name == 'rdb_parse':
+        result['mb_per_sec'] = env.bytes / best / 1e6 if best else None
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous, out):
+    out.write('\n%-24s %12s %12s %8s\n' % ('benchmark', 'before', 'after',
+                                           'ratio'))
+    for name, r in sorted(results['results'].items()):
+        old = previous['results'].get(name)
+        if not old:
+            continue
+        out.write('%-24s %11.4fs %11.4fs %7.2fx\n' % (
+            name, old['best'], r['best'], old['best'] / r['best']))
+
+
+def main(args=None, out=sys.stdout):
+    args = parse_args(args)
+    only = set(args.only.split(',')) if args.only else None
+    env = Environment(args)
+    try:
+        results = {
+            'commit': git_commit(),
+            'time': time.time(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'lzf_extension': rdbparser.lzf is not None,
+            'params': vars(args),
+            'dataset': {'keys': env.keys, 'rdb_bytes': env.bytes},
+            'results': {},
+        }
+        for name, setup, fn in bench_copies(env) + bench_components(env) + \
+                bench_startup(env):
+            if only and name not in only:
+                continue
+            r = run(name, setup, fn, args.repeat, env)
+            results['results'][name] = r
+            out.write('%-24s %10.4fs %12.0f/s\n' % (
+                name, r['best'], r['items_per_sec'] or 0))
+    finally:
+        env.close()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f), out)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
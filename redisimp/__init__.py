@@ -2,8 +2,41 @@
 redisimp - redis import tool
 
 """
+from importlib import import_module
 
 from .api import *  # noqa
 from .multi import *  # noqa
-from .cli import *  # noqa
+from .fanout import *  # noqa
+from .sharded import *  # noqa
+from .manifest import *  # noqa
+from .verify import *  # noqa
+from .throttle import *  # noqa
+from .metrics import *  # noqa
+from .profiler import *  # noqa
+from .rdbwriter import *  # noqa
+from .resp import *  # noqa
+from .archive import *  # noqa
+from .fastrestore import *  # noqa
+from .split import *  # noqa
+from .decode import *  # noqa
+from .hotness import *  # noqa
+from .dedup import *  # noqa
+from .sampler import *  # noqa
+from .predicates import *  # noqa
+from .progress import *  # noqa
+from .replicas import *  # noqa
+from .retry import *  # noqa
+from .plan import *  # noqa
+from .analyze import *  # noqa
+from .copier import *  # noqa
+from .transcode import *  # noqa
 from .version import __version__  # noqa
+
+
+def __getattr__(name):
+    # the command line pulls in argparse and the http metrics server, which
+    # library users don't need, so it is only imported when asked for.
+    if name in ('cli', 'main'):
+        cli = import_module('.cli', __name__)
+        return cli if name == 'cli' else cli.main
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
@@ -0,0 +1,216 @@
+"""
+Summarize what is in an rdb file or archive, without restoring anything.
+
+The keyspace is grouped by key prefix, the first `depth` parts of the key
+split on a delimiter, with the keys, serialized bytes, types, encodings and
+ttls under each. The `top` largest keys are kept in a heap and value sizes
+are counted in power of two buckets. rdb files are parsed without building
+the payloads, the parser seeks past each value and only counts the bytes
+it takes, so no value is held in memory and no checksum is computed. At
+most `max_prefixes` prefixes are tracked, keys of any further ones are
+counted under OTHER, so memory stays bounded however large the file.
+"""
+import heapq
+import json
+
+from six import string_types
+
+from .api import rdb_regex_pattern
+from .archive import ArchiveReader, is_archive
+from .plan import object_type
+from .rdbparser import parse_rdb_sizes
+
+__all__ = ['Analyzer', 'analyze']
+
+# how each rdb object type is laid out
+ENCODINGS = {
+    0: 'string', 1: 'linkedlist', 2: 'hashtable', 3: 'skiplist',
+    4: 'hashtable', 5: 'skiplist', 6: 'module', 7: 'module', 9: 'zipmap',
+    10: 'ziplist', 11: 'intset', 12: 'ziplist', 13: 'ziplist',
+    14: 'quicklist', 15: 'stream', 16: 'listpack', 17: 'listpack',
+    18: 'quicklist', 19: 'stream', 20: 'listpack', 21: 'stream',
+}
+
+# upper bounds of the ttl buckets in ms
+TTL_BUCKETS = [
+    (60 * 1000, '<1m'),
+    (3600 * 1000, '<1h'),
+    (86400 * 1000, '<1d'),
+    (7 * 86400 * 1000, '<1w'),
+    (30 * 86400 * 1000, '<30d'),
+]
+
+NO_PREFIX = '(none)'
+OTHER = '(other)'
+
+
+def _text(key):
+    if isinstance(key, bytes):
+        return key.decode('utf-8', 'backslashreplace')
+    return key
+
+
+def ttl_bucket(pttl):
+    if not pttl:
+        return 'none'
+    for bound, name in TTL_BUCKETS:
+        if pttl < bound:
+            return name
+    return '>=30d'
+
+
+def size_bucket(size):
+    """
+    :return: int the power of two at or above the size, at least 64
+    """
+    return 1 << max(6, (size - 1).bit_length())
+
+
+def _incr(counts, name, n=1):
+    counts[name] = counts.get(name, 0) + n
+
+
+class _Group(object):
+    __slots__ = ('keys', 'bytes', 'types', 'encodings', 'ttls')
+
+    def __init__(self):
+        self.keys = 0
+        self.bytes = 0
+        self.types = {}
+        self.encodings = {}
+        self.ttls = {}
+
+    def add(self, size, kind, encoding, ttl):
+        self.keys += 1
+        self.bytes += size
+        _incr(self.types, kind)
+        _incr(self.encodings, encoding)
+        _incr(self.ttls, ttl)
+
+    def as_dict(self):
+        return {'keys': self.keys, 'bytes': self.bytes, 'types': self.types,
+                'encodings': self.encodings, 'ttls': self.ttls}
+
+
+class Analyzer(object):
+    """
+    Aggregates the keys of rdb files and archives.
+
+    :param delimiter: str what separates the parts of a key
+    :param depth: int how many parts make up the prefix
+    :param top: int how many of the largest keys to list
+    :param max_prefixes: int how many prefixes to track
+    """
+
+    def __init__(self, delimiter=':', depth=1, top=20, max_prefixes=10000):
+        if not isinstance(delimiter, bytes):
+            delimiter = delimiter.encode('utf-8')
+        self.delimiter = delimiter
+        self.depth = depth
+        self.top = top
+        self.max_prefixes = max_prefixes
+        self.total = _Group()
+        self.prefixes = {}
+        self.sizes = {}
+        self._largest = []
+
+    def prefix(self, key):
+        parts = key.split(self.delimiter, self.depth)
+        if len(parts) <= self.depth:
+            return NO_PREFIX
+        return _text(self.delimiter.join(parts[:self.depth]))
+
+    def add(self, key, data, pttl=0):
+        """
+        count one key.
+        :param key: bytes
+        :param data: bytes its DUMP payload
+        :param pttl: int
+        """
+        self.add_size(key, bytearray(data[:1])[0], len(data), pttl)
+
+    def add_size(self, key, enc_type, size, pttl=0):
+        """
+        count one key by the size of its value.
+        :param key: bytes
+        :param enc_type: int the rdb object type
+        :param size: int the bytes of its DUMP payload
+        :param pttl: int
+        """
+        kind = object_type(enc_type)
+        encoding = ENCODINGS.get(enc_type, kind)
+        ttl = ttl_bucket(pttl)
+        self.total.add(size, kind, encoding, ttl)
+
+        prefix = self.prefix(key)
+        group = self.prefixes.get(prefix)
+        if group is None:
+            if len(self.prefixes) >= self.max_prefixes:
+                prefix = OTHER
+                group = self.prefixes.get(OTHER)
+            if group is None:
+                group = self.prefixes[prefix] = _Group()
+        group.add(size, kind, encoding, ttl)
+
+        _incr(self.sizes, size_bucket(size))
+
+        item = (size, key, kind, encoding, pttl)
+        if len(self._largest) < self.top:
+            heapq.heappush(self._largest, item)
+        elif item > self._largest[0]:
+            heapq.heapreplace(self._largest, item)
+
+    def read(self, src, pattern=None):
+        """
+        count every key of a source.
+        :param src: the path to an rdb file or archive, or an ArchiveReader
+        :param pattern: str glob-style or /regex/ key filter
+        """
+        if is_archive(src):
+            src = ArchiveReader(src)
+        if isinstance(src, ArchiveReader):
+            key_filter = rdb_regex_pattern(pattern)
+            for key, data, pttl in src:
+                if key_filter(key):
+                    self.add(key, data, pttl)
+        elif isinstance(src, string_types):
+            for key, enc_type, size, pttl in parse_rdb_sizes(
+                    src, rdb_regex_pattern(pattern)):
+                self.add_size(key, enc_type, size, pttl)
+        else:
+            raise TypeError('only rdb files and archives can be analyzed')
+
+    def result(self):
+        """
+        :return: dict suitable for json
+        """
+        result = self.total.as_dict()
+        result['delimiter'] = _text(self.delimiter)
+        result['depth'] = self.depth
+        result['prefixes'] = dict((prefix, group.as_dict()) for
+                                  prefix, group in self.prefixes.items())
+        result['value_sizes'] = [{'max_bytes': bound, 'keys': n} for
+                                 bound, n in sorted(self.sizes.items())]
+        result['largest'] = [
+            {'key': _text(key), 'bytes': size, 'type': kind,
+             'encoding': encoding, 'pttl': pttl}
+            for size, key, kind, encoding, pttl in
+            sorted(self._largest, reverse=True)]
+        return result
+
+    def write(self, out):
+        json.dump(self.result(), out, indent=2, sort_keys=True)
+        out.write('\n')
+        out.flush()
+
+
+def analyze(srclist, pattern=None, delimiter=':', depth=1, top=20,
+            max_prefixes=10000):
+    """
+    :param srclist: list of paths to rdb files or archives
+    :return: dict of the keyspace, suitable for json
+    """
+    analyzer = Analyzer(delimiter, depth, top, max_prefixes)
+    for src in srclist:
+        analyzer.read(src, pattern)
+    return analyzer.result()
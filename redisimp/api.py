@@ -1,7 +1,14 @@
 import re
-from redis import RedisCluster
-from .rdbparser import parse_rdb
+import sys
+from .rdbparser import parse_rdb, parse_rdb_hotness
+from .archive import ArchiveReader, is_archive
+from .hotness import HotKeys, live_hotness
+from .throttle import Throttle, payload_bytes
+from .metrics import NULL_METRICS
+from .progress import NULL_PROGRESS
+from .retry import NO_RETRY
 import fnmatch
+from functools import lru_cache
 from six import string_types
 
 try:
@@ -23,6 +30,7 @@ def _chunks(iterable, size, fillvalue=None):
     return zip_longest(*[iter(iterable)] * size, fillvalue=fillvalue)
 
 
+@lru_cache(maxsize=64)
 def _compile_regex_pattern(pattern):
     if pattern is None:
         return None
@@ -44,26 +52,52 @@ def _compile_regex_pattern(pattern):
     return match
 
 
-def _read_keys(src, batch_size=500, pattern=None):
+def _read_keys(src, batch_size=500, pattern=None, metrics=NULL_METRICS,
+               dedup=None, sampler=None, predicate=None):
     """
     iterate through batches of keys from source
     :param src: redis.StrictRedis
     :param batch_size: int
     :param pattern: str
+    :param metrics: redisimp.Metrics
+    :param dedup: redisimp.Dedup leaves out the keys it has seen, without
+        marking the rest
+    :param sampler: redisimp.Sampler
+    :param predicate: redisimp.Predicate
     :yeild: array of keys
     :return: generator
     """
     matcher = _compile_regex_pattern(pattern)
     if matcher:
         pattern = None
+    from redis.exceptions import ResponseError
+    scan = {}
+    if predicate is not None and predicate.scan_type:
+        scan['_type'] = predicate.scan_type
 
     cursor = 0
     while True:
-        cursor, keys = src.scan(cursor=cursor, count=batch_size, match=pattern)
+        with metrics.timer('scan'):
+            try:
+                next_cursor, keys = src.scan(cursor=cursor, count=batch_size,
+                                             match=pattern, **scan)
+            except ResponseError as e:
+                # SCAN TYPE is new in redis 6. without it the rows are still
+                # checked once they are read.
+                if not scan or 'syntax' not in str(e).lower():
+                    raise
+                scan = {}
+                continue
+        cursor = next_cursor
         if keys:
             if matcher:
                 keys = [key for key in keys if matcher(key)]
-            yield keys
+            if sampler is not None:
+                keys = [key for key in keys if sampler(key)]
+            if dedup is not None:
+                keys = dedup.unseen(keys)
+            if keys:
+                yield keys
 
         if cursor == 0:
             break
@@ -80,7 +114,8 @@ def _read_data_and_pttl(src, keys):
         ii = i * 2
         data = res[ii]
         pttl = int(res[ii + 1])
-        if len(data) < 1:
+        # keys can go away between SCAN and DUMP
+        if not data:
             continue
         if pttl < 1:
             pttl = 0
@@ -94,8 +129,33 @@ def _compare_version(version1, version2):
     return _cmp(normalize(version1), normalize(version2))
 
 
+def _is_cluster(conn):
+    """
+    whether conn is a RedisCluster. redis-py is slow to import and isn't
+    needed for copies between files, so this doesn't import it: nothing is
+    a RedisCluster before redis.cluster is loaded.
+    """
+    cluster = sys.modules.get('redis.cluster')
+    return cluster is not None and isinstance(conn, cluster.RedisCluster)
+
+
+def _takes_commands(conn):
+    """
+    whether conn is a redis connection, cluster or ShardedRedis rather than
+    a file, looking through the wrappers around it. wrappers pass unknown
+    attributes on to the destination they wrap, so it is found through
+    their own `conn` rather than asked for.
+    """
+    while 'conn' in getattr(conn, '__dict__', {}):
+        conn = conn.conn
+    return _is_cluster(conn) or hasattr(conn, 'connection_pool') \
+        or hasattr(conn, 'node_for')
+
+
 def _supports_replace(conn):
-    if isinstance(conn, RedisCluster):
+    if _is_cluster(conn):
+        return True
+    if getattr(conn, 'supports_replace', False):
         return True
     version = conn.info().get('redis_version')
     if not version:
@@ -116,6 +176,10 @@ def _delete_restore(pipe, key, pttl, data):
     pipe.restore(key, pttl, data)
 
 
+def _new_restore(pipe, key, pttl, data):
+    pipe.restore(key, pttl, data)
+
+
 def _get_restore_handler(conn):
     if _supports_replace(conn):
         return _replace_restore
@@ -123,75 +187,209 @@ def _get_restore_handler(conn):
         return _delete_restore
 
 
-def _dry_run_copy(src, pattern=None):
+def _dry_run_copy(src, pattern=None, dedup=None, sampler=None, predicate=None):
     """
     yields the keys it processes as it goes.
     :param pattern:
     :param src: redis.StrictRedis
     :param dst: redis.StrictRedis or rediscluster.RedisCluster
+    :param dedup: redisimp.Dedup
+    :param sampler: redisimp.Sampler
+    :param predicate: redisimp.Predicate
     :return: None
     """
-    for keys in _read_keys(src, pattern=pattern):
+    for keys in _read_keys(src, pattern=pattern, dedup=dedup,
+                           sampler=sampler, predicate=predicate):
+        if dedup is not None:
+            keys = dedup.filter(keys)
         for key in keys:
             yield key
 
 
-def _clobber_copy(src, dst, pattern=None):
+def _conn_name(conn):
+    """
+    a label for a connection or rdb file in metrics and logs.
+    """
+    if isinstance(conn, string_types):
+        return conn
+    if not hasattr(conn, 'connection_pool'):
+        return conn.name
+    kwargs = conn.connection_pool.connection_kwargs
+    if 'path' in kwargs:
+        return kwargs['path']
+    return '%s:%s' % (kwargs.get('host'), kwargs.get('port'))
+
+
+def _count_read(metrics, src, rows):
+    if not metrics.enabled:
+        return
+    name = _conn_name(src)
+    metrics.incr('keys_read', name, len(rows))
+    metrics.incr('bytes_read', name, payload_bytes(rows))
+
+
+def _node_namer(dst):
+    """
+    :return: function that names the node a key is written to, or None if
+        the destination is a single node
+    """
+    if _is_cluster(getattr(dst, 'conn', None)):
+        # a wrapper like SplitLargeKeys
+        dst = dst.conn
+    if _is_cluster(dst):
+        def node_name(key):
+            return dst.get_node_from_key(key).name
+
+        return node_name
+    return getattr(dst, 'node_name', None)
+
+
+def _count_written(metrics, dst, rows):
+    if not metrics.enabled or not rows:
+        return
+    node_name = _node_namer(dst)
+    if node_name is not None:
+        for key, data, pttl in rows:
+            name = node_name(key)
+            metrics.incr('keys_written', name)
+            metrics.incr('bytes_written', name, len(data))
+        return
+    name = _conn_name(dst)
+    metrics.incr('keys_written', name, len(rows))
+    metrics.incr('bytes_written', name, payload_bytes(rows))
+
+
+def _read_rows(src, keys, throttle, manifest=None, metrics=NULL_METRICS,
+               progress=NULL_PROGRESS, predicate=None, dedup=None):
+    with metrics.timer('dump'):
+        rows = list(_read_data_and_pttl(src, keys))
+    _count_read(metrics, src, rows)
+    nbytes = payload_bytes(rows)
+    throttle.read(len(rows), nbytes)
+    progress.read(len(rows), nbytes)
+    if predicate is not None:
+        rows = predicate.filter(rows)
+    # an unchanged row is already in the destination, so it counts as seen
+    if dedup is not None:
+        rows = dedup.accept(rows)
+    if manifest is not None:
+        rows = list(manifest.filter(rows))
+    return rows
+
+
+def _missing(dst, keys, metrics, retry=None):
+    """
+    the keys that don't exist in the destination yet.
+    """
+    def exists():
+        pipe = dst.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+        return pipe.execute()
+
+    with metrics.timer('exists'):
+        results = (retry or NO_RETRY).call(dst, exists, metrics)
+    return [keys[i] for i, result in enumerate(results) if not result]
+
+
+def _restore_rows(dst, rows, restore, metrics, retry=None):
+    """
+    restore rows with the restore handler, sending the ones that fail
+    again as the retry policy says.
+    :return: list of the rows written
+    """
+    retry = retry or NO_RETRY
+    written, busy, failed = retry.restore(dst, rows, restore, metrics)
+    _count_written(metrics, dst, written)
+    retry.give_up(failed)
+    return written
+
+
+def _restore_new(dst, rows, metrics, retry=None):
+    """
+    restore rows without replacing existing keys, skipping the ones that
+    got created in the meantime.
+    :return: list of the keys it restored
+    """
+    written = _restore_rows(dst, rows, _new_restore, metrics, retry)
+    return [row[0] for row in written]
+
+
+def _clobber_copy(src, dst, pattern=None, manifest=None, throttle=None,
+                  metrics=NULL_METRICS, dedup=None, progress=NULL_PROGRESS,
+                  sampler=None, predicate=None, retry=None):
     """
     yields the keys it processes as it goes.
     :param pattern:
     :param src: redis.StrictRedis
     :param dst: redis.StrictRedis or rediscluster.RedisCluster
+    :param manifest: redisimp.Manifest
+    :param throttle: redisimp.Throttle
+    :param metrics: redisimp.Metrics
+    :param dedup: redisimp.Dedup
+    :param progress: redisimp.Progress
+    :param sampler: redisimp.Sampler
+    :param predicate: redisimp.Predicate
+    :param retry: redisimp.Retry
     :return: None
     """
-    read = _read_data_and_pttl
+    throttle = throttle or Throttle()
     _restore = _get_restore_handler(dst)
 
-    for keys in _read_keys(src, pattern=pattern):
-        pipe = dst.pipeline(transaction=False)
-        for key, data, pttl in read(src, keys):
-            _restore(pipe, key, pttl, data)
-            yield key
-        pipe.execute()
+    for keys in _read_keys(src, pattern=pattern, metrics=metrics,
+                           dedup=dedup, sampler=sampler, predicate=predicate):
+        rows = _read_rows(src, keys, throttle, manifest, metrics, progress,
+                          predicate, dedup)
+        if not rows:
+            continue
+        throttle.write(len(rows), payload_bytes(rows))
+        for row in _restore_rows(dst, rows, _restore, metrics, retry):
+            yield row[0]
 
 
-def _backfill_copy(src, dst, pattern=None):
+def _backfill_copy(src, dst, pattern=None, manifest=None, throttle=None,
+                   metrics=NULL_METRICS, dedup=None, progress=NULL_PROGRESS,
+                   sampler=None, predicate=None, retry=None):
     """
     yields the keys it processes as it goes.
     WON'T OVERWRITE the key if it exists. It'll skip over it.
     :param src: redis.StrictRedis
     :param dst: redis.StrictRedis or redis.RedisCluster
     :param pattern: str
+    :param manifest: redisimp.Manifest
+    :param throttle: redisimp.Throttle
+    :param metrics: redisimp.Metrics
+    :param dedup: redisimp.Dedup
+    :param progress: redisimp.Progress
+    :param sampler: redisimp.Sampler
+    :param predicate: redisimp.Predicate
+    :param retry: redisimp.Retry
     :return: None
     """
-    read = _read_data_and_pttl
-    for keys in _read_keys(src, pattern=pattern):
+    throttle = throttle or Throttle()
+    for keys in _read_keys(src, pattern=pattern, metrics=metrics,
+                           dedup=dedup, sampler=sampler, predicate=predicate):
         # don't even bother reading the data if the key already exists in the
         #  src.
-        pipe = dst.pipeline(transaction=False)
-        for key in keys:
-            pipe.exists(key)
-        keys = [keys[i] for i, result in enumerate(pipe.execute()) if
-                not result]
+        missing = _missing(dst, keys, metrics, retry)
+        if manifest is not None and len(missing) < len(keys):
+            found = set(missing)
+            manifest.keep(key for key in keys if key not in found)
+        keys = missing
         if not keys:
             continue
 
-        pipe = dst.pipeline(transaction=False)
-
-        for key, data, pttl in read(src, keys):
-            pipe.restore(key, pttl, data)
-
-        for i, result in enumerate(pipe.execute(raise_on_error=False)):
-            if not isinstance(result, Exception):
-                yield keys[i]
-                continue
-
-            if 'is busy' in str(result):
-                continue
+        rows = _read_rows(src, keys, throttle, manifest, metrics, progress,
+                          predicate, dedup)
+        if not rows:
+            continue
 
-            raise result
+        throttle.write(len(rows), payload_bytes(rows))
+        for key in _restore_new(dst, rows, metrics, retry):
+            yield key
 
 
+@lru_cache(maxsize=64)
 def rdb_regex_pattern(pattern):
     if pattern is None:
         def matchall(x):
@@ -219,109 +417,359 @@ def rdb_regex_pattern(pattern):
         return fnmatch_pattern
 
 
-def _rdb_clobber_copy(src, dst, pattern=None):
+def _rdb_key_filter(pattern, exclude=None, dedup=None, sampler=None):
+    """
+    :param exclude: keys to leave out
+    :param dedup: redisimp.Dedup consulted for the keys that pass the rest.
+        the keys aren't marked as seen until their rows are accepted
+    :param sampler: redisimp.Sampler
+    """
+    key_filter = rdb_regex_pattern(pattern)
+    if not exclude and dedup is None and sampler is None:
+        return key_filter
+
+    def match(key):
+        if exclude and key in exclude:
+            return False
+        if not key_filter(key):
+            return False
+        if sampler is not None and not sampler(key):
+            return False
+        return dedup is None or dedup.is_new(key)
+
+    return match
+
+
+def _parsed_batches(src, batches, manifest, throttle, metrics,
+                    progress=NULL_PROGRESS, predicate=None, dedup=None):
+    for batch in batches:
+        batch = [row for row in batch if row is not None]
+        _count_read(metrics, src, batch)
+        nbytes = payload_bytes(batch)
+        throttle.read(len(batch), nbytes)
+        progress.read(len(batch), nbytes)
+        if predicate is not None:
+            batch = predicate.filter(batch)
+        if dedup is not None:
+            batch = dedup.accept(batch)
+        if manifest is not None:
+            batch = list(manifest.filter(batch))
+        if batch:
+            yield batch
+
+
+def _rdb_batches(src, pattern, manifest, throttle, metrics=NULL_METRICS,
+                 batch_size=500, exclude=None, dedup=None,
+                 progress=NULL_PROGRESS, sampler=None, predicate=None):
+    """
+    parse the rdb file into batches of (key, data, pttl) rows. archives
+    are read a chunk per batch.
+    :param exclude: keys to leave out
+    :param dedup: redisimp.Dedup
+    :param progress: redisimp.Progress
+    :param sampler: redisimp.Sampler
+    :param predicate: redisimp.Predicate
+    """
+    key_filter = _rdb_key_filter(pattern, exclude, dedup, sampler)
+    if isinstance(src, ArchiveReader):
+        batches = src.batches(key_filter)
+    else:
+        rows = parse_rdb(src, key_filter,
+                         metrics=metrics if metrics.enabled else None,
+                         progress=progress, predicate=predicate)
+        batches = _chunks(rows, batch_size)
+    for batch in _parsed_batches(src, batches, manifest, throttle, metrics,
+                                 progress, predicate, dedup):
+        yield batch
+
+
+def _hot_batches(src, pattern, manifest, throttle, metrics, size,
+                 batch_size=500, dedup=None, progress=NULL_PROGRESS,
+                 sampler=None, predicate=None):
+    """
+    batches of rows with the `size` hottest keys first, hottest first,
+    followed by the rest in source order. rdb files are parsed twice, the
+    hottest rows are held in memory in between. live sources are scanned
+    twice.
+    """
+    hot = HotKeys(size)
+    if isinstance(src, string_types):
+        with metrics.timer('hotness'):
+            for row, hotness in parse_rdb_hotness(
+                    src, _rdb_key_filter(pattern, sampler=sampler),
+                    predicate=predicate):
+                hot.add(row[0], hotness, row)
+        rows = [row for _, row in hot.hottest()
+                if dedup is None or dedup.is_new(row[0])]
+        for batch in _parsed_batches(src, _chunks(rows, batch_size),
+                                     manifest, throttle, metrics,
+                                     predicate=predicate, dedup=dedup):
+            yield batch
+        for batch in _rdb_batches(src, pattern, manifest, throttle, metrics,
+                                  batch_size, exclude=hot, dedup=dedup,
+                                  progress=progress, sampler=sampler,
+                                  predicate=predicate):
+            yield batch
+        return
+
+    for keys in _read_keys(src, batch_size, pattern, metrics,
+                           sampler=sampler, predicate=predicate):
+        with metrics.timer('hotness'):
+            for key, hotness in zip(keys, live_hotness(src, keys)):
+                if hotness is not None:
+                    hot.add(key, hotness)
+    keys = [key for key, _ in hot.hottest()]
+    if dedup is not None:
+        keys = dedup.unseen(keys)
+    for start in range(0, len(keys), batch_size):
+        rows = _read_rows(src, keys[start:start + batch_size], throttle,
+                          manifest, metrics, progress, predicate, dedup)
+        if rows:
+            yield rows
+    for keys in _read_keys(src, batch_size, pattern, metrics,
+                           sampler=sampler, predicate=predicate):
+        keys = [key for key in keys if key not in hot]
+        if dedup is not None:
+            keys = dedup.unseen(keys)
+        if not keys:
+            continue
+        rows = _read_rows(src, keys, throttle, manifest, metrics, progress,
+                          predicate, dedup)
+        if rows:
+            yield rows
+
+
+def _read_batches(src, pattern=None, manifest=None, throttle=None,
+                  metrics=NULL_METRICS, hot_first=None, dedup=None,
+                  progress=NULL_PROGRESS, sampler=None, predicate=None):
+    """
+    batches of (key, data, pttl) rows from a live source, rdb file or
+    archive.
+    :param hot_first: int how many of the hottest keys to read first.
+        archives keep no access statistics and are read in order.
+    :param dedup: redisimp.Dedup
+    :param progress: redisimp.Progress
+    :param sampler: redisimp.Sampler
+    :param predicate: redisimp.Predicate
+    """
+    throttle = throttle or Throttle()
+    if hot_first and not isinstance(src, ArchiveReader):
+        for rows in _hot_batches(src, pattern, manifest, throttle, metrics,
+                                 hot_first, dedup=dedup, progress=progress,
+                                 sampler=sampler, predicate=predicate):
+            yield rows
+        return
+    if isinstance(src, string_types + (ArchiveReader,)):
+        for rows in _rdb_batches(src, pattern, manifest, throttle, metrics,
+                                 dedup=dedup, progress=progress,
+                                 sampler=sampler, predicate=predicate):
+            yield rows
+        return
+
+    for keys in _read_keys(src, pattern=pattern, metrics=metrics,
+                           dedup=dedup, sampler=sampler, predicate=predicate):
+        rows = _read_rows(src, keys, throttle, manifest, metrics, progress,
+                          predicate, dedup)
+        if rows:
+            yield rows
+
+
+def _copy_batches(batches, dst, backfill=False, throttle=None,
+                  metrics=NULL_METRICS, retry=None):
+    """
+    restore batches of rows that were already read.
+    yields the keys it processes as it goes.
+    """
+    throttle = throttle or Throttle()
+    if backfill:
+        for rows in batches:
+            missing = set(_missing(dst, [row[0] for row in rows], metrics,
+                                   retry))
+            rows = [row for row in rows if row[0] in missing]
+            if not rows:
+                continue
+
+            throttle.write(len(rows), payload_bytes(rows))
+            for key in _restore_new(dst, rows, metrics, retry):
+                yield key
+        return
+
+    _restore = _get_restore_handler(dst)
+    for rows in batches:
+        throttle.write(len(rows), payload_bytes(rows))
+        for row in _restore_rows(dst, rows, _restore, metrics, retry):
+            yield row[0]
+
+
+def _rdb_clobber_copy(src, dst, pattern=None, manifest=None, throttle=None,
+                      metrics=NULL_METRICS, dedup=None,
+                      progress=NULL_PROGRESS, sampler=None, predicate=None,
+                      retry=None):
     """
     yields the keys it processes as it goes.
     :param pattern:
     :param src: redis.StrictRedis
     :param dst: redis.StrictRedis or rediscluster.RedisCluster
+    :param manifest: redisimp.Manifest
+    :param throttle: redisimp.Throttle
+    :param metrics: redisimp.Metrics
+    :param dedup: redisimp.Dedup
+    :param progress: redisimp.Progress
+    :param sampler: redisimp.Sampler
+    :param predicate: redisimp.Predicate
+    :param retry: redisimp.Retry
     :return: None
     """
-    _restore = _get_restore_handler(dst)
-    matcher = rdb_regex_pattern(pattern)
-    for rows in _chunks(parse_rdb(src, matcher), 500):
-        pipe = dst.pipeline(transaction=False)
-        for row in rows:
-            if row is None:
-                continue
-            key, data, pttl = row
-            _restore(pipe, key, pttl, data)
-            yield key
-        pipe.execute()
+    throttle = throttle or Throttle()
+    batches = _rdb_batches(src, pattern, manifest, throttle, metrics,
+                           dedup=dedup, progress=progress, sampler=sampler,
+                           predicate=predicate)
+    return _copy_batches(batches, dst, throttle=throttle, metrics=metrics,
+                         retry=retry)
 
 
-def _rdb_dryrun_copy(src, pattern=None):
+def _rdb_dryrun_copy(src, pattern=None, dedup=None, progress=NULL_PROGRESS,
+                     sampler=None, predicate=None):
     """
     yields the keys it processes as it goes.
     WON'T OVERWRITE the key if it exists. It'll skip over it.
     :param src: redis.StrictRedis
     :param dst: redis.StrictRedis or rediscluster.RedisCluster
     :param pattern: str
+    :param dedup: redisimp.Dedup
+    :param progress: redisimp.Progress
+    :param sampler: redisimp.Sampler
+    :param predicate: redisimp.Predicate
     :return: None
     """
-    matcher = rdb_regex_pattern(pattern)
-    for rows in _chunks(parse_rdb(src, matcher), 500):
+    key_filter = _rdb_key_filter(pattern, dedup=dedup, sampler=sampler)
+    if isinstance(src, ArchiveReader):
+        batches = src.batches(key_filter)
+    else:
+        batches = _chunks(parse_rdb(src, key_filter, progress=progress,
+                                    predicate=predicate), 500)
+    for rows in batches:
         for row in rows:
             if row is None:
                 continue
+            if predicate is not None and not predicate.row(row):
+                continue
+            if dedup is not None and not dedup.add(row[0]):
+                continue
             yield row[0]
 
 
-def _rdb_backfill_copy(src, dst, pattern=None):
+def _rdb_backfill_copy(src, dst, pattern=None, manifest=None, throttle=None,
+                       metrics=NULL_METRICS, dedup=None,
+                       progress=NULL_PROGRESS, sampler=None, predicate=None,
+                       retry=None):
     """
     yields the keys it processes as it goes.
     WON'T OVERWRITE the key if it exists. It'll skip over it.
     :param src: redis.StrictRedis
     :param dst: redis.StrictRedis or rediscluster.RedisCluster
     :param pattern: str
+    :param manifest: redisimp.Manifest
+    :param throttle: redisimp.Throttle
+    :param metrics: redisimp.Metrics
+    :param dedup: redisimp.Dedup
+    :param progress: redisimp.Progress
+    :param sampler: redisimp.Sampler
+    :param predicate: redisimp.Predicate
+    :param retry: redisimp.Retry
     :return: None
     """
-    matcher = rdb_regex_pattern(pattern)
-    for rows in _chunks(parse_rdb(src, matcher), 500):
-        # don't even bother reading the data if the key already exists in the
-        #  src.
-        pipe = dst.pipeline(transaction=False)
-        for row in rows:
-            if row is None:
-                continue
-            pipe.exists(row[0])
-        rows = [rows[i] for i, result in enumerate(pipe.execute()) if
-                not result]
-        if not rows:
-            continue
-
-        pipe = dst.pipeline(transaction=False)
-
-        for key, data, pttl in rows:
-            pipe.restore(key, pttl, data)
-
-        for i, result in enumerate(pipe.execute(raise_on_error=False)):
-            if not isinstance(result, Exception):
-                yield rows[i][0]
-                continue
-
-            if 'is busy' in str(result):
-                continue
-
-            raise result
-
-
-def copy(src, dst, pattern=None, backfill=False):
+    throttle = throttle or Throttle()
+    # don't even bother restoring the data if the key already exists in
+    #  the dst.
+    batches = _rdb_batches(src, pattern, manifest, throttle, metrics,
+                           dedup=dedup, progress=progress, sampler=sampler,
+                           predicate=predicate)
+    return _copy_batches(batches, dst, backfill=True, throttle=throttle,
+                         metrics=metrics, retry=retry)
+
+
+def copy(src, dst, pattern=None, backfill=False, manifest=None,
+         throttle=None, metrics=None, hot_first=None, dedup=None,
+         progress=None, sampler=None, predicate=None, retry=None):
     """
     Copy data from source to destination.
     Optionally filter the source keys by a given glob-style or regex pattern.
     Optionally only backfill keys, avoiding overwriting any pre-existing keys.
+    Optionally pass a Manifest to only restore keys whose payload changed
+    since the previous import.
+    Optionally pass a Throttle to rate limit reads and writes.
+    Optionally pass Metrics to record phase timings and throughput.
+    Optionally copy the `hot_first` most used keys before the rest, as
+    ranked by the lfu or lru data of the source.
+    Optionally pass a Dedup to skip keys it has already let through, before
+    they are read.
+    Optionally pass a Progress to follow the bytes read and rdb offset.
+    Optionally pass a Sampler to only copy the keys it picks, which are
+    dropped before their values are read.
+    Optionally pass a Retry to send the writes that fail again instead of
+    aborting, and log the keys that never make it.
+    The source can also be the path to an rdb file or archive, or an
+    ArchiveReader. The destination can be a FanOut to write to several
+    destinations from one read.
     :param src: redis.StrictRedis
     :param dst: redis.StrictRedis
     :param pattern: string
     :param backfill: bool
+    :param manifest: redisimp.Manifest
+    :param throttle: redisimp.Throttle
+    :param metrics: redisimp.Metrics
+    :param hot_first: int
+    :param dedup: redisimp.Dedup
+    :param progress: redisimp.Progress
+    :param sampler: redisimp.Sampler
+    :param predicate: redisimp.Predicate
+    :param retry: redisimp.Retry
     :return: generator
     """
+    if is_archive(src):
+        src = ArchiveReader(src)
+    from_file = isinstance(src, string_types + (ArchiveReader,))
+    progress = progress or NULL_PROGRESS
+
+    if hasattr(dst, 'copy_from'):
+        return dst.copy_from(src, pattern, backfill=backfill,
+                             manifest=manifest, throttle=throttle,
+                             metrics=metrics or NULL_METRICS,
+                             hot_first=hot_first, dedup=dedup,
+                             progress=progress, sampler=sampler,
+                             predicate=predicate, retry=retry)
+
+    if hot_first and not isinstance(src, ArchiveReader):
+        batches = _read_batches(src, pattern, manifest, throttle,
+                                metrics or NULL_METRICS, hot_first, dedup,
+                                progress, sampler, predicate)
+        if dst is None:
+            return (row[0] for rows in batches for row in rows)
+        return _copy_batches(batches, dst, backfill, throttle,
+                             metrics or NULL_METRICS, retry)
+
     if dst is None:
-        if isinstance(src, string_types):
-            return _rdb_dryrun_copy(src, pattern=pattern)
+        if from_file:
+            return _rdb_dryrun_copy(src, pattern=pattern, dedup=dedup,
+                                    progress=progress, sampler=sampler,
+                                    predicate=predicate)
         else:
-            return _dry_run_copy(src, pattern=pattern)
+            return _dry_run_copy(src, pattern=pattern, dedup=dedup,
+                                 sampler=sampler, predicate=predicate)
 
     if backfill:
-        if isinstance(src, string_types):
+        if from_file:
             c = _rdb_backfill_copy
         else:
             c = _backfill_copy
     else:
-        if isinstance(src, string_types):
+        if from_file:
             c = _rdb_clobber_copy
         else:
             c = _clobber_copy
 
-    return c(src, dst, pattern)
+    return c(src, dst, pattern, manifest=manifest, throttle=throttle,
+             metrics=metrics or NULL_METRICS, dedup=dedup,
+             progress=progress, sampler=sampler, predicate=predicate,
+             retry=retry)
@@ -0,0 +1,323 @@
+"""
+A portable archive of DUMP payloads for moving data offline.
+
+The archive is a header, a run of independent chunks and a footer index:
+
+    header  RIMPARC1, created at in ms
+    chunk   compressed size, key count, crc32, zlib compressed records
+    record  key size, payload size, absolute expiry in ms, key, payload
+    index   per chunk: offset, size, count, crc32, first and last key
+    trailer index offset, RIMPIDX1
+
+Records inside a chunk are sorted by key, so the first and last key give the
+range a chunk covers. Any chunk can be read on its own, which lets several
+processes import one archive in parallel and an interrupted import resume
+from the chunks it hadn't finished.
+"""
+import os
+import time
+import zlib
+import struct
+from collections import namedtuple
+
+from six import string_types
+
+from .dedup import FingerprintSet
+from .rdbwriter import RdbWriterPipeline
+
+__all__ = ['ArchiveWriter', 'ArchiveReader', 'ArchiveJournal', 'is_archive']
+
+MAGIC = b'RIMPARC1'
+INDEX_MAGIC = b'RIMPIDX1'
+
+HEADER = struct.Struct('<8sQ')
+CHUNK = struct.Struct('<III')
+RECORD = struct.Struct('<IIQ')
+INDEX_ENTRY = struct.Struct('<QIII')
+TRAILER = struct.Struct('<Q8s')
+LENGTH = struct.Struct('<I')
+
+Chunk = namedtuple('Chunk', 'offset size count crc first last')
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def is_archive(filename):
+    """
+    :param filename: str
+    :return: bool True if the file starts with the archive magic
+    """
+    if not isinstance(filename, string_types):
+        return False
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (IOError, OSError):
+        return False
+
+
+def _pack_key(key):
+    return LENGTH.pack(len(key)) + key
+
+
+class ArchiveWriter(object):
+    """
+    A destination that writes restored keys into an archive.
+
+    Like RdbWriter, the first time a key is written wins, and the keys
+    written are remembered in a FingerprintSet. A chunk is flushed once it
+    holds `chunk_keys` keys or `chunk_bytes` bytes of payload, whichever
+    comes first.
+    """
+    supports_replace = True
+
+    def __init__(self, filename, chunk_keys=500, chunk_bytes=4 << 20,
+                 level=6, clock=time.time):
+        self.name = filename
+        self.chunk_keys = chunk_keys
+        self.chunk_bytes = chunk_bytes
+        self.level = level
+        self.keys = 0
+        self.skipped = 0
+        self.chunks = []
+        self._seen = FingerprintSet()
+        self._records = []
+        self._buffered = 0
+        self._clock = clock
+        self._f = open(filename, 'wb')
+        self._f.write(HEADER.pack(MAGIC, int(clock() * 1000)))
+
+    def exists(self, key):
+        return key in self._seen
+
+    def write(self, key, data, pttl=0):
+        """
+        append a key.
+        :param key: bytes
+        :param data: bytes a DUMP payload
+        :param pttl: int ttl in ms, 0 for none
+        :return: bool False if the key was written before
+        """
+        if not self._seen.add(key):
+            self.skipped += 1
+            return False
+
+        expiry = 0
+        if pttl and pttl > 0:
+            expiry = int(self._clock() * 1000) + int(pttl)
+        self._records.append((key, data, expiry))
+        self._buffered += len(key) + len(data)
+        self.keys += 1
+        if len(self._records) >= self.chunk_keys or \
+                self._buffered >= self.chunk_bytes:
+            self.flush()
+        return True
+
+    def flush(self):
+        """
+        compress the buffered records into a chunk.
+        """
+        if not self._records:
+            return
+        records, self._records = sorted(self._records), []
+        self._buffered = 0
+
+        parts = []
+        for key, data, expiry in records:
+            parts.append(RECORD.pack(len(key), len(data), expiry))
+            parts.append(key)
+            parts.append(data)
+        body = zlib.compress(b''.join(parts), self.level)
+        crc = zlib.crc32(body) & 0xffffffff
+
+        offset = self._f.tell()
+        self._f.write(CHUNK.pack(len(body), len(records), crc))
+        self._f.write(body)
+        self.chunks.append(Chunk(offset, len(body), len(records), crc,
+                                 records[0][0], records[-1][0]))
+
+    def pipeline(self, transaction=False):
+        return RdbWriterPipeline(self)
+
+    def close(self):
+        """
+        flush the last chunk and write the index.
+        """
+        if self._f.closed:
+            return
+        self.flush()
+        index_offset = self._f.tell()
+        self._f.write(LENGTH.pack(len(self.chunks)))
+        for chunk in self.chunks:
+            self._f.write(INDEX_ENTRY.pack(chunk.offset, chunk.size,
+                                           chunk.count, chunk.crc))
+            self._f.write(_pack_key(chunk.first))
+            self._f.write(_pack_key(chunk.last))
+        self._f.write(TRAILER.pack(index_offset, INDEX_MAGIC))
+        self._f.close()
+
+
+class ArchiveJournal(object):
+    """
+    Remembers which chunks of an archive have been imported, one chunk
+    number per line. Several processes can share a journal since each
+    line is a single append.
+    """
+
+    def __init__(self, filename):
+        self.name = filename
+        self.done = set()
+        if os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self.done.add(int(line))
+        self._f = open(filename, 'a')
+
+    def mark(self, chunk):
+        self._f.write('%d\n' % chunk)
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self.done.add(chunk)
+
+    def close(self):
+        self._f.close()
+
+
+class ArchiveReader(object):
+    """
+    A source that reads an archive.
+
+    `shard` is a tuple of (index, count) selecting every count-th chunk
+    starting at index, so count processes can split an import between them.
+    With a `journal`, chunks imported before are skipped and each chunk is
+    recorded once the batch it was handed out in has been written.
+    """
+
+    def __init__(self, filename, shard=None, journal=None, clock=time.time):
+        self.name = filename
+        self.shard = shard
+        self.journal = journal
+        self._clock = clock
+        with open(filename, 'rb') as f:
+            magic, self.created = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ArchiveError('%s is not a redisimp archive' % filename)
+            self.chunks = self._read_index(f)
+
+    def _read_index(self, f):
+        f.seek(0, 2)
+        end = f.tell()
+        if end >= HEADER.size + TRAILER.size:
+            f.seek(end - TRAILER.size)
+            index_offset, magic = TRAILER.unpack(f.read(TRAILER.size))
+            if magic == INDEX_MAGIC:
+                f.seek(index_offset)
+                return self._parse_index(f)
+        return self._scan_chunks(f, end)
+
+    def _parse_index(self, f):
+        def read_key():
+            size = LENGTH.unpack(f.read(LENGTH.size))[0]
+            return f.read(size)
+
+        chunks = []
+        for _ in range(LENGTH.unpack(f.read(LENGTH.size))[0]):
+            entry = INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+            chunks.append(Chunk(*(entry + (read_key(), read_key()))))
+        return chunks
+
+    def _scan_chunks(self, f, end):
+        # no index, the writer didn't finish. walk the chunks that made it
+        # to disk in full and ignore a partial one at the end.
+        chunks = []
+        offset = HEADER.size
+        while offset + CHUNK.size <= end:
+            f.seek(offset)
+            size, count, crc = CHUNK.unpack(f.read(CHUNK.size))
+            body = f.read(size)
+            if len(body) < size or zlib.crc32(body) & 0xffffffff != crc:
+                break
+            keys = [key for key, _, _ in _records(zlib.decompress(body))]
+            chunks.append(Chunk(offset, size, count, crc, keys[0], keys[-1]))
+            offset += CHUNK.size + size
+        return chunks
+
+    @property
+    def keys(self):
+        return sum(chunk.count for chunk in self.chunks)
+
+    def selected(self):
+        """
+        :return: list of chunk numbers this reader imports
+        """
+        numbers = range(len(self.chunks))
+        if self.shard is not None:
+            index, count = self.shard
+            numbers = [n for n in numbers if n % count == index]
+        if self.journal is not None:
+            numbers = [n for n in numbers if n not in self.journal.done]
+        return list(numbers)
+
+    def read_chunk(self, number, f=None):
+        """
+        :param number: int the chunk
+        :return: list of (key, data, pttl) leaving out expired keys
+        """
+        chunk = self.chunks[number]
+        if f is None:
+            with open(self.name, 'rb') as f:
+                return self.read_chunk(number, f)
+        f.seek(chunk.offset + CHUNK.size)
+        body = f.read(chunk.size)
+        if zlib.crc32(body) & 0xffffffff != chunk.crc:
+            raise ArchiveError('chunk %d of %s is corrupt' % (number,
+                                                              self.name))
+        now = int(self._clock() * 1000)
+        rows = []
+        for key, data, expiry in _records(zlib.decompress(body)):
+            pttl = 0
+            if expiry:
+                pttl = expiry - now
+                if pttl <= 0:
+                    continue
+            rows.append((key, data, pttl))
+        return rows
+
+    def batches(self, key_filter=None):
+        """
+        yields the rows of each selected chunk as one batch.
+        :param key_filter: function
+        :return: generator
+        """
+        with open(self.name, 'rb') as f:
+            for number in self.selected():
+                rows = self.read_chunk(number, f)
+                if key_filter is not None:
+                    rows = [row for row in rows if key_filter(row[0])]
+                yield rows
+                # the consumer asked for the next batch, so this one is
+                # written
+                if self.journal is not None:
+                    self.journal.mark(number)
+
+    def __iter__(self):
+        for rows in self.batches():
+            for row in rows:
+                yield row
+
+
+def _records(body):
+    pos = 0
+    end = len(body)
+    while pos < end:
+        klen, dlen, expiry = RECORD.unpack_from(body, pos)
+        pos += RECORD.size
+        key = body[pos:pos + klen]
+        pos += klen
+        data = body[pos:pos + dlen]
+        pos += dlen
+        yield key, data, expiry
@@ -3,18 +3,35 @@ import argparse
 import sys
 import time
 import logging
+from functools import partial
 from signal import signal, SIGTERM
 
 # 3rd party
-
-import redis
-from redis import RedisCluster
-from redis.cluster import ClusterNode
-import redislite
-from redis.exceptions import BusyLoadingError
+from six import string_types
 
 # internal
-from .multi import multi_copy
+from .multi import multi_copy, opened_sources
+from .fanout import FanOut, FanOutError
+from .sharded import ShardedRedis, SCHEMES
+from .manifest import Manifest
+from .verify import verify
+from .throttle import Throttle, LatencyGovernor
+from .metrics import Metrics, MetricsReporter, serve_metrics
+from .profiler import Profiler
+from .rdbwriter import RdbWriter
+from .resp import RespWriter
+from .archive import ArchiveWriter, ArchiveReader, ArchiveJournal, is_archive
+from .fastrestore import FastRestore, fast_restore
+from .split import SplitLargeKeys, split_large_keys
+from .transcode import Transcoder, transcoding
+from .dedup import Dedup, POLICIES
+from .sampler import Sampler
+from .predicates import Predicate, TYPES
+from .plan import DEFAULT_SAMPLE, Plan
+from .analyze import Analyzer
+from .progress import Progress, KeyLog
+from .replicas import ReplicaSource
+from .retry import Retry
 from .version import __version__
 
 __all__ = ['main']
@@ -43,27 +60,290 @@ def parse_args(args=None):
         help='comma separated list of hosts in the form of hostname:port')
 
     parser.add_argument(
-        '-d', '--dst', type=str, required=True,
-        help='the destination in the form of hostname:port')
+        '-d', '--dst', type=str, default=None,
+        help='the destination in the form of hostname:port, '
+             'rdb://path to write an rdb file directly, resp://path to '
+             'write RESTORE commands for redis-cli --pipe (resp://- for '
+             'stdout), or archive://path to export an archive. separate '
+             'several destinations with commas to write to all of them from '
+             'one read of the source')
 
     parser.add_argument('--dry-run', action='store_true', default=False,
-                        help='iterate through all the keys to copy, dont do '
-                             'anything')
+                        help="don't copy, report the keys, bytes, type mix, "
+                             "largest keys, bytes per destination node and "
+                             "round trips the copy would take")
+
+    parser.add_argument(
+        '--plan-sample', type=float, default=DEFAULT_SAMPLE,
+        metavar='FRACTION',
+        help='with --dry-run, only size this fraction of the keys of live '
+             'sources and scale the totals up. 1 sizes all of them. '
+             'default %(default)s')
 
     parser.add_argument(
         '-p', '--pattern', type=str, default=None,
         help='a glob-style pattern to select the keys to copy')
 
+    parser.add_argument(
+        '--sample', type=float, default=None, metavar='FRACTION',
+        help='only copy this fraction of the keys, picked by a hash of the '
+             'key or its {hash tag}. the same seed picks the same keys on '
+             'every run, e.g. 0.05')
+
+    parser.add_argument(
+        '--sample-seed', type=int, default=0, metavar='N',
+        help='pick a different --sample of the same size')
+
+    parser.add_argument(
+        '--type', type=str, default=None, dest='types',
+        help='only copy keys of these types, separated by commas: %s. '
+             'live sources are scanned with SCAN TYPE when there is one'
+             % ', '.join(TYPES))
+
+    parser.add_argument(
+        '--max-value-bytes', type=int, default=None, metavar='BYTES',
+        help='leave out keys whose DUMP payload is larger than this. rdb '
+             'files skip them by the length before the value where it '
+             'tells')
+
+    parser.add_argument(
+        '--min-ttl', type=float, default=None, metavar='SECS',
+        help='leave out keys that expire within this many seconds. keys '
+             'without a ttl are copied')
+
     parser.add_argument(
         '-v', '--verbose', action='store_true', default=False,
         help='turn on verbose output')
 
+    parser.add_argument(
+        '--progress-interval', type=float, default=1.0, metavar='SECS',
+        help='seconds between progress lines with the percent done, '
+             'throughput and time left. 0 turns them off')
+
     parser.add_argument(
         '-b', '--backfill', action='store_true', default=False,
         help="backfill data, don't overwrite keys in "
              "destination that exist already")
 
-    return parser.parse_args(args=args)
+    parser.add_argument(
+        '--manifest', type=str, default=None,
+        help='path to a manifest of key fingerprints from the previous '
+             'import. only keys whose payload changed get restored')
+
+    parser.add_argument(
+        '--manifest-delete', action='store_true', default=False,
+        help='delete keys imported last time that are missing from this '
+             'import. requires --manifest')
+
+    parser.add_argument(
+        '--no-rdb-checksum', action='store_true', default=False,
+        help='skip the crc64 of the whole file when writing an rdb:// '
+             'destination')
+
+    parser.add_argument(
+        '--dedup', type=str, default=None, choices=POLICIES,
+        help='copy each key once when sources overlap, from the first or '
+             'the last source that has it. later copies are skipped before '
+             'they are read')
+
+    parser.add_argument(
+        '--read-replicas', action='store_true', default=False,
+        help='read live sources from the replicas their INFO replication '
+             'lists instead of the primary')
+
+    parser.add_argument(
+        '--replicas', type=str, default=None, metavar='HOSTS',
+        help='the replicas of the source to read from, separated by '
+             'commas, instead of the ones INFO replication lists')
+
+    parser.add_argument(
+        '--replica-max-lag', type=int, default=1 << 20, metavar='BYTES',
+        help='read from a replica only while it is at most this many bytes '
+             'of replication stream behind the primary, otherwise from the '
+             'primary')
+
+    parser.add_argument(
+        '--hot-first', type=int, default=None, metavar='KEYS',
+        help='copy this many of the most used keys first, hottest first, '
+             'then the rest. needs an lru or lfu maxmemory-policy on the '
+             'source, or on the server that saved the rdb file')
+
+    parser.add_argument(
+        '--split-large-keys', type=int, default=None, metavar='BYTES',
+        help='write keys with a DUMP payload of at least this many bytes '
+             'in pieces through a temporary key instead of one RESTORE')
+
+    parser.add_argument(
+        '--split-chunk-elements', type=int, default=1000,
+        help='how many elements to write per command when splitting keys')
+
+    parser.add_argument(
+        '--target-rdb-version', type=int, default=None, metavar='N',
+        help='rewrite DUMP payloads newer than this rdb version so a server '
+             'that only loads up to it can restore them. redis destinations '
+             'are matched to their own version without this')
+
+    parser.add_argument(
+        '--no-transcode', dest='transcode', action='store_false',
+        default=True,
+        help='restore payloads exactly as read, even if the destination '
+             'is older than the source')
+
+    parser.add_argument(
+        '--shard-scheme', type=str, default=None, choices=SCHEMES,
+        help='treat several destinations as the nodes of a client side '
+             'sharded fleet and write each key only to the node this '
+             'scheme picks for it, instead of to all of them')
+
+    parser.add_argument(
+        '--dst-buffer', type=int, default=8,
+        help='with several destinations, how many batches one may fall '
+             'behind the others')
+
+    parser.add_argument(
+        '--dst-stall-timeout', type=float, default=30.0,
+        help='with several destinations, give up on one that stays '
+             '--dst-buffer batches behind for this many seconds')
+
+    parser.add_argument(
+        '--retries', type=int, default=0,
+        help='send the keys a destination fails to write again up to this '
+             'many times, reconnecting after a lost connection, instead of '
+             'stopping the import')
+
+    parser.add_argument(
+        '--retry-backoff', type=float, default=0.1,
+        help='seconds to wait before the first retry, doubled for each '
+             'one after it up to 10s')
+
+    parser.add_argument(
+        '--failure-log', type=str, default=None,
+        help='append the keys that still fail after the last retry to this '
+             'file as json lines and carry on. without it the import stops '
+             'at the first such key')
+
+    parser.add_argument(
+        '--archive-shard', type=str, default=None,
+        help='only import chunk I of every N from an archive source, in the '
+             'form I/N, to split an import across processes')
+
+    parser.add_argument(
+        '--archive-journal', type=str, default=None,
+        help='record the archive chunks imported in this file and skip the '
+             'ones recorded by an earlier run')
+
+    parser.add_argument(
+        '--fast-restore', action='store_true', default=False,
+        help='send RESTORE payloads to the destination without copying '
+             'them through redis-py first')
+
+    parser.add_argument(
+        '--read-keys-rate', type=float, default=None,
+        help='max keys per second to read from the source')
+
+    parser.add_argument(
+        '--read-bytes-rate', type=float, default=None,
+        help='max payload bytes per second to read from the source')
+
+    parser.add_argument(
+        '--write-keys-rate', type=float, default=None,
+        help='max keys per second to write to the destination')
+
+    parser.add_argument(
+        '--write-bytes-rate', type=float, default=None,
+        help='max payload bytes per second to write to the destination')
+
+    parser.add_argument(
+        '--target-latency', type=float, default=None,
+        help='slow the copy down whenever the round trip time to the '
+             'destination goes over this many milliseconds. the first '
+             'destination must be a redis server')
+
+    parser.add_argument(
+        '--metrics-log', type=str, default=None,
+        help='append a json line of phase timings and counters to this '
+             'file periodically')
+
+    parser.add_argument(
+        '--metrics-interval', type=float, default=10.0,
+        help='seconds between lines in the metrics log')
+
+    parser.add_argument(
+        '--metrics-port', type=int, default=None,
+        help='serve prometheus metrics on http://127.0.0.1:PORT/metrics')
+
+    parser.add_argument(
+        '--profile', type=str, nargs='?', const='-', default=None,
+        help='profile the import and write a summary of the hot functions '
+             'and the per-phase time split to this file, or stderr')
+
+    parser.add_argument(
+        '--verify', action='store_true', default=False,
+        help="don't copy, compare the keys in the source with the "
+             "destination and report mismatches")
+
+    parser.add_argument(
+        '--verify-sample', type=float, default=None,
+        help='only verify this fraction of the keys, e.g. 0.01')
+
+    parser.add_argument(
+        '--verify-method', type=str, default='auto',
+        choices=['auto', 'digest', 'dump', 'length'],
+        help='how to fingerprint keys when verifying')
+
+    parser.add_argument(
+        '--repair', action='store_true', default=False,
+        help='when verifying, restore mismatched keys from the source')
+
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help='how many batches to work on concurrently')
+
+    parser.add_argument(
+        '--analyze', action='store_true', default=False,
+        help="don't copy, write a json summary of the keys in rdb file or "
+             "archive sources grouped by prefix. no destination needed")
+
+    parser.add_argument(
+        '--analyze-delimiter', type=str, default=':',
+        help='what separates the parts of a key when grouping by prefix')
+
+    parser.add_argument(
+        '--analyze-depth', type=int, default=1,
+        help='how many parts of a key make up its prefix')
+
+    parser.add_argument(
+        '--analyze-top', type=int, default=20,
+        help='how many of the largest keys to list')
+
+    args = parser.parse_args(args=args)
+    if args.dst is None and not args.analyze:
+        parser.error('the following arguments are required: -d/--dst')
+    if args.sample is not None and not 0 <= args.sample <= 1:
+        parser.error('--sample must be between 0 and 1')
+    if args.sample_seed < 0:
+        parser.error('--sample-seed must not be negative')
+    if args.manifest_delete and not args.manifest:
+        parser.error('--manifest-delete requires --manifest')
+    if args.manifest and args.dst and any(
+            d.startswith(('rdb://', 'archive://'))
+            for d in _host_strings(args.dst)):
+        # a new file only holds the keys that changed since the last run
+        parser.error('--manifest needs destinations that keep the keys of '
+                     'earlier runs, not files')
+    if args.retries < 0:
+        parser.error('--retries must not be negative')
+    if args.target_latency and args.dst and \
+            not is_redis_destination(_host_strings(args.dst)[0]):
+        parser.error('--target-latency needs a redis destination to ping')
+    if args.replicas and len(_host_strings(args.src)) > 1:
+        parser.error('--replicas needs a single source')
+    if args.types:
+        args.types = [t.strip() for t in args.types.split(',') if t.strip()]
+        unknown = sorted(set(args.types) - set(TYPES))
+        if unknown:
+            parser.error('--type: unknown types %s' % ', '.join(unknown))
+    return args
 
 
 def resolve_host(target):
@@ -71,6 +351,10 @@ def resolve_host(target):
     :param target: str The host:port pair or path
     :return:
     """
+    # redis-py is imported here rather than at the top so that copies
+    # between files don't wait for it
+    import redis
+    from redis.exceptions import BusyLoadingError
     target = target.strip()
     if target.startswith('redis://') or target.startswith('unix://'):
         return redis.StrictRedis.from_url(target)
@@ -79,6 +363,9 @@ def resolve_host(target):
         hostname, port = target.split(':')
         return redis.StrictRedis(host=hostname, port=int(port))
     except ValueError:
+        # starting redislite's own redis server takes a while to import, so
+        # only pay for it when a path is given
+        import redislite
         start = time.time()
         while True:
             try:
@@ -103,77 +390,505 @@ def resolve_host(target):
             return conn
 
 
+def _host_strings(srcstring):
+    return [s.strip() for s in srcstring.split(',') if s.strip()]
+
+
+def is_redis_destination(dststring):
+    """
+    :return: bool whether the destination is a redis server rather than
+        a file
+    """
+    return '://' not in dststring or \
+        dststring.startswith(('redis://', 'unix://'))
+
+
+def resolve_source(hoststring):
+    """
+    :param hoststring: str host:port, redis:// url or the path to an rdb
+        file or archive
+    :return: a connection, or the path of a file
+    """
+    if hoststring.startswith('rdb://'):
+        return hoststring[6:]
+    elif ':' not in hoststring:
+        return hoststring
+    return resolve_host(hoststring)
+
+
 def resolve_sources(srcstring):
-    for hoststring in srcstring.split(','):
-        hoststring = hoststring.strip()
-        if len(hoststring) < 1:
-            continue
-        if hoststring.startswith('rdb://'):
-            yield hoststring[6:]
-        elif ':' not in hoststring:
-            yield hoststring
-        else:
-            yield resolve_host(hoststring)
-
-
-def resolve_destination(dststring):
+    for hoststring in _host_strings(srcstring):
+        yield resolve_source(hoststring)
+
+
+def resolve_destination(dststring, rdb_checksum=True):
+    if dststring.startswith('rdb://'):
+        return RdbWriter(dststring[6:], checksum=rdb_checksum)
+
+    if dststring.startswith('resp://'):
+        return RespWriter(dststring[7:])
+
+    if dststring.startswith('archive://'):
+        return ArchiveWriter(dststring[10:])
+
     conn = resolve_host(dststring)
     if not conn.info('cluster').get('cluster_enabled', None):
         return conn
 
-    if not RedisCluster:
-        raise RuntimeError(
-            'cluster destination specified and redis-py-cluster not installed')
-
+    from redis import RedisCluster
+    from redis.cluster import ClusterNode
     host, port = dststring.split(':')
     return RedisCluster(
         startup_nodes=[ClusterNode(host=host, port=port)], max_connections=1000)
 
 
+def parse_shard(shard):
+    """
+    :param shard: str in the form I/N
+    :return: tuple of ints or None
+    """
+    if not shard:
+        return None
+    try:
+        index, count = [int(x) for x in shard.split('/')]
+    except ValueError:
+        raise SystemExit('--archive-shard must look like I/N')
+    if not 0 <= index < count:
+        raise SystemExit('--archive-shard I must be between 0 and N-1')
+    return index, count
+
+
+def replica_options(read_replicas=False, hosts=None, max_lag=1 << 20):
+    """
+    :return: dict of ReplicaSource arguments, or None to read the primary
+    """
+    if not read_replicas and not hosts:
+        return None
+    return {'hosts': _host_strings(hosts) if hosts else None,
+            'max_lag': max_lag}
+
+
+def open_source(hoststring, shard=None, journal=None, replicas=None):
+    """
+    :param replicas: dict from replica_options() to read a live source
+        from its replicas
+    """
+    src = resolve_source(hoststring)
+    if is_archive(src):
+        return ArchiveReader(src, shard=shard, journal=journal)
+    if replicas is not None and not isinstance(src, string_types):
+        hosts = replicas['hosts']
+        return ReplicaSource(
+            src, [resolve_host(h) for h in hosts] if hosts else None,
+            max_lag=replicas['max_lag'])
+    return src
+
+
+def source_openers(srcstring, shard=None, journal=None, replicas=None):
+    """
+    a function per source that opens it, so multi_copy connects to each
+    source only when it gets to it.
+    """
+    return [partial(open_source, s, shard, journal, replicas)
+            for s in _host_strings(srcstring)]
+
+
 # pylint: disable=unused-argument
 def sigterm_handler(signum, frame):
     raise SystemExit('--- Caught SIGTERM; Attempting to quit gracefully ---')
 
 
+def start_metrics(log=None, interval=10.0, port=None):
+    """
+    :return: tuple of the redisimp.Metrics or None and a stop function
+    """
+    if not log and not port:
+        return None, lambda: None
+
+    metrics = Metrics()
+    reporter = server = None
+    if log:
+        reporter = MetricsReporter(metrics, open(log, 'a'), interval)
+        reporter.start()
+    if port:
+        server = serve_metrics(metrics, port)
+
+    def stop():
+        if reporter is not None:
+            reporter.stop()
+            reporter.out.close()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    return metrics, stop
+
+
+def open_destination(dststring, rdb_checksum=True, fast=False,
+                     buffer_batches=8, stall_timeout=30.0, shard_scheme=None,
+                     split_threshold=None, split_chunk_elements=1000,
+                     transcode=True, target_rdb_version=None):
+    """
+    :param dststring: str one or more comma separated destinations
+    :return: a destination, a ShardedRedis over several with a
+        shard_scheme, otherwise a FanOut of several
+    """
+    dsts = [resolve_destination(d.strip(), rdb_checksum)
+            for d in dststring.split(',') if d.strip()]
+    if fast:
+        dsts = [fast_restore(d) for d in dsts]
+    if transcode or target_rdb_version:
+        dsts = [transcoding(d, target_rdb_version) for d in dsts]
+    if split_threshold:
+        dsts = [split_large_keys(d, split_threshold, split_chunk_elements)
+                for d in dsts]
+    if shard_scheme:
+        return ShardedRedis(dsts, scheme=shard_scheme)
+    if len(dsts) == 1:
+        return dsts[0]
+    return FanOut(dsts, buffer_batches=buffer_batches,
+                  stall_timeout=stall_timeout)
+
+
+def plan_destination(dststring, shard_scheme=None):
+    """
+    the redis destinations of a dry run, connected without writing
+    anything. files aren't opened at all.
+    :return: a connection, a ShardedRedis or None
+    """
+    dsts = [resolve_destination(d) for d in _host_strings(dststring)
+            if is_redis_destination(d)]
+    if not dsts:
+        return None
+    if shard_scheme and len(dsts) > 1:
+        return ShardedRedis(dsts, scheme=shard_scheme)
+    # each destination of a fan out gets the same keys, the first stands in
+    # for all of them
+    return dsts[0]
+
+
+def destinations(dst):
+    if dst is None:
+        return []
+    if isinstance(dst, FanOut):
+        return dst.dsts
+    if isinstance(dst, ShardedRedis):
+        return dst.nodes
+    return [dst]
+
+
+def close_destination(dst):
+    if isinstance(dst, SplitLargeKeys):
+        dst = dst.conn
+    if isinstance(dst, Transcoder):
+        dst = dst.conn
+    if isinstance(dst, (RdbWriter, RespWriter, ArchiveWriter, FastRestore)):
+        dst.close()
+    if isinstance(dst, FastRestore):
+        dst = dst.conn
+
+    # make sure to save data if it is redislite destnation
+    if _is_redislite(dst):
+        from redis.exceptions import ResponseError
+        try:
+            dst.bgsave()
+        except ResponseError:
+            pass
+
+
+def _is_redislite(conn):
+    # nothing can be a redislite connection if it was never imported
+    redislite = sys.modules.get('redislite')
+    return redislite is not None and isinstance(conn, redislite.StrictRedis)
+
+
+def value_predicate(types=None, max_value_bytes=None, min_ttl=None):
+    """
+    :return: redisimp.Predicate, or None if nothing is filtered on
+    """
+    if not types and max_value_bytes is None and min_ttl is None:
+        return None
+    return Predicate(types=types, max_value_bytes=max_value_bytes,
+                     min_ttl=min_ttl)
+
+
+def retry_policy(retries=0, backoff=0.1, failure_log=None):
+    """
+    :return: redisimp.Retry, or None to stop at the first failed write
+    """
+    if not retries and failure_log is None:
+        return None
+    return Retry(attempts=retries + 1, backoff=backoff,
+                 failure_log=failure_log)
+
+
+def start_progress(out, sources, interval, verbose=False):
+    """
+    :return: redisimp.Progress or None
+    """
+    if not interval:
+        return None
+    if verbose:
+        # keep the list of keys clean
+        if out is not sys.stdout:
+            return None
+        out = sys.stderr
+    return Progress(out, sources, interval)
+
+
+def count_keys(keys, key_log=None, progress=None):
+    """
+    :return: int how many keys the copy processed
+    """
+    processed = 0
+    for key in keys:
+        processed += 1
+        if key_log is not None:
+            key_log.write(key)
+        if progress is not None:
+            progress.advance()
+
+    if key_log is not None:
+        key_log.flush()
+    return processed
+
+
+def save_manifest(manifest, dsts, delete=False, verbose=False, out=None):
+    if delete:
+        deleted = 0
+        for dst in dsts:
+            for key in manifest.delete_stale(dst):
+                deleted += 1
+                if verbose:
+                    out.write('%s\n' % key)
+        out.write('deleted %s stale keys\n' % deleted)
+    manifest.save()
+
+
+def report_failures(out, failures, gave_up=0, failure_log=None):
+    for name, error in sorted(failures.items()):
+        out.write('failed writing to %s: %s\n' % (name, error))
+    if gave_up:
+        out.write('failed writing %s keys, listed in %s\n' % (
+            gave_up, failure_log))
+
+
 def process(src, dst, verbose=False, pattern=None,
-            backfill=False, dryrun=False, out=None):
+            backfill=False, dryrun=False, out=None, manifest=None,
+            manifest_delete=False, read_keys_rate=None, read_bytes_rate=None,
+            write_keys_rate=None, write_bytes_rate=None, target_latency=None,
+            metrics=None, rdb_checksum=True, fast=False, archive_shard=None,
+            archive_journal=None, dst_buffer=8, dst_stall_timeout=30.0,
+            shard_scheme=None, split_threshold=None,
+            split_chunk_elements=1000, transcode=True,
+            target_rdb_version=None, hot_first=None, dedup=None,
+            progress_interval=1.0, plan_sample=DEFAULT_SAMPLE, sample=None,
+            sample_seed=0, types=None, max_value_bytes=None, min_ttl=None,
+            replicas=None, retries=0, retry_backoff=0.1, failure_log=None):
     if out is None:
         out = sys.stdout
-    dst = None if dryrun else resolve_destination(dst)
-    processed = 0
-    src_list = [s for s in resolve_sources(src)]
+    sampler = Sampler(sample, sample_seed) if sample is not None else None
+    predicate = value_predicate(types, max_value_bytes, min_ttl)
+    retry = retry_policy(retries, retry_backoff, failure_log)
+    plan = None
+    if dryrun:
+        plan = Plan(plan_destination(dst, shard_scheme), pattern=pattern,
+                    sample=plan_sample, backfill=backfill, sampler=sampler,
+                    predicate=predicate)
+    dst = None if dryrun else open_destination(
+        dst, rdb_checksum, fast, dst_buffer, dst_stall_timeout, shard_scheme,
+        split_threshold, split_chunk_elements, transcode, target_rdb_version)
+    dsts = destinations(dst)
+    if isinstance(dst, FanOut) and archive_journal:
+        raise SystemExit('--archive-journal needs a single destination')
+    if any(isinstance(d, RespWriter) and d.to_stdout for d in dsts) \
+            and out is sys.stdout:
+        # keep the protocol stream clean
+        out = sys.stderr
+    manifest = Manifest(manifest) if manifest and dst is not None else None
+    governor = None
+    if target_latency and dst is not None:
+        governor = LatencyGovernor(
+            dsts[0] if isinstance(dst, FanOut) else dst, target_latency)
+    throttle = Throttle(read_keys=read_keys_rate, read_bytes=read_bytes_rate,
+                        write_keys=write_keys_rate,
+                        write_bytes=write_bytes_rate, governor=governor)
+    journal = None
+    if archive_journal and dst is not None:
+        journal = ArchiveJournal(archive_journal)
+    src_list = source_openers(src, parse_shard(archive_shard), journal,
+                              replicas)
+    dedup = Dedup(dedup) if dedup else None
+    key_log = KeyLog(out) if verbose else None
+    progress = start_progress(out, len(src_list), progress_interval, verbose)
+
+    if plan is not None:
+        keys = plan.read_sources(src_list, dedup=dedup, progress=progress)
+    else:
+        keys = multi_copy(src_list, dst, pattern=pattern, backfill=backfill,
+                          manifest=manifest, throttle=throttle,
+                          metrics=metrics, hot_first=hot_first,
+                          dedup=dedup, progress=progress,
+                          sampler=sampler, predicate=predicate,
+                          retry=retry)
+    processed = count_keys(keys, key_log, progress)
+
+    failures = {}
+    if isinstance(dst, FanOut):
+        try:
+            dst.close()
+        except FanOutError as e:
+            failures = e.failures
 
-    for key in multi_copy(src_list, dst, pattern=pattern, backfill=backfill):
-        processed += 1
-        if verbose:
-            print(key)
+    out.write('\n\nprocessed %s keys\n' % processed)
+    if dedup is not None:
+        out.write('skipped %s duplicate keys\n' % dedup.skipped)
+    if plan is not None:
+        out.write('\n')
+        plan.report(out)
 
-        if not verbose and processed % 1000 == 0:
-            out.write('\r%d' % processed)
-            out.flush()
+    gave_up = retry.failed if retry is not None else 0
+
+    # a manifest saved now would hide the changes from a destination that
+    # failed, so leave it for the next run to redo.
+    if manifest is not None and not failures and not gave_up:
+        save_manifest(manifest, dsts, manifest_delete, verbose, out)
+
+    report_failures(out, failures, gave_up, failure_log)
 
-    out.write('\n\nprocessed %s keys\n' % processed)
     out.flush()
-    for src in src_list:
-        del src
+    if journal is not None:
+        journal.close()
 
-    # make sure to save data if it is redislite destnation
-    if isinstance(dst, redislite.StrictRedis):
-        try:
-            dst.bgsave()
-        except redis.ResponseError:
-            pass
+    for d in (dst, plan and plan.dst):
+        if isinstance(d, ShardedRedis):
+            d.close()
+    for d in dsts:
+        close_destination(d)
 
     del dst
+    if failures or gave_up:
+        raise SystemExit(1)
+
+
+def process_verify(src, dst, pattern=None, sample=None,
+                   repair=False, method='auto', workers=4, out=None):
+    """
+    :return: int how many mismatched keys are left unrepaired
+    """
+    if out is None:
+        out = sys.stdout
+    dst = resolve_destination(dst)
+    mismatches = repaired = 0
+    for s in resolve_sources(src):
+        for mismatch in verify(s, dst, pattern=pattern, sample=sample,
+                               repair=repair, method=method,
+                               workers=workers):
+            mismatches += 1
+            repaired += mismatch.repaired
+            out.write('%s %s\n' % (mismatch.reason, mismatch.key))
+
+    out.write('\n\nfound %s mismatched keys\n' % mismatches)
+    if repair:
+        out.write('repaired %s keys\n' % repaired)
+    out.flush()
+    return mismatches - repaired
+
+
+def process_analyze(src, pattern=None, delimiter=':', depth=1, top=20,
+                    out=None):
+    if out is None:
+        out = sys.stdout
+    analyzer = Analyzer(delimiter, depth, top)
+    for s in opened_sources(source_openers(src)):
+        if not isinstance(s, string_types + (ArchiveReader,)):
+            raise SystemExit('--analyze only reads rdb files and archives')
+        analyzer.read(s, pattern)
+    analyzer.write(out)
+    return analyzer
+
+
+def report_profile(profiler, filename):
+    if filename == '-':
+        profiler.report(sys.stderr)
+        return
+    with open(filename, 'w') as f:
+        profiler.report(f)
 
 
 def main(args=None, out=None):
     signal(SIGTERM, sigterm_handler)
     args = parse_args(args=args)
 
-    process(src=args.src, dst=args.dst,
-            verbose=args.verbose,
-            pattern=args.pattern,
-            backfill=args.backfill,
-            dryrun=args.dry_run,
-            out=out)
+    if args.analyze:
+        process_analyze(src=args.src, pattern=args.pattern,
+                        delimiter=args.analyze_delimiter,
+                        depth=args.analyze_depth, top=args.analyze_top,
+                        out=out)
+        return
+
+    if args.verify:
+        left = process_verify(src=args.src, dst=args.dst,
+                              pattern=args.pattern,
+                              sample=args.verify_sample,
+                              repair=args.repair,
+                              method=args.verify_method,
+                              workers=args.workers,
+                              out=out)
+        if left:
+            raise SystemExit(1)
+        return
+
+    metrics, stop_metrics = start_metrics(log=args.metrics_log,
+                                          interval=args.metrics_interval,
+                                          port=args.metrics_port)
+    profiler = None
+    if args.profile:
+        profiler = Profiler(metrics=metrics)
+        metrics = profiler.metrics
+        profiler.start()
+    try:
+        process(src=args.src, dst=args.dst,
+                verbose=args.verbose,
+                pattern=args.pattern,
+                backfill=args.backfill,
+                dryrun=args.dry_run,
+                out=out,
+                manifest=args.manifest,
+                manifest_delete=args.manifest_delete,
+                read_keys_rate=args.read_keys_rate,
+                read_bytes_rate=args.read_bytes_rate,
+                write_keys_rate=args.write_keys_rate,
+                write_bytes_rate=args.write_bytes_rate,
+                target_latency=args.target_latency,
+                metrics=metrics,
+                rdb_checksum=not args.no_rdb_checksum,
+                fast=args.fast_restore,
+                archive_shard=args.archive_shard,
+                archive_journal=args.archive_journal,
+                dst_buffer=args.dst_buffer,
+                dst_stall_timeout=args.dst_stall_timeout,
+                shard_scheme=args.shard_scheme,
+                split_threshold=args.split_large_keys,
+                split_chunk_elements=args.split_chunk_elements,
+                transcode=args.transcode,
+                target_rdb_version=args.target_rdb_version,
+                hot_first=args.hot_first,
+                dedup=args.dedup,
+                progress_interval=args.progress_interval,
+                plan_sample=args.plan_sample,
+                sample=args.sample,
+                sample_seed=args.sample_seed,
+                types=args.types,
+                max_value_bytes=args.max_value_bytes,
+                min_ttl=args.min_ttl,
+                replicas=replica_options(args.read_replicas, args.replicas,
+                                         args.replica_max_lag),
+                retries=args.retries,
+                retry_backoff=args.retry_backoff,
+                failure_log=args.failure_log)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            report_profile(profiler, args.profile)
+        stop_metrics()
@@ -0,0 +1,198 @@
+"""
+A reusable copier for programs that run many imports.
+
+copy() works out the restore strategy with an INFO round trip every time it
+is called and hands back one key at a time, once the batch it came in was
+written. A Copier does that setup once and copies a batch per step,
+reporting what happened to each batch, the keys written as well as the
+ones skipped or refused.
+"""
+import time
+from collections import namedtuple
+
+from six import string_types
+
+from .api import (
+    _count_written,
+    _get_restore_handler,
+    _missing,
+    _new_restore,
+    _read_batches,
+    _read_keys,
+    _read_rows,
+)
+from .archive import ArchiveReader, is_archive
+from .metrics import NULL_METRICS
+from .retry import NO_RETRY
+from .throttle import Throttle, payload_bytes
+
+__all__ = ['Copier', 'BatchResult']
+
+BatchResult = namedtuple('BatchResult', [
+    'keys',        # keys written
+    'bytes',       # payload bytes written
+    'skipped',     # keys left alone because they exist in the destination
+    'failed',      # (key, error) for keys the destination refused
+    'read_time',   # seconds spent reading the batch
+    'write_time',  # seconds spent writing it
+])
+
+
+class Copier(object):
+    """
+    Copies sources into one destination with the same settings each time.
+    Errors restoring single keys are reported in the batch results instead
+    of raised, once the retry policy has given up on them.
+
+    :param dst: destination, or None to only list the keys
+    :param pattern: str glob-style or /regex/ key filter
+    :param backfill: bool leave keys that exist in the destination alone
+    :param manifest: redisimp.Manifest
+    :param throttle: redisimp.Throttle
+    :param metrics: redisimp.Metrics
+    :param hot_first: int
+    :param dedup: redisimp.Dedup
+    :param sampler: redisimp.Sampler
+    :param predicate: redisimp.Predicate
+    :param retry: redisimp.Retry
+    """
+
+    def __init__(self, dst, pattern=None, backfill=False, manifest=None,
+                 throttle=None, metrics=None, hot_first=None, dedup=None,
+                 sampler=None, predicate=None, retry=None,
+                 clock=time.time):
+        if hasattr(dst, 'copy_from'):
+            raise TypeError('use copy() to write to %s' % type(dst).__name__)
+        self.dst = dst
+        self.pattern = pattern
+        self.backfill = backfill
+        self.manifest = manifest
+        self.throttle = throttle or Throttle()
+        self.metrics = metrics or NULL_METRICS
+        self.hot_first = hot_first
+        self.dedup = dedup
+        self.sampler = sampler
+        self.predicate = predicate
+        self.retry = retry
+        self._clock = clock
+        self._restore = None
+        if dst is not None:
+            self._restore = _new_restore if backfill else \
+                _get_restore_handler(dst)
+
+    def _live_backfill(self, src):
+        """
+        check which keys exist before reading them at all.
+        """
+        for keys in _read_keys(src, pattern=self.pattern,
+                               metrics=self.metrics, dedup=self.dedup,
+                               sampler=self.sampler, predicate=self.predicate):
+            missing = _missing(self.dst, keys, self.metrics, self.retry)
+            found = set(missing)
+            skipped = [key for key in keys if key not in found]
+            if self.manifest is not None:
+                self.manifest.keep(skipped)
+            rows = []
+            if missing:
+                rows = _read_rows(src, missing, self.throttle, self.manifest,
+                                  self.metrics, predicate=self.predicate,
+                                  dedup=self.dedup)
+            yield rows, skipped
+
+    def _batches(self, src):
+        """
+        yields (rows, skipped keys)
+        """
+        from_file = isinstance(src, string_types + (ArchiveReader,))
+        if self.backfill and not from_file and not self.hot_first:
+            for item in self._live_backfill(src):
+                yield item
+            return
+        for rows in _read_batches(src, self.pattern, self.manifest,
+                                  self.throttle, self.metrics,
+                                  self.hot_first, self.dedup,
+                                  sampler=self.sampler,
+                                  predicate=self.predicate):
+            skipped = []
+            if self.backfill:
+                keys = [row[0] for row in rows]
+                found = set(_missing(self.dst, keys, self.metrics,
+                                     self.retry))
+                skipped = [key for key in keys if key not in found]
+                rows = [row for row in rows if row[0] in found]
+            yield rows, skipped
+
+    def _keys(self, src):
+        """
+        the batches of a dry run. live sources are only scanned.
+        """
+        if isinstance(src, string_types + (ArchiveReader,)):
+            for rows in _read_batches(src, self.pattern, metrics=self.metrics,
+                                      dedup=self.dedup,
+                                      sampler=self.sampler,
+                                      predicate=self.predicate):
+                yield [row[0] for row in rows]
+            return
+        for keys in _read_keys(src, pattern=self.pattern,
+                               metrics=self.metrics, dedup=self.dedup,
+                               sampler=self.sampler, predicate=self.predicate):
+            if self.dedup is not None:
+                keys = self.dedup.filter(keys)
+            yield keys
+
+    def _write(self, rows):
+        """
+        :return: tuple of the rows written, keys skipped and failures
+        """
+        retry = self.retry or NO_RETRY
+        written, skipped, failed = retry.restore(
+            self.dst, rows, self._restore, self.metrics)
+        _count_written(self.metrics, self.dst, written)
+        if self.retry is not None:
+            self.retry.record(failed)
+        return written, skipped, failed
+
+    def copy_batches(self, src):
+        """
+        copy one source.
+        :param src: redis.StrictRedis, or the path to an rdb file or
+            archive, or an ArchiveReader
+        :yield: a BatchResult per batch
+        """
+        if is_archive(src):
+            src = ArchiveReader(src)
+        if self.dst is None:
+            batches = ((keys, []) for keys in self._keys(src))
+        else:
+            batches = self._batches(src)
+        while True:
+            start = self._clock()
+            try:
+                rows, skipped = next(batches)
+            except StopIteration:
+                return
+            read_time = self._clock() - start
+            if self.dst is None:
+                yield BatchResult(rows, 0, [], [], read_time, 0.0)
+                continue
+            if not rows:
+                yield BatchResult([], 0, skipped, [], read_time, 0.0)
+                continue
+
+            self.throttle.write(len(rows), payload_bytes(rows))
+            start = self._clock()
+            written, busy, failed = self._write(rows)
+            yield BatchResult([row[0] for row in written],
+                              payload_bytes(written), skipped + busy, failed,
+                              read_time, self._clock() - start)
+
+    def copy(self, srclist):
+        """
+        copy several sources, in the order the dedup policy asks for.
+        :yield: a BatchResult per batch
+        """
+        if self.dedup is not None:
+            srclist = self.dedup.order(srclist)
+        for src in srclist:
+            for result in self.copy_batches(src):
+                yield result
@@ -0,0 +1,349 @@
+"""
+Decode DUMP payloads into their elements.
+
+Covers strings, lists, sets, sorted sets and hashes in every encoding redis
+has used for them up to 7.2: plain, zipmap, ziplist, intset, quicklist and
+listpack. Streams and module types can't be decoded and raise
+UnsupportedPayload.
+"""
+import struct
+from io import BytesIO
+
+from .rdbparser import (
+    lzf_decompress,
+    REDIS_RDB_6BITLEN,
+    REDIS_RDB_14BITLEN,
+    REDIS_RDB_32BITLEN,
+    REDIS_RDB_64BITLEN,
+    REDIS_RDB_ENCVAL,
+    REDIS_RDB_ENC_INT8,
+    REDIS_RDB_ENC_INT16,
+    REDIS_RDB_ENC_INT32,
+    REDIS_RDB_ENC_LZF,
+    REDIS_RDB_TYPE_STRING,
+    REDIS_RDB_TYPE_LIST,
+    REDIS_RDB_TYPE_SET,
+    REDIS_RDB_TYPE_ZSET,
+    REDIS_RDB_TYPE_HASH,
+    REDIS_RDB_TYPE_ZSET_2,
+    REDIS_RDB_TYPE_HASH_ZIPMAP,
+    REDIS_RDB_TYPE_LIST_ZIPLIST,
+    REDIS_RDB_TYPE_SET_INTSET,
+    REDIS_RDB_TYPE_ZSET_ZIPLIST,
+    REDIS_RDB_TYPE_HASH_ZIPLIST,
+    REDIS_RDB_TYPE_LIST_QUICKLIST,
+)
+
+__all__ = ['decode_payload', 'UnsupportedPayload']
+
+REDIS_RDB_TYPE_HASH_LISTPACK = 16
+REDIS_RDB_TYPE_ZSET_LISTPACK = 17
+REDIS_RDB_TYPE_LIST_QUICKLIST_2 = 18
+REDIS_RDB_TYPE_SET_LISTPACK = 20
+
+QUICKLIST_NODE_CONTAINER_PLAIN = 1
+
+TYPE_NAMES = {
+    REDIS_RDB_TYPE_STRING: 'string',
+    REDIS_RDB_TYPE_LIST: 'list',
+    REDIS_RDB_TYPE_LIST_ZIPLIST: 'list',
+    REDIS_RDB_TYPE_LIST_QUICKLIST: 'list',
+    REDIS_RDB_TYPE_LIST_QUICKLIST_2: 'list',
+    REDIS_RDB_TYPE_SET: 'set',
+    REDIS_RDB_TYPE_SET_INTSET: 'set',
+    REDIS_RDB_TYPE_SET_LISTPACK: 'set',
+    REDIS_RDB_TYPE_ZSET: 'zset',
+    REDIS_RDB_TYPE_ZSET_2: 'zset',
+    REDIS_RDB_TYPE_ZSET_ZIPLIST: 'zset',
+    REDIS_RDB_TYPE_ZSET_LISTPACK: 'zset',
+    REDIS_RDB_TYPE_HASH: 'hash',
+    REDIS_RDB_TYPE_HASH_ZIPMAP: 'hash',
+    REDIS_RDB_TYPE_HASH_ZIPLIST: 'hash',
+    REDIS_RDB_TYPE_HASH_LISTPACK: 'hash',
+}
+
+
+class UnsupportedPayload(Exception):
+    pass
+
+
+def _read(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise UnsupportedPayload('truncated payload')
+    return data
+
+
+def _read_length(f):
+    """
+    :return: tuple of the length and whether it is a special encoding
+    """
+    first = _read(f, 1)[0]
+    enc_type = (first & 0xC0) >> 6
+    if enc_type == REDIS_RDB_ENCVAL:
+        return first & 0x3F, True
+    if enc_type == REDIS_RDB_6BITLEN:
+        return first & 0x3F, False
+    if enc_type == REDIS_RDB_14BITLEN:
+        return ((first & 0x3F) << 8) | _read(f, 1)[0], False
+    if first == REDIS_RDB_32BITLEN:
+        return struct.unpack('>I', _read(f, 4))[0], False
+    if first == REDIS_RDB_64BITLEN:
+        return struct.unpack('>Q', _read(f, 8))[0], False
+    raise UnsupportedPayload('bad length encoding %d' % first)
+
+
+def _read_string(f):
+    length, encoded = _read_length(f)
+    if not encoded:
+        return _read(f, length)
+    if length == REDIS_RDB_ENC_INT8:
+        return b'%d' % struct.unpack('b', _read(f, 1))[0]
+    if length == REDIS_RDB_ENC_INT16:
+        return b'%d' % struct.unpack('<h', _read(f, 2))[0]
+    if length == REDIS_RDB_ENC_INT32:
+        return b'%d' % struct.unpack('<i', _read(f, 4))[0]
+    if length == REDIS_RDB_ENC_LZF:
+        clen = _read_length(f)[0]
+        ulen = _read_length(f)[0]
+        return lzf_decompress(_read(f, clen), ulen)
+    raise UnsupportedPayload('bad string encoding %d' % length)
+
+
+def _read_float(f):
+    length = _read(f, 1)[0]
+    if length == 253:
+        return b'nan'
+    if length == 254:
+        return b'inf'
+    if length == 255:
+        return b'-inf'
+    return _read(f, length)
+
+
+def _format_double(value):
+    return repr(value).encode('ascii')
+
+
+def _ziplist(data):
+    """
+    yields the entries of a ziplist as bytes.
+    """
+    pos = 10
+    while data[pos] != 0xFF:
+        pos += 5 if data[pos] == 0xFE else 1
+        enc = data[pos]
+        kind = enc >> 6
+        if kind == 0:
+            pos += 1
+            n = enc & 0x3F
+        elif kind == 1:
+            n = ((enc & 0x3F) << 8) | data[pos + 1]
+            pos += 2
+        elif kind == 2:
+            n = struct.unpack_from('>I', data, pos + 1)[0]
+            pos += 5
+        else:
+            pos += 1
+            if enc == 0xC0:
+                value = struct.unpack_from('<h', data, pos)[0]
+                pos += 2
+            elif enc == 0xD0:
+                value = struct.unpack_from('<i', data, pos)[0]
+                pos += 4
+            elif enc == 0xE0:
+                value = struct.unpack_from('<q', data, pos)[0]
+                pos += 8
+            elif enc == 0xF0:
+                value = struct.unpack('<i', b'\x00' + data[pos:pos + 3])[0]
+                value >>= 8
+                pos += 3
+            elif enc == 0xFE:
+                value = struct.unpack_from('<b', data, pos)[0]
+                pos += 1
+            else:
+                value = (enc & 0x0F) - 1
+            yield b'%d' % value
+            continue
+        yield data[pos:pos + n]
+        pos += n
+
+
+def _backlen_size(n):
+    # the same bounds as lpEncodeBacklen in redis
+    if n <= 127:
+        return 1
+    if n < 16383:
+        return 2
+    if n < 2097151:
+        return 3
+    if n < 268435455:
+        return 4
+    return 5
+
+
+def _listpack(data):
+    """
+    yields the entries of a listpack as bytes.
+    """
+    pos = 6
+    while data[pos] != 0xFF:
+        start = pos
+        enc = data[pos]
+        value = None
+        if enc & 0x80 == 0:
+            value = enc & 0x7F
+            pos += 1
+        elif enc & 0xC0 == 0x80:
+            n = enc & 0x3F
+            pos += 1 + n
+            value = data[start + 1:pos]
+        elif enc & 0xE0 == 0xC0:
+            value = ((enc & 0x1F) << 8) | data[pos + 1]
+            if value >= 1 << 12:
+                value -= 1 << 13
+            pos += 2
+        elif enc & 0xF0 == 0xE0:
+            n = ((enc & 0x0F) << 8) | data[pos + 1]
+            pos += 2 + n
+            value = data[start + 2:pos]
+        elif enc == 0xF0:
+            n = struct.unpack_from('<I', data, pos + 1)[0]
+            pos += 5 + n
+            value = data[start + 5:pos]
+        elif enc == 0xF1:
+            value = struct.unpack_from('<h', data, pos + 1)[0]
+            pos += 3
+        elif enc == 0xF2:
+            value = struct.unpack('<i', b'\x00' + data[pos + 1:pos + 4])[0]
+            value >>= 8
+            pos += 4
+        elif enc == 0xF3:
+            value = struct.unpack_from('<i', data, pos + 1)[0]
+            pos += 5
+        elif enc == 0xF4:
+            value = struct.unpack_from('<q', data, pos + 1)[0]
+            pos += 9
+        else:
+            raise UnsupportedPayload('bad listpack encoding %d' % enc)
+        pos += _backlen_size(pos - start)
+        yield value if isinstance(value, bytes) else b'%d' % value
+
+
+def _intset(data):
+    size, count = struct.unpack_from('<II', data, 0)
+    fmt = {2: '<h', 4: '<i', 8: '<q'}[size]
+    for i in range(count):
+        yield b'%d' % struct.unpack_from(fmt, data, 8 + i * size)[0]
+
+
+def _zipmap(data):
+    def length(pos):
+        if data[pos] < 254:
+            return data[pos], pos + 1
+        return struct.unpack_from('<I', data, pos + 1)[0], pos + 5
+
+    pos = 1
+    while data[pos] != 0xFF:
+        n, pos = length(pos)
+        field = data[pos:pos + n]
+        pos += n
+        n, pos = length(pos)
+        free = data[pos]
+        pos += 1
+        yield field, data[pos:pos + n]
+        pos += n + free
+
+
+def _pairs(items):
+    items = iter(items)
+    for first in items:
+        yield first, next(items)
+
+
+def _strings(f):
+    for _ in range(_read_length(f)[0]):
+        yield _read_string(f)
+
+
+def _string_pairs(f):
+    for _ in range(_read_length(f)[0]):
+        field = _read_string(f)
+        yield field, _read_string(f)
+
+
+def _zset(f):
+    for _ in range(_read_length(f)[0]):
+        member = _read_string(f)
+        yield member, _read_float(f)
+
+
+def _zset_2(f):
+    for _ in range(_read_length(f)[0]):
+        member = _read_string(f)
+        score = struct.unpack('<d', _read(f, 8))[0]
+        yield member, _format_double(score)
+
+
+def _quicklist(f):
+    for _ in range(_read_length(f)[0]):
+        for item in _ziplist(_read_string(f)):
+            yield item
+
+
+def _quicklist_2(f):
+    for _ in range(_read_length(f)[0]):
+        container = _read_length(f)[0]
+        if container == QUICKLIST_NODE_CONTAINER_PLAIN:
+            yield _read_string(f)
+            continue
+        for item in _listpack(_read_string(f)):
+            yield item
+
+
+def _encoded(decode, pairs=False):
+    """
+    a reader for types stored as a single encoded string.
+    """
+    def read(f):
+        items = decode(_read_string(f))
+        return _pairs(items) if pairs else items
+    return read
+
+
+READERS = {
+    REDIS_RDB_TYPE_LIST: _strings,
+    REDIS_RDB_TYPE_SET: _strings,
+    REDIS_RDB_TYPE_ZSET: _zset,
+    REDIS_RDB_TYPE_ZSET_2: _zset_2,
+    REDIS_RDB_TYPE_HASH: _string_pairs,
+    REDIS_RDB_TYPE_HASH_ZIPMAP: _encoded(_zipmap),
+    REDIS_RDB_TYPE_LIST_ZIPLIST: _encoded(_ziplist),
+    REDIS_RDB_TYPE_SET_INTSET: _encoded(_intset),
+    REDIS_RDB_TYPE_ZSET_ZIPLIST: _encoded(_ziplist, pairs=True),
+    REDIS_RDB_TYPE_HASH_ZIPLIST: _encoded(_ziplist, pairs=True),
+    REDIS_RDB_TYPE_ZSET_LISTPACK: _encoded(_listpack, pairs=True),
+    REDIS_RDB_TYPE_HASH_LISTPACK: _encoded(_listpack, pairs=True),
+    REDIS_RDB_TYPE_SET_LISTPACK: _encoded(_listpack),
+    REDIS_RDB_TYPE_LIST_QUICKLIST: _quicklist,
+    REDIS_RDB_TYPE_LIST_QUICKLIST_2: _quicklist_2,
+}
+
+
+def decode_payload(data):
+    """
+    :param data: bytes a DUMP payload
+    :return: tuple of the type name and an iterator over its elements.
+        strings yield their value once, lists and sets yield members,
+        zsets yield (member, score) and hashes (field, value).
+    :raises UnsupportedPayload: for types that can't be decoded
+    """
+    enc_type = data[0]
+    name = TYPE_NAMES.get(enc_type)
+    if name is None:
+        raise UnsupportedPayload('type %d can not be decoded' % enc_type)
+    f = BytesIO(data)
+    f.seek(1)
+    if enc_type == REDIS_RDB_TYPE_STRING:
+        return name, iter([_read_string(f)])
+    return name, READERS[enc_type](f)
@@ -0,0 +1,171 @@
+"""
+Skip keys that were already copied, across sources and SCAN repeats.
+
+When overlapping sources are merged, every copy of a key is read, sent and
+restored, and only the last one survives. Dedup remembers the 64 bit
+fingerprint of each key it lets through, so later copies are dropped before
+they are DUMPed or their payload is parsed. A key only counts as let
+through once its row has passed every other check and is about to be
+written, so a copy left out of one source for its type, size or ttl, or
+because it expired before it was read, doesn't keep the copy in the next
+source out as well.
+
+The fingerprints live in an open addressing hash table in a flat
+array('Q'), 8 bytes per slot and no per key objects. The table doubles
+when it is 3/4 full, so a key costs 11 to 21 bytes and 500 million keys
+take a table of 2^30 slots, 8GB. While it doubles the old table is held
+next to the new one, so growing into that 8GB table peaks at 12GB. Pass
+`expected_keys` to size it once up front and it never grows. Two keys
+share a fingerprint with a probability of about n^2 / 2^65, roughly one
+in 150 at 500 million keys, in which case the second is skipped.
+"""
+from array import array
+
+from .fingerprint import key_fingerprint
+
+__all__ = ['Dedup', 'FingerprintSet', 'POLICIES']
+
+POLICIES = ('first', 'last')
+
+MAX_LOAD = 0.75
+
+
+def fingerprint(key):
+    """
+    :param key: bytes or str
+    :return: int a non zero 64 bit hash
+    """
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    # zero marks an empty slot
+    return key_fingerprint(key) or 1
+
+
+class FingerprintSet(object):
+    """
+    A set of keys that only stores their fingerprints.
+
+    :param expected_keys: int how many keys to make room for up front
+    """
+
+    def __init__(self, expected_keys=1 << 16):
+        size = 16
+        while size * MAX_LOAD < expected_keys:
+            size *= 2
+        self._allocate(size)
+        self._len = 0
+
+    def _allocate(self, size):
+        self._table = array('Q', bytes(8 * size))
+        self._mask = size - 1
+        self._limit = int(size * MAX_LOAD)
+
+    def _insert(self, fp):
+        table = self._table
+        mask = self._mask
+        i = fp & mask
+        while True:
+            slot = table[i]
+            if slot == 0:
+                table[i] = fp
+                return True
+            if slot == fp:
+                return False
+            i = (i + 1) & mask
+
+    def _grow(self):
+        old = self._table
+        self._allocate(len(old) * 2)
+        for fp in old:
+            if fp:
+                self._insert(fp)
+
+    def add(self, key):
+        """
+        :return: bool whether the key is new
+        """
+        if self._len >= self._limit:
+            self._grow()
+        if self._insert(fingerprint(key)):
+            self._len += 1
+            return True
+        return False
+
+    def __contains__(self, key):
+        fp = fingerprint(key)
+        table = self._table
+        i = fp & self._mask
+        while table[i]:
+            if table[i] == fp:
+                return True
+            i = (i + 1) & self._mask
+        return False
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def nbytes(self):
+        return len(self._table) * self._table.itemsize
+
+
+class Dedup(object):
+    """
+    Lets each key through once. Pass one to copy() or multi_copy().
+
+    :param policy: str `first` keeps the copy of a key from the first source
+        that has it, `last` the one from the last source, which is how a
+        plain merge would end up. multi_copy() reads the sources in reverse
+        for `last`.
+    :param expected_keys: int
+    """
+
+    def __init__(self, policy='first', expected_keys=1 << 16):
+        if policy not in POLICIES:
+            raise ValueError('unknown dedup policy %s' % policy)
+        self.policy = policy
+        self.seen = FingerprintSet(expected_keys)
+        self.skipped = 0
+
+    def order(self, sources):
+        """
+        :return: list of the sources in the order to copy them
+        """
+        sources = list(sources)
+        if self.policy == 'last':
+            sources.reverse()
+        return sources
+
+    def is_new(self, key):
+        """
+        the check made before a key is read. it isn't marked as seen.
+        :return: bool whether the key may still be copied
+        """
+        if key in self.seen:
+            self.skipped += 1
+            return False
+        return True
+
+    def unseen(self, keys):
+        return [key for key in keys if self.is_new(key)]
+
+    def add(self, key):
+        """
+        mark the key as let through.
+        :return: bool whether the key should be copied
+        """
+        if self.seen.add(key):
+            return True
+        self.skipped += 1
+        return False
+
+    def filter(self, keys):
+        return [key for key in keys if self.add(key)]
+
+    def accept(self, rows):
+        """
+        mark the keys of rows that are about to be written as let through.
+        :param rows: list of (key, data, pttl)
+        :return: list of the rows whose key wasn't let through before
+        """
+        return [row for row in rows if self.add(row[0])]
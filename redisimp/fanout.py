@@ -0,0 +1,154 @@
+"""
+Copy one source into several destinations with a single read.
+
+Batches are read once and handed to a thread per destination through a
+bounded queue. Each destination restores with its own handler and backfill
+check, so an error in one doesn't stop the others. A destination that
+stays too far behind for longer than `stall_timeout` is detached instead
+of holding up the rest.
+"""
+import threading
+
+from six.moves.queue import Queue, Full
+
+from .api import (
+    _read_batches,
+    _conn_name,
+    _get_restore_handler,
+    _missing,
+    _restore_new,
+    _restore_rows,
+)
+from .metrics import NULL_METRICS
+from .progress import NULL_PROGRESS
+from .throttle import Throttle, payload_bytes
+
+__all__ = ['FanOut', 'FanOutError']
+
+
+class FanOutError(Exception):
+    """
+    Raised when the copy finished but some destinations failed.
+    `failures` maps the destination name to its error.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        super(FanOutError, self).__init__(
+            '%d destinations failed: %s' % (len(failures), ', '.join(
+                '%s (%s)' % (name, error)
+                for name, error in sorted(failures.items()))))
+
+
+class StalledError(Exception):
+    pass
+
+
+class _Destination(threading.Thread):
+    def __init__(self, conn, buffer_batches):
+        super(_Destination, self).__init__()
+        self.daemon = True
+        self.conn = conn
+        self.name = _conn_name(conn)
+        self.queue = Queue(maxsize=buffer_batches)
+        self.error = None
+        self._restore = None
+
+    def _clobber(self, rows, metrics, retry):
+        if self._restore is None:
+            self._restore = _get_restore_handler(self.conn)
+        _restore_rows(self.conn, rows, self._restore, metrics, retry)
+
+    def _backfill(self, rows, metrics, retry):
+        missing = set(_missing(self.conn, [row[0] for row in rows], metrics,
+                               retry))
+        rows = [row for row in rows if row[0] in missing]
+        if rows:
+            _restore_new(self.conn, rows, metrics, retry)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # keep draining so the reader never blocks on us
+                continue
+            rows, backfill, metrics, retry = item
+            try:
+                if backfill:
+                    self._backfill(rows, metrics, retry)
+                else:
+                    self._clobber(rows, metrics, retry)
+            except Exception as e:
+                self.error = e
+
+
+class FanOut(object):
+    """
+    A destination made of several destinations. Pass it to copy() or
+    multi_copy() like any other and call close() when done, which waits
+    for every destination to catch up and raises FanOutError if any of
+    them failed.
+
+    :param dsts: list of destinations
+    :param buffer_batches: int how many batches a destination may fall
+        behind before the reader waits for it
+    :param stall_timeout: float seconds the reader waits on a full buffer
+        before detaching that destination
+    """
+
+    def __init__(self, dsts, buffer_batches=8, stall_timeout=30.0):
+        self.dsts = list(dsts)
+        self.name = ','.join(_conn_name(dst) for dst in self.dsts)
+        self.stall_timeout = stall_timeout
+        self._workers = [_Destination(dst, buffer_batches)
+                         for dst in self.dsts]
+        for worker in self._workers:
+            worker.start()
+
+    def _put(self, worker, item, metrics):
+        if worker.error is not None:
+            return
+        try:
+            worker.queue.put(item, timeout=self.stall_timeout)
+        except Full:
+            metrics.incr('fanout_stalls', worker.name)
+            worker.error = StalledError(
+                'more than %d batches behind for %ss' % (
+                    worker.queue.maxsize, self.stall_timeout))
+
+    def copy_from(self, src, pattern=None, backfill=False, manifest=None,
+                  throttle=None, metrics=NULL_METRICS, hot_first=None,
+                  dedup=None, progress=NULL_PROGRESS, sampler=None,
+                  predicate=None, retry=None):
+        """
+        yields the keys it reads as it goes.
+        """
+        throttle = throttle or Throttle()
+        for rows in _read_batches(src, pattern, manifest, throttle, metrics,
+                                  hot_first, dedup, progress, sampler,
+                                  predicate):
+            throttle.write(len(rows), payload_bytes(rows))
+            item = (rows, backfill, metrics, retry)
+            for worker in self._workers:
+                self._put(worker, item, metrics)
+            for row in rows:
+                yield row[0]
+
+    def close(self):
+        """
+        wait for the destinations to finish writing.
+        :raises FanOutError: if any destination failed
+        """
+        for worker in self._workers:
+            if worker.error is None:
+                worker.queue.put(None)
+                worker.join()
+            elif not isinstance(worker.error, StalledError):
+                # it only drains, so there is room
+                worker.queue.put(None)
+        failures = {w.name: w.error for w in self._workers
+                    if w.error is not None}
+        if failures:
+            raise FanOutError(failures)
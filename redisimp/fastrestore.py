@@ -0,0 +1,285 @@
+"""
+Send RESTORE commands without copying the payloads.
+
+redis-py encodes every argument of a pipelined command into one string
+before writing it, so each multi-MB DUMP payload gets copied and joined
+again on its way to the socket. FastRestore builds the RESP headers itself
+and hands the payloads to `socket.sendmsg` as they are, then reads the
+replies with a minimal parser. Anything it doesn't handle, like error
+replies, cluster redirections or connection errors, is replayed through
+the wrapped redis-py connection.
+"""
+import socket
+
+from .api import _is_cluster
+from .resp import _to_bytes, CRLF
+
+__all__ = ['FastRestore', 'fast_restore']
+
+# arguments at least this big go to sendmsg as their own buffer, smaller
+# ones are cheaper to copy into the header.
+MIN_ZERO_COPY = 16 * 1024
+
+try:
+    IOV_MAX = min(socket.sysconf('SC_IOV_MAX'), 1024)
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+
+
+def _pack(args, buffers):
+    """
+    append the buffers for one command, keeping large arguments as they are.
+    """
+    header = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        arg = _to_bytes(arg)
+        if len(arg) < MIN_ZERO_COPY:
+            header.append(b'$%d\r\n' % len(arg))
+            header.append(arg)
+            header.append(CRLF)
+            continue
+        header.append(b'$%d\r\n' % len(arg))
+        buffers.append(b''.join(header))
+        buffers.append(arg)
+        header = [CRLF]
+    buffers.append(b''.join(header))
+
+
+def _is_redirect(error):
+    return str(error).split(' ', 1)[0] in ('MOVED', 'ASK', 'TRYAGAIN')
+
+
+def _sendall(sock, buffers):
+    """
+    write all the buffers, at most IOV_MAX per syscall, picking up after
+    partial writes.
+    """
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return
+
+    buffers = [memoryview(b) for b in buffers]
+    i = 0
+    while i < len(buffers):
+        sent = sock.sendmsg(buffers[i:i + IOV_MAX])
+        while sent:
+            size = buffers[i].nbytes
+            if sent < size:
+                buffers[i] = buffers[i][sent:]
+                break
+            sent -= size
+            i += 1
+
+
+class ReplyReader(object):
+    """
+    Just enough of a RESP2 parser for the replies of a pipeline.
+    """
+
+    def __init__(self, sock, chunk_size=1 << 16):
+        from redis.exceptions import ResponseError
+        self.sock = sock
+        self.chunk_size = chunk_size
+        self._buf = bytearray()
+        self._pos = 0
+        self._error = ResponseError
+
+    def _fill(self):
+        data = self.sock.recv(self.chunk_size)
+        if not data:
+            raise ConnectionError('connection closed by server')
+        if self._pos:
+            del self._buf[:self._pos]
+            self._pos = 0
+        self._buf += data
+
+    def _line(self):
+        while True:
+            end = self._buf.find(CRLF, self._pos)
+            if end >= 0:
+                line = bytes(self._buf[self._pos:end])
+                self._pos = end + 2
+                return line
+            self._fill()
+
+    def _exactly(self, n):
+        while len(self._buf) - self._pos < n + 2:
+            self._fill()
+        data = bytes(self._buf[self._pos:self._pos + n])
+        self._pos += n + 2
+        return data
+
+    def read(self):
+        """
+        :return: the reply, error replies as a ResponseError
+        """
+        line = self._line()
+        kind, rest = line[:1], line[1:]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            return self._error(rest.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            n = int(rest)
+            return None if n < 0 else self._exactly(n)
+        if kind == b'*':
+            n = int(rest)
+            return None if n < 0 else [self.read() for _ in range(n)]
+        raise ConnectionError('protocol error: %r' % line)
+
+
+class FastRestore(object):
+    """
+    A destination wrapping a standalone redis connection. Pipelines write
+    straight to a socket of their own; everything else is passed through to
+    the wrapped connection.
+    """
+
+    def __init__(self, conn):
+        from .api import _supports_replace
+        self.conn = conn
+        self.supports_replace = _supports_replace(conn)
+        self._sock = None
+        self._reader = None
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def _connect(self):
+        kwargs = self.conn.connection_pool.connection_kwargs
+        timeout = kwargs.get('socket_timeout')
+        if 'path' in kwargs:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(kwargs['path'])
+        else:
+            sock = socket.create_connection(
+                (kwargs.get('host', 'localhost'), kwargs.get('port', 6379)),
+                kwargs.get('socket_connect_timeout') or timeout)
+            sock.settimeout(timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._reader = ReplyReader(sock)
+
+        commands = []
+        if kwargs.get('password'):
+            if kwargs.get('username'):
+                commands.append(('AUTH', kwargs['username'],
+                                 kwargs['password']))
+            else:
+                commands.append(('AUTH', kwargs['password']))
+        if kwargs.get('db'):
+            commands.append(('SELECT', kwargs['db']))
+        for reply in self._send(commands):
+            if isinstance(reply, Exception):
+                self.close()
+                raise reply
+
+    def _send(self, commands):
+        if not commands:
+            return []
+        if self._sock is None:
+            self._connect()
+        buffers = []
+        for args in commands:
+            _pack(args, buffers)
+        try:
+            _sendall(self._sock, buffers)
+            return [self._reader.read() for _ in commands]
+        except (socket.error, ConnectionError):
+            self.close()
+            raise
+
+    def execute(self, commands, raise_on_error=True):
+        """
+        send the commands in one round trip.
+        :param commands: list of argument tuples
+        :param raise_on_error: bool
+        :return: list of replies
+        """
+        try:
+            results = self._send(commands)
+        except (socket.error, ConnectionError):
+            # let redis-py reconnect and retry the whole batch
+            return self._fallback(commands, raise_on_error)
+
+        # errors are handed to redis-py to raise with its own exception
+        # types. without raise_on_error only redirections need a replay.
+        failed = [i for i, r in enumerate(results)
+                  if isinstance(r, Exception)]
+        if not raise_on_error:
+            failed = [i for i in failed if _is_redirect(results[i])]
+        if failed:
+            replies = self._fallback([commands[i] for i in failed],
+                                     raise_on_error)
+            for i, reply in zip(failed, replies):
+                results[i] = reply
+        return results
+
+    def _fallback(self, commands, raise_on_error):
+        pipe = self.conn.pipeline(transaction=False)
+        for args in commands:
+            pipe.execute_command(*args)
+        return pipe.execute(raise_on_error=raise_on_error)
+
+    def pipeline(self, transaction=False):
+        return FastRestorePipeline(self)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+                self._reader = None
+
+
+class FastRestorePipeline(object):
+    """
+    Just enough of the redis pipeline interface for the copy functions.
+    """
+
+    def __init__(self, fast):
+        self.fast = fast
+        self._commands = []
+
+    def execute_command(self, *args, **options):
+        self._commands.append(args)
+        return self
+
+    def restore(self, name, ttl, value, replace=False, **kwargs):
+        args = ('RESTORE', name, ttl, value)
+        if replace:
+            args += ('REPLACE',)
+        return self.execute_command(*args)
+
+    def exists(self, *names):
+        return self.execute_command('EXISTS', *names)
+
+    def delete(self, *names):
+        return self.execute_command('DEL', *names)
+
+    def execute(self, raise_on_error=True):
+        commands, self._commands = self._commands, []
+        return self.fast.execute(commands, raise_on_error)
+
+
+def fast_restore(conn):
+    """
+    wrap a destination in FastRestore if it can be, otherwise return it as
+    it is. clusters, tls connections and anything that isn't a plain redis
+    connection keep using redis-py.
+    :param conn: destination
+    :return: FastRestore or conn
+    """
+    if _is_cluster(conn) or isinstance(conn, FastRestore):
+        return conn
+    pool = getattr(conn, 'connection_pool', None)
+    if pool is None:
+        return conn
+    from redis.connection import SSLConnection
+    if issubclass(pool.connection_class, SSLConnection):
+        return conn
+    return FastRestore(conn)
@@ -0,0 +1,26 @@
+"""
+Cheap 64-bit fingerprints for keys and DUMP payloads.
+"""
+import struct
+import hashlib
+
+__all__ = ['key_fingerprint', 'payload_crc']
+
+
+def key_fingerprint(key):
+    """
+    a stable 64-bit hash of the key bytes.
+    :param key: bytes
+    :return: int
+    """
+    return struct.unpack('<Q', hashlib.blake2b(key, digest_size=8).digest())[0]
+
+
+def payload_crc(data):
+    """
+    every DUMP payload ends with the crc64 of everything before it, so we
+    get a fingerprint of the value for free.
+    :param data: bytes
+    :return: int
+    """
+    return struct.unpack('<Q', data[-8:])[0]
@@ -0,0 +1,86 @@
+"""
+Rank keys by how often they are used, to copy the hottest ones first.
+
+When traffic moves to the destination before the copy has finished, the
+keys it asks for first should already be there. A first pass over the
+source ranks every key by the lfu counter (OBJECT FREQ) or, under an lru
+policy, by how long it has been idle (OBJECT IDLETIME). For rdb files the
+same numbers come from the IDLE and FREQ opcodes redis saves with each key
+when an lru or lfu maxmemory-policy is set.
+
+Only the `size` hottest keys are kept, in a heap, so memory stays bounded
+however large the source is. They are copied first, hottest first, then a
+second pass streams the cold rest in source order.
+"""
+import heapq
+
+__all__ = ['HotKeys', 'live_hotness']
+
+COLD = float('-inf')
+
+
+class HotKeys(object):
+    """
+    The `size` hottest keys seen so far, with an optional row each.
+    Keys without a hotness rank below every key that has one, and of keys
+    that are equally hot the ones seen first are kept.
+
+    :param size: int how many keys to keep
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.keys = set()
+        self._heap = []
+        self._seen = 0
+
+    def add(self, key, hotness, row=None):
+        self._seen += 1
+        item = (COLD if hotness is None else hotness, -self._seen, key, row)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            self.keys.discard(heapq.heapreplace(self._heap, item)[2])
+        else:
+            return
+        self.keys.add(key)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self._heap)
+
+    def hottest(self):
+        """
+        :return: list of (key, row), hottest first
+        """
+        return [(key, row) for _, _, key, row in
+                sorted(self._heap, reverse=True)]
+
+
+def live_hotness(src, keys):
+    """
+    :param src: redis.StrictRedis
+    :param keys: list of keys
+    :return: list with the hotness of each key: its lfu counter, or minus
+        its idle seconds if the server doesn't count frequency, or None if
+        the key is gone
+    """
+    # only the primary sees the traffic, replicas keep their own counts
+    pipe = getattr(src, 'primary', src).pipeline(transaction=False)
+    for key in keys:
+        # only one of the two works, depending on the maxmemory-policy
+        pipe.execute_command('OBJECT', 'FREQ', key)
+        pipe.execute_command('OBJECT', 'IDLETIME', key)
+    replies = pipe.execute(raise_on_error=False)
+    result = []
+    for i in range(len(keys)):
+        freq, idle = replies[i * 2], replies[i * 2 + 1]
+        if isinstance(freq, int):
+            result.append(freq)
+        elif isinstance(idle, int):
+            result.append(-idle)
+        else:
+            result.append(None)
+    return result
@@ -0,0 +1,141 @@
+"""
+Remember what the last import wrote so the next one only restores the keys
+that changed.
+
+The manifest file is a small header followed by sorted pairs of
+(key fingerprint, payload crc64), each stored as a little-endian uint64.
+"""
+import os
+import sys
+import struct
+from array import array
+
+from .fingerprint import key_fingerprint, payload_crc
+
+__all__ = ['Manifest']
+
+MANIFEST_MAGIC = b'RIMPMAN1'
+
+
+class Manifest(object):
+    """
+    Tracks (key fingerprint -> payload crc) pairs between runs.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.previous = self._load()
+        self.current = {}
+
+    def _load(self):
+        if not os.path.exists(self.filename):
+            return {}
+
+        with open(self.filename, 'rb') as f:
+            if f.read(len(MANIFEST_MAGIC)) != MANIFEST_MAGIC:
+                raise Exception('manifest',
+                                'Invalid manifest file %s' % self.filename)
+            count = struct.unpack('<Q', f.read(8))[0]
+            pairs = array('Q')
+            pairs.fromfile(f, count * 2)
+
+        if sys.byteorder != 'little':
+            pairs.byteswap()
+        return dict(zip(pairs[0::2], pairs[1::2]))
+
+    def changed(self, key, data):
+        """
+        record the fingerprint of the key and report if it differs from the
+        one written by the previous import.
+        :param key: bytes
+        :param data: bytes the DUMP payload
+        :return: bool
+        """
+        fp = key_fingerprint(key)
+        crc = payload_crc(data)
+        self.current[fp] = crc
+        return self.previous.get(fp) != crc
+
+    def keep(self, keys):
+        """
+        carry the fingerprints of keys this run saw but didn't read, like
+        the ones a backfill left alone in the destination, over from the
+        previous import, so they aren't taken for stale.
+        :param keys: iterable of bytes
+        """
+        for key in keys:
+            fp = key_fingerprint(key)
+            crc = self.previous.get(fp)
+            if crc is not None:
+                self.current[fp] = crc
+
+    def filter(self, rows):
+        """
+        only pass along the rows whose payload changed since the last import.
+        :param rows: iterable of (key, data, pttl)
+        :return: generator
+        """
+        for row in rows:
+            if self.changed(row[0], row[1]):
+                yield row
+
+    def stale(self):
+        """
+        fingerprints of keys imported last time but not seen in this run.
+        :return: set
+        """
+        return set(self.previous).difference(self.current)
+
+    def delete_stale(self, dst, batch_size=500):
+        """
+        delete the keys from the destination that were written by the
+        previous import but are missing from this one.
+        yields the keys it deletes as it goes.
+        :param dst: redis.StrictRedis or redis.RedisCluster
+        :param batch_size: int
+        :return: generator
+        """
+        stale = self.stale()
+        if not stale:
+            return
+
+        batch = []
+        for key in dst.scan_iter(count=batch_size):
+            if key_fingerprint(key) in stale:
+                batch.append(key)
+            if len(batch) >= batch_size:
+                for key in self._delete(dst, batch):
+                    yield key
+                batch = []
+
+        for key in self._delete(dst, batch):
+            yield key
+
+    @staticmethod
+    def _delete(dst, keys):
+        if not keys:
+            return []
+        pipe = dst.pipeline(transaction=False)
+        for key in keys:
+            pipe.delete(key)
+        pipe.execute()
+        return keys
+
+    def save(self):
+        """
+        write the fingerprints seen in this run, replacing the old manifest.
+        """
+        pairs = array('Q')
+        for fp in sorted(self.current):
+            pairs.append(fp)
+            pairs.append(self.current[fp])
+
+        if sys.byteorder != 'little':
+            pairs.byteswap()
+
+        tmp = '%s.tmp' % self.filename
+        with open(tmp, 'wb') as f:
+            f.write(MANIFEST_MAGIC)
+            f.write(struct.pack('<Q', len(self.current)))
+            pairs.tofile(f)
+        os.rename(tmp, self.filename)
@@ -0,0 +1,256 @@
+"""
+Per-phase latency histograms and throughput counters for a copy.
+
+Phases are timed per batch (scan, dump, restore, ...) or per object inside
+the rdb parser (parse, crc, lzf). Counters carry a single label, usually the
+source or destination node they apply to.
+"""
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+__all__ = ['Metrics', 'MetricsReporter', 'serve_metrics']
+
+# upper bounds in seconds, doubling from 10us to ~84s
+BUCKETS = [0.00001 * 2 ** i for i in range(24)]
+
+_now = getattr(time, 'perf_counter', time.time)
+
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        estimate a quantile as the upper bound of the bucket it falls in.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+        return float('inf')
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class NullMetrics(object):
+    """
+    Stand-in used when metrics are off so the hot paths don't need to
+    check for it.
+    """
+    enabled = False
+    _timer = _NullTimer()
+
+    def timer(self, phase):
+        return self._timer
+
+    def observe(self, phase, secs):
+        pass
+
+    def incr(self, name, label=None, n=1):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def timed(metrics, phase, fn):
+    """
+    wrap a function so every call is observed as the given phase.
+    """
+    observe = metrics.observe
+
+    def wrapper(*args, **kwargs):
+        start = _now()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            observe(phase, _now() - start)
+
+    return wrapper
+
+
+class Metrics(object):
+    """
+    Collects phase timings and counters. Safe to read from another thread
+    while a copy is running.
+    """
+    enabled = True
+
+    def __init__(self, clock=time.time):
+        self.histograms = {}
+        self.counters = {}
+        self.started = clock()
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, phase):
+        start = _now()
+        try:
+            yield
+        finally:
+            self.observe(phase, _now() - start)
+
+    def observe(self, phase, secs):
+        with self._lock:
+            h = self.histograms.get(phase)
+            if h is None:
+                h = self.histograms[phase] = Histogram()
+            h.observe(secs)
+
+    def incr(self, name, label=None, n=1):
+        with self._lock:
+            key = (name, label)
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def snapshot(self):
+        """
+        :return: dict suitable for json
+        """
+        with self._lock:
+            counters = {}
+            for (name, label), value in self.counters.items():
+                if label is None:
+                    counters[name] = value
+                else:
+                    counters.setdefault(name, {})[label] = value
+
+            phases = {}
+            for phase, h in sorted(self.histograms.items()):
+                phases[phase] = {
+                    'count': h.count,
+                    'sum': h.sum,
+                    'p50': h.quantile(0.5),
+                    'p99': h.quantile(0.99),
+                }
+
+        return {
+            'time': self._clock(),
+            'elapsed': self._clock() - self.started,
+            'counters': counters,
+            'phases': phases,
+        }
+
+    def prometheus(self):
+        """
+        render everything in the prometheus text exposition format.
+        :return: str
+        """
+        lines = []
+        with self._lock:
+            lines.append('# TYPE redisimp_phase_seconds histogram')
+            for phase, h in sorted(self.histograms.items()):
+                seen = 0
+                for bound, n in zip(BUCKETS, h.counts):
+                    seen += n
+                    lines.append(
+                        'redisimp_phase_seconds_bucket{phase="%s",le="%g"} %d'
+                        % (phase, bound, seen))
+                lines.append(
+                    'redisimp_phase_seconds_bucket{phase="%s",le="+Inf"} %d'
+                    % (phase, h.count))
+                lines.append('redisimp_phase_seconds_sum{phase="%s"} %f'
+                             % (phase, h.sum))
+                lines.append('redisimp_phase_seconds_count{phase="%s"} %d'
+                             % (phase, h.count))
+
+            names = sorted(set(name for name, _ in self.counters))
+            for name in names:
+                lines.append('# TYPE redisimp_%s_total counter' % name)
+                for (n, label), value in sorted(
+                        self.counters.items(), key=lambda x: str(x[0][1])):
+                    if n != name:
+                        continue
+                    if label is None:
+                        lines.append('redisimp_%s_total %d' % (name, value))
+                    else:
+                        lines.append('redisimp_%s_total{node="%s"} %d' % (
+                            name, _escape(label), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(label):
+    if isinstance(label, bytes):
+        label = label.decode('utf-8', 'replace')
+    return label.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class MetricsReporter(threading.Thread):
+    """
+    Writes a json snapshot of the metrics as one line to `out` every
+    `interval` seconds, and once more when stopped.
+    """
+
+    def __init__(self, metrics, out, interval=10.0):
+        super(MetricsReporter, self).__init__()
+        self.daemon = True
+        self.metrics = metrics
+        self.out = out
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def report(self):
+        self.out.write(json.dumps(self.metrics.snapshot(), sort_keys=True))
+        self.out.write('\n')
+        self.out.flush()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.report()
+
+
+def serve_metrics(metrics, port, host='127.0.0.1'):
+    """
+    serve the metrics in prometheus format on http://host:port/metrics from
+    a background thread.
+    :return: HTTPServer call shutdown() on it when done
+    """
+    # http.server is slow to import and only needed with --metrics-port
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+    except ImportError:  # pragma: no cover
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((host, port), Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
@@ -3,16 +3,68 @@ from .api import copy
 __all__ = ['multi_copy']
 
 
-def multi_copy(srclist, dst, pattern=None, backfill=False):
+def _close(src):
+    close = getattr(src, 'close', None)
+    if close is not None:
+        close()
+
+
+def opened_sources(srclist, progress=None):
+    """
+    yields the sources in turn. sources that are functions are called to
+    open them, and what they return is closed before the next one is
+    opened.
+    :param progress: redisimp.Progress started on each source
+    """
+    for src in srclist:
+        opened = src() if callable(src) else src
+        try:
+            if progress is not None:
+                progress.start(opened)
+            yield opened
+        finally:
+            if opened is not src:
+                _close(opened)
+
+
+def multi_copy(srclist, dst, pattern=None, backfill=False, manifest=None,
+               throttle=None, metrics=None, hot_first=None, dedup=None,
+               progress=None, sampler=None, predicate=None, retry=None):
     """
     Same semantics as copy in the api, but copy from a list of sources.
+    With a Dedup each key is copied once, from the first or last source
+    that has it depending on its policy.
+    A source can also be a function that opens it. It is called when the
+    copy gets to that source, and what it returns is closed once that
+    source is done, so only one is open at a time.
+    A Progress is started on each source before it is copied.
     :param pattern:
     :param backfill:
+    :param manifest:
+    :param throttle:
+    :param metrics:
+    :param hot_first:
+    :param dedup:
+    :param progress:
+    :param sampler:
+    :param predicate:
+    :param retry:
     :param srclist:
     :param dst:
     :param worker_count:
     :return:
     """
-    for src in srclist:
-        for key in copy(src, dst, pattern=pattern, backfill=backfill):
-            yield key
+    if dedup is not None:
+        srclist = dedup.order(srclist)
+    sources = opened_sources(srclist, progress)
+    try:
+        for src in sources:
+            for key in copy(src, dst, pattern=pattern, backfill=backfill,
+                            manifest=manifest, throttle=throttle,
+                            metrics=metrics, hot_first=hot_first,
+                            dedup=dedup, progress=progress,
+                            sampler=sampler, predicate=predicate,
+                            retry=retry):
+                yield key
+    finally:
+        sources.close()
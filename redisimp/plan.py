@@ -0,0 +1,403 @@
+"""
+Estimate what a copy will cost before running it.
+
+A Plan reads the sources the way the copy would, without writing anything,
+and works out how many keys and bytes the copy moves, the type mix, the
+largest keys and, for a cluster or client side sharded destination, how
+the bytes spread over its nodes. rdb files and archives give the exact
+DUMP payload size of every key, read past without building the payload.
+Keys of live sources are all scanned, but only a sample of them, 1% by
+default, is sized with MEMORY USAGE, which costs the server a lookup
+rather than a serialized copy of the value. Servers without it (before
+4.0) are sent DUMP instead. The totals of each source are scaled up from
+its own sample.
+
+Payload bytes and memory bytes are not the same measure, a value usually
+takes more memory than its payload, so they are added up and reported
+apart rather than mixed in one total.
+
+The duration is the number of round trips the copy needs, times the
+latency measured to the source and destination. It leaves out the time
+to send the bytes and for redis to restore them, so it is a lower bound.
+"""
+import heapq
+import time
+from math import ceil
+
+from six import string_types
+
+from .api import (
+    _node_namer,
+    _rdb_key_filter,
+    _read_keys,
+)
+from .archive import ArchiveReader, is_archive
+from .decode import TYPE_NAMES
+from .multi import opened_sources
+from .progress import live_key_count
+from .rdbparser import parse_rdb_sizes
+from .sampler import sampler_for
+
+__all__ = ['Plan']
+
+# the fraction of the keys of live sources sized by default
+DEFAULT_SAMPLE = 0.01
+
+# every key of a live source is sized until this many were, so small
+# sources aren't left with no sample at all
+MIN_SIZED = 100
+
+# what a size measures, payload bytes or memory bytes
+PAYLOAD, MEMORY = 0, 1
+MEASURES = ('payload', 'memory')
+
+# the other types restore as is but can't be decoded
+OTHER_TYPE_NAMES = {6: 'module', 7: 'module', 15: 'stream', 19: 'stream',
+                    21: 'stream'}
+
+
+def object_type(enc_type):
+    """
+    :param enc_type: int the rdb object type
+    :return: str the name of its type
+    """
+    return TYPE_NAMES.get(enc_type) or \
+        OTHER_TYPE_NAMES.get(enc_type, 'type %d' % enc_type)
+
+
+def round_trip(conn, samples=5, clock=time.time):
+    """
+    :return: float the median seconds a PING takes
+    """
+    times = []
+    for _ in range(samples):
+        start = clock()
+        conn.ping()
+        times.append(clock() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def _live_sizes(src, keys, measure):
+    """
+    :param measure: MEMORY to ask for MEMORY USAGE, PAYLOAD to DUMP
+    :return: list of (type, bytes) for each key, None for keys that are
+        gone. bytes is None if MEMORY USAGE is refused.
+    """
+    pipe = src.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+        if measure == MEMORY:
+            pipe.execute_command('MEMORY', 'USAGE', key)
+        else:
+            pipe.dump(key)
+    replies = pipe.execute(raise_on_error=False)
+    sizes = []
+    for i in range(len(keys)):
+        kind, size = replies[i * 2], replies[i * 2 + 1]
+        if isinstance(kind, bytes):
+            kind = kind.decode('ascii')
+        if kind == 'none' or size is None:
+            sizes.append(None)
+        elif isinstance(size, Exception):
+            sizes.append((kind, None))
+        else:
+            sizes.append((kind, size if measure == MEMORY else len(size)))
+    return sizes
+
+
+def _key_text(key):
+    if isinstance(key, bytes):
+        return key.decode('utf-8', 'backslashreplace')
+    return key
+
+
+def _size(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return '%.1f %s' % (n, unit) if unit != 'B' else '%d B' % n
+        n /= 1024.0
+    return '%.1f TB' % n
+
+
+def _duration(secs):
+    if secs < 10:
+        return '%.2fs' % secs
+    secs = int(ceil(secs))
+    return '%d:%02d:%02d' % (secs // 3600, secs // 60 % 60, secs % 60)
+
+
+class Plan(object):
+    """
+    What copying the sources into the destination will take. Call read()
+    with each source, then look at the totals or report() them.
+
+    :param dst: destination to measure the latency of and, for clusters
+        and ShardedRedis, to spread the keys over. None leaves both out.
+    :param pattern: str glob-style or /regex/ key filter
+    :param sample: float fraction of the keys of live sources to size,
+        chosen by key hash, 1 or None for all of them. rdb files and
+        archives are always sized in full
+    :param backfill: bool the copy checks which keys exist first
+    :param sampler: redisimp.Sampler the subset of keys the copy takes
+    :param predicate: redisimp.Predicate the values the copy takes
+    :param largest: int how many of the largest keys to keep
+    :param batch_size: int
+    """
+
+    def __init__(self, dst=None, pattern=None, sample=DEFAULT_SAMPLE,
+                 backfill=False,
+                 sampler=None, predicate=None, largest=10, batch_size=500,
+                 clock=time.time):
+        self.dst = dst
+        self.pattern = pattern
+        self.sample = sample
+        self.backfill = backfill
+        self.sampler = sampler
+        self.predicate = predicate
+        self.batch_size = batch_size
+        self.keys = 0
+        self.sized = 0
+        # type: (keys, payload bytes, memory bytes)
+        self.types = {}
+        # node: (payload bytes, memory bytes)
+        self.nodes = {}
+        self._bytes = [0.0, 0.0]
+        # what the source being read has sized so far, scaled up when it
+        # is done
+        self._source_keys = 0
+        self._source_sized = 0
+        self._source_types = {}
+        self._source_nodes = {}
+        self.src_round_trips = 0
+        self.src_latency = 0.0
+        self.dst_round_trips = 0
+        self.dst_latency = None
+        self._largest = []
+        self._largest_size = largest
+        self._sampled = sampler_for(sample)
+        self._node_name = _node_namer(dst) if dst is not None else None
+        self._clock = clock
+        if dst is not None:
+            self.dst_latency = round_trip(dst, clock=clock)
+
+    def _add(self, key, kind, size, measure=PAYLOAD):
+        self.sized += 1
+        self._source_sized += 1
+        counts = self._source_types.setdefault(kind, [0, 0, 0])
+        counts[0] += 1
+        counts[1 + measure] += size
+        if self._node_name is not None:
+            node = self._node_name(key)
+            self._source_nodes.setdefault(node, [0, 0])[measure] += size
+        item = (size, key, kind, MEASURES[measure])
+        if len(self._largest) < self._largest_size:
+            heapq.heappush(self._largest, item)
+        elif item > self._largest[0]:
+            heapq.heapreplace(self._largest, item)
+
+    def _batch(self, keys):
+        self.keys += keys
+        self._source_keys += keys
+        # RESTORE, and EXISTS before it when backfilling
+        self.dst_round_trips += 2 if self.backfill else 1
+
+    def _file_sizes(self, src, key_filter):
+        """
+        :yield: batches of (key, rdb object type, payload bytes, pttl)
+        """
+        if isinstance(src, ArchiveReader):
+            for rows in src.batches(key_filter):
+                yield ((key, bytearray(data[:1])[0], len(data), pttl)
+                       for key, data, pttl in rows)
+        else:
+            yield parse_rdb_sizes(src, key_filter, predicate=self.predicate)
+
+    def _read_file(self, src, dedup):
+        key_filter = _rdb_key_filter(self.pattern, dedup=dedup,
+                                     sampler=self.sampler)
+        for rows in self._file_sizes(src, key_filter):
+            count = 0
+            for key, enc_type, size, pttl in rows:
+                if self.predicate is not None and \
+                        not self.predicate.sized(enc_type, size, pttl):
+                    continue
+                if dedup is not None and not dedup.add(key):
+                    continue
+                self._add(key, object_type(enc_type), size)
+                count += 1
+                if count == self.batch_size:
+                    self._batch(count)
+                    count = 0
+                yield key
+            if count:
+                self._batch(count)
+
+    def _read_live(self, src, dedup):
+        latency = round_trip(src, clock=self._clock)
+        self.src_latency = max(self.src_latency, latency)
+        # SCAN walks every key whatever the pattern
+        self.src_round_trips += int(ceil(
+            float(live_key_count(src)) / self.batch_size))
+        measure = MEMORY
+        for keys in _read_keys(src, self.batch_size, self.pattern,
+                               dedup=dedup, sampler=self.sampler,
+                               predicate=self.predicate):
+            if dedup is not None:
+                keys = dedup.filter(keys)
+                if not keys:
+                    continue
+            self._batch(len(keys))
+            # DUMP and PTTL
+            self.src_round_trips += 1
+            sized = keys
+            if self._sampled is not None:
+                room = MIN_SIZED - self._source_sized
+                sized = [key for i, key in enumerate(keys)
+                         if i < room or self._sampled(key)]
+            if sized:
+                sizes = _live_sizes(src, sized, measure)
+                if measure == MEMORY and any(
+                        s is not None and s[1] is None for s in sizes):
+                    measure = PAYLOAD
+                    sizes = _live_sizes(src, sized, measure)
+                for key, size in zip(sized, sizes):
+                    if size is not None:
+                        self._add(key, size[0], size[1], measure)
+            for key in keys:
+                yield key
+
+    def read(self, src, dedup=None):
+        """
+        account for one source.
+        :param src: redis.StrictRedis, or the path to an rdb file or
+            archive, or an ArchiveReader
+        :param dedup: redisimp.Dedup
+        :yield: the keys the copy would process
+        """
+        if is_archive(src):
+            src = ArchiveReader(src)
+        if isinstance(src, string_types + (ArchiveReader,)):
+            keys = self._read_file(src, dedup)
+        else:
+            keys = self._read_live(src, dedup)
+        for key in keys:
+            yield key
+        self._scale_source()
+
+    def _scale_source(self):
+        """
+        add what the source sized to the totals, scaled up by how many
+        keys each sized key of that source stands for.
+        """
+        scale = float(self._source_keys) / self._source_sized \
+            if self._source_sized else 0.0
+        for kind, counts in self._source_types.items():
+            totals = self.types.get(kind, (0.0, 0.0, 0.0))
+            self.types[kind] = tuple(total + n * scale
+                                     for total, n in zip(totals, counts))
+            for measure in (PAYLOAD, MEMORY):
+                self._bytes[measure] += counts[1 + measure] * scale
+        for node, sizes in self._source_nodes.items():
+            totals = self.nodes.get(node, (0.0, 0.0))
+            self.nodes[node] = tuple(total + n * scale
+                                     for total, n in zip(totals, sizes))
+        self._source_keys = self._source_sized = 0
+        self._source_types = {}
+        self._source_nodes = {}
+
+    def read_sources(self, srclist, dedup=None, progress=None):
+        """
+        account for several sources the way multi_copy() copies them.
+        :yield: the keys the copy would process
+        """
+        if dedup is not None:
+            srclist = dedup.order(srclist)
+        for src in opened_sources(srclist, progress):
+            for key in self.read(src, dedup):
+                yield key
+
+    @property
+    def bytes(self):
+        """
+        :return: int the payload bytes of the keys of rdb files and
+            archives, and of live sources on servers without MEMORY USAGE
+        """
+        return int(round(self._bytes[PAYLOAD]))
+
+    @property
+    def memory(self):
+        """
+        :return: int the memory the keys of live sources take, estimated
+            from the sample
+        """
+        return int(round(self._bytes[MEMORY]))
+
+    @property
+    def largest(self):
+        """
+        :return: list of (bytes, key, type, measure) of the largest keys
+            sized, largest first
+        """
+        return sorted(self._largest, reverse=True)
+
+    @property
+    def seconds(self):
+        """
+        :return: float the time the round trips of the copy take, or None
+            without a destination
+        """
+        if self.dst_latency is None:
+            return None
+        return self.src_round_trips * self.src_latency + \
+            self.dst_round_trips * self.dst_latency
+
+    def report(self, out):
+        """
+        write the totals for a person to read.
+        """
+        # only the measures something was sized with get a column
+        measures = [m for m in (PAYLOAD, MEMORY) if self._bytes[m]] or \
+            [PAYLOAD]
+        out.write('keys: %d\n' % self.keys)
+        for measure in measures:
+            out.write('%s bytes: %s\n' % (
+                MEASURES[measure], _size(self._bytes[measure])))
+        if self.sized < self.keys:
+            out.write('estimated from %d keys\n' % self.sized)
+
+        if self.types:
+            out.write('\n%-10s %12s' % ('type', 'keys'))
+            for measure in measures:
+                out.write(' %12s' % MEASURES[measure])
+            out.write('\n')
+            for kind, counts in sorted(
+                    self.types.items(), key=lambda x: -sum(x[1][1:])):
+                out.write('%-10s %12d' % (kind, round(counts[0])))
+                for measure in measures:
+                    out.write(' %12s' % _size(counts[1 + measure]))
+                out.write('\n')
+
+        if self._largest:
+            out.write('\nlargest keys:\n')
+            for size, key, kind, measure in self.largest:
+                out.write('%12s  %-8s %-8s %s\n' % (
+                    _size(size), measure, kind, _key_text(key)))
+
+        if self.nodes:
+            out.write('\nbytes per node:\n')
+            for node, sizes in sorted(self.nodes.items()):
+                out.write('%-24s' % node)
+                for measure in measures:
+                    total = self._bytes[measure]
+                    out.write(' %12s %6.1f%%' % (
+                        _size(sizes[measure]),
+                        100.0 * sizes[measure] / total if total else 0.0))
+                out.write('\n')
+
+        if self.seconds is not None:
+            out.write('\nround trips: %d to the source at %.2fms, '
+                      '%d to the destination at %.2fms\n' % (
+                          self.src_round_trips, self.src_latency * 1000,
+                          self.dst_round_trips, self.dst_latency * 1000))
+            out.write('duration: at least %s\n' % _duration(self.seconds))
+        out.flush()
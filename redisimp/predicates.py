@@ -0,0 +1,117 @@
+"""
+Pick keys by their type, encoding, size and ttl as well as their name.
+
+A Predicate is checked in two places. The rdb parser asks it about each
+key before the value is read, with the rdb object type, the length at the
+start of the value and the expiry, and skips over the values it turns
+down. That length is the bytes of a value stored as one string and the
+element count of the others. Either way it is no more than the size of
+the DUMP payload, so a value already over the limit by its length is
+certainly over it. Every row read from any source is then checked again
+with its payload and ttl, which catches the values that only turn out too
+large once read. Live sources ask SCAN for the type when one type is
+wanted, so keys of other types aren't even dumped.
+"""
+import time
+
+from .analyze import ENCODINGS
+from .plan import object_type
+
+__all__ = ['Predicate', 'TYPES']
+
+TYPES = ('string', 'list', 'set', 'zset', 'hash', 'stream', 'module')
+
+
+class Predicate(object):
+    """
+    Decides which values are copied.
+
+    :param types: list of the type names to keep, e.g. ['hash']
+    :param encodings: list of the encodings to keep, e.g. ['ziplist']
+    :param max_value_bytes: int the largest DUMP payload to keep
+    :param min_ttl: float seconds. keys that expire sooner are left out,
+        keys without a ttl are kept
+    """
+
+    def __init__(self, types=None, encodings=None, max_value_bytes=None,
+                 min_ttl=None, clock=time.time):
+        if types:
+            unknown = set(types) - set(TYPES)
+            if unknown:
+                raise ValueError('unknown types: %s' %
+                                 ', '.join(sorted(unknown)))
+        self.types = frozenset(types) if types else None
+        self.encodings = frozenset(encodings) if encodings else None
+        self.max_value_bytes = max_value_bytes
+        self.min_ttl = min_ttl
+        self._min_pttl = None if min_ttl is None else int(min_ttl * 1000)
+        self._clock = clock
+        self._kinds = {}
+
+    @property
+    def scan_type(self):
+        """
+        :return: str the type to ask SCAN for, or None if more than one
+            type, or none at all, is wanted
+        """
+        if self.types is not None and len(self.types) == 1:
+            kind, = self.types
+            # module values report the name of their module
+            if kind != 'module':
+                return kind
+        return None
+
+    def _kind(self, enc_type):
+        keep = self._kinds.get(enc_type)
+        if keep is None:
+            kind = object_type(enc_type)
+            encoding = ENCODINGS.get(enc_type, kind)
+            keep = (self.types is None or kind in self.types) and \
+                (self.encodings is None or encoding in self.encodings)
+            self._kinds[enc_type] = keep
+        return keep
+
+    def __call__(self, key, enc_type, length, expiry):
+        """
+        the check the rdb parser makes before it reads a value.
+        :param key: bytes
+        :param enc_type: int the rdb object type, which is also the encoding
+        :param length: int the bytes or elements the value header announces
+        :param expiry: int unix time in ms the key expires at, or None
+        :return: bool
+        """
+        if not self._kind(enc_type):
+            return False
+        if self.max_value_bytes is not None and \
+                length > self.max_value_bytes:
+            return False
+        if self._min_pttl is not None and expiry:
+            return expiry - int(self._clock() * 1000) >= self._min_pttl
+        return True
+
+    def row(self, row):
+        """
+        the check made on a (key, data, pttl) row once the value is read.
+        """
+        key, data, pttl = row
+        return self.sized(bytearray(data[:1])[0], len(data), pttl)
+
+    def sized(self, enc_type, size, pttl):
+        """
+        the same check for a value known by its type and payload size.
+        :param enc_type: int the rdb object type
+        :param size: int the bytes of its DUMP payload
+        :param pttl: int ttl in ms, 0 for none
+        """
+        if not self._kind(enc_type):
+            return False
+        if self.max_value_bytes is not None and size > self.max_value_bytes:
+            return False
+        return self._min_pttl is None or not pttl or pttl >= self._min_pttl
+
+    def filter(self, rows):
+        """
+        :param rows: list of (key, data, pttl)
+        :return: list of the rows to keep
+        """
+        return [row for row in rows if self.row(row)]
@@ -0,0 +1,96 @@
+"""
+Find out where an import spends its time.
+
+Wraps the copy in cProfile and pairs the hottest functions with the
+per-phase split recorded by Metrics. Nothing is installed unless a
+Profiler is started, so there is no overhead when profiling is off.
+"""
+import sys
+import time
+from contextlib import contextmanager
+
+from .metrics import Metrics
+
+__all__ = ['Profiler', 'profiling']
+
+
+class Profiler(object):
+    """
+    Pass `profiler.metrics` to copy() so phase timings get recorded too.
+    """
+
+    def __init__(self, metrics=None, top=20, clock=time.time):
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.top = top
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.elapsed = 0.0
+        self._clock = clock
+        self._start = None
+
+    def start(self):
+        self._start = self._clock()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.elapsed += self._clock() - self._start
+
+    def phases(self):
+        """
+        :return: list of (phase, seconds, count) slowest first
+        """
+        phases = self.metrics.snapshot()['phases']
+        return sorted(((phase, v['sum'], v['count'])
+                       for phase, v in phases.items()),
+                      key=lambda x: -x[1])
+
+    def report(self, out=None):
+        """
+        write the per-phase split and the hottest functions.
+        :param out: file object, defaults to stderr
+        """
+        if out is None:
+            out = sys.stderr
+
+        out.write('\n--- redisimp profile: %.3fs wall time ---\n' %
+                  self.elapsed)
+        out.write('\nphase split (parse includes crc and lzf):\n')
+        for phase, secs, count in self.phases():
+            pct = 100.0 * secs / self.elapsed if self.elapsed else 0.0
+            out.write('  %-10s %10.3fs %6.1f%% %10d calls\n' %
+                      (phase, secs, pct, count))
+
+        out.write('\nhot functions by own time:\n')
+        import pstats
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.strip_dirs().sort_stats('tottime').print_stats(self.top)
+        out.flush()
+
+    def dump_stats(self, filename):
+        """
+        save the raw profile for pstats, snakeviz and friends.
+        """
+        self.profile.dump_stats(filename)
+
+
+@contextmanager
+def profiling(out=None, metrics=None, top=20):
+    """
+    profile the block and write the report when it exits.
+
+        with profiling() as p:
+            for key in copy(src, dst, metrics=p.metrics):
+                pass
+
+    :param out: file object for the report, defaults to stderr
+    :param metrics: redisimp.Metrics to share with other reporting
+    :param top: int how many functions to list
+    """
+    profiler = Profiler(metrics=metrics, top=top)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        profiler.report(out)
@@ -0,0 +1,241 @@
+"""
+Percent done, throughput and time left while a copy runs.
+
+The size of each source is looked up when the copy gets to it: the file
+size and the RESIZEDB key counts of an rdb file, the chunk index of an
+archive, or DBSIZE of a live server. rdb files are measured by the offset
+the parser has read up to, so the percentage stays right when a pattern
+skips most of the keys. Other sources are measured by the keys copied so
+far. A status line is written every `interval` seconds, never per key.
+"""
+import os
+import time
+
+from six import string_types
+
+from .archive import ArchiveReader, is_archive
+from .rdbparser import (
+    RdbParser,
+    read_unsigned_char,
+    REDIS_RDB_OPCODE_AUX,
+    REDIS_RDB_OPCODE_RESIZEDB,
+    REDIS_RDB_OPCODE_SELECTDB,
+)
+
+__all__ = ['Progress', 'KeyLog', 'source_size']
+
+
+class NullProgress(object):
+    """
+    Stand-in used when progress isn't reported.
+    """
+
+    def reading(self, f):
+        pass
+
+    def read(self, keys, nbytes):
+        pass
+
+
+NULL_PROGRESS = NullProgress()
+
+
+def rdb_key_count(filename):
+    """
+    :return: int the keys the RESIZEDB opcodes at the start of an rdb file
+        announce, or None if it has none. Only the first database is
+        announced up front.
+    """
+    parser = RdbParser()
+    keys = None
+    with open(filename, 'rb') as f:
+        parser.verify_magic_string(f.read(5))
+        parser.verify_version(f.read(4))
+        while True:
+            data_type = read_unsigned_char(f)
+            if data_type == REDIS_RDB_OPCODE_AUX:
+                parser.read_string(f)
+                parser.read_string(f)
+            elif data_type == REDIS_RDB_OPCODE_SELECTDB:
+                parser.read_length(f)
+            elif data_type == REDIS_RDB_OPCODE_RESIZEDB:
+                keys = (keys or 0) + parser.read_length(f)
+                # the size of the expires table
+                parser.read_length(f)
+            else:
+                return keys
+
+
+def live_key_count(conn):
+    """
+    :return: int the keys in the database a live source scans
+    """
+    from redis.exceptions import ResponseError
+    try:
+        return conn.dbsize()
+    except ResponseError:
+        # DBSIZE may be renamed away, INFO keyspace has the same number
+        db = conn.connection_pool.connection_kwargs.get('db', 0)
+        return conn.info('keyspace').get('db%d' % db, {}).get('keys', 0)
+
+
+def source_size(src):
+    """
+    :param src: redis.StrictRedis, ArchiveReader or the path to an rdb file
+    :return: tuple of the keys in the source and the size of the rdb file,
+        either None if unknown
+    """
+    if is_archive(src):
+        src = ArchiveReader(src)
+    if isinstance(src, ArchiveReader):
+        return sum(src.chunks[n].count for n in src.selected()), None
+    if isinstance(src, string_types):
+        if src == '-':
+            return None, None
+        return rdb_key_count(src), os.path.getsize(src)
+    return live_key_count(src), None
+
+
+def _duration(secs):
+    secs = int(secs)
+    return '%d:%02d:%02d' % (secs // 3600, secs // 60 % 60, secs % 60)
+
+
+class Progress(object):
+    """
+    Follows a copy across its sources. Call start() with each source before
+    it is copied and advance() for each key copied; pass the Progress to
+    copy() so it sees the bytes read.
+
+    :param out: file object for the status lines
+    :param sources: int how many sources will be copied
+    :param interval: float seconds between status lines
+    """
+
+    def __init__(self, out, sources=1, interval=1.0, clock=time.time):
+        self.out = out
+        self.sources = sources
+        self.interval = interval
+        self.source = 0
+        self.keys = 0
+        self.started = clock()
+        self._clock = clock
+        self._next = self.started + interval
+        self._done_bytes = 0
+        self._read_bytes = 0
+        self._source_keys = 0
+        self._total_keys = None
+        self._size = None
+        self._file = None
+
+    def start(self, src):
+        """
+        a new source is about to be copied.
+        """
+        self._done_bytes += self._bytes()
+        self.source += 1
+        self._source_keys = self._read_bytes = 0
+        self._file = None
+        self._total_keys, self._size = source_size(src)
+
+    def reading(self, f):
+        """
+        the parser opened the rdb file of the current source.
+        """
+        if self._size:
+            self._file = f
+
+    def read(self, keys, nbytes):
+        """
+        account for a batch read from the current source.
+        """
+        self._read_bytes += nbytes
+
+    def _offset(self):
+        if self._file.closed:
+            return self._size
+        return self._file.tell()
+
+    def _bytes(self):
+        if self._file is not None:
+            return self._offset()
+        return self._read_bytes
+
+    def fraction(self):
+        """
+        :return: float how much of the current source is done, or None if
+            its size is unknown
+        """
+        if self._file is not None:
+            return min(1.0, float(self._offset()) / self._size)
+        if self._total_keys:
+            return min(1.0, float(self._source_keys) / self._total_keys)
+        return None
+
+    def status(self, now=None):
+        """
+        :return: str percent done, keys, keys/sec, MB/sec and time left
+        """
+        if now is None:
+            now = self._clock()
+        elapsed = max(now - self.started, 1e-6)
+        parts = []
+        if self.sources > 1:
+            parts.append('[%d/%d]' % (self.source, self.sources))
+        fraction = self.fraction()
+        done = None
+        if fraction is not None:
+            done = (self.source - 1 + fraction) / self.sources
+            parts.append('%5.1f%%' % (done * 100))
+        if self._total_keys is not None:
+            parts.append('%d/%d keys' % (self._source_keys,
+                                         self._total_keys))
+        else:
+            parts.append('%d keys' % self._source_keys)
+        parts.append('%d keys/s' % (self.keys / elapsed))
+        parts.append('%.1f MB/s' % (
+            (self._done_bytes + self._bytes()) / elapsed / 1e6))
+        if done:
+            parts.append('eta %s' % _duration(elapsed * (1 - done) / done))
+        return '  '.join(parts)
+
+    def report(self, now=None):
+        self.out.write('\r%s' % self.status(now))
+        self.out.flush()
+
+    def advance(self, keys=1):
+        """
+        count keys copied, writing a status line once the interval passed.
+        """
+        self.keys += keys
+        self._source_keys += keys
+        now = self._clock()
+        if now >= self._next:
+            self._next = now + self.interval
+            self.report(now)
+
+
+class KeyLog(object):
+    """
+    Buffers the keys --verbose lists and writes them `size` at a time, so
+    a slow terminal doesn't hold the copy up on every key.
+
+    :param out: file object
+    :param size: int keys per write
+    """
+
+    def __init__(self, out, size=1000):
+        self.out = out
+        self.size = size
+        self._keys = []
+
+    def write(self, key):
+        self._keys.append(key)
+        if len(self._keys) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self._keys:
+            self.out.write(''.join('%s\n' % key for key in self._keys))
+            self._keys = []
+        self.out.flush()
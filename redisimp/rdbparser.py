@@ -1,14 +1,16 @@
 # Borrowed from rdb-tools
 import sys
+import time
 import struct
 from .crc64 import crc64
+from .metrics import timed
 
 try:
     import lzf
 except ImportError:
     lzf = None
 
-__all__ = ['parse_rdb']
+__all__ = ['parse_rdb', 'parse_rdb_hotness', 'parse_rdb_sizes']
 
 REDIS_RDB_6BITLEN = 0
 REDIS_RDB_14BITLEN = 1
@@ -16,6 +18,8 @@ REDIS_RDB_32BITLEN = 0x80
 REDIS_RDB_64BITLEN = 0x81
 REDIS_RDB_ENCVAL = 3
 
+REDIS_RDB_OPCODE_IDLE = 248
+REDIS_RDB_OPCODE_FREQ = 249
 REDIS_RDB_OPCODE_AUX = 250
 REDIS_RDB_OPCODE_RESIZEDB = 251
 REDIS_RDB_OPCODE_EXPIRETIME_MS = 252
@@ -43,6 +47,32 @@ REDIS_RDB_ENC_INT16 = 1
 REDIS_RDB_ENC_INT32 = 2
 REDIS_RDB_ENC_LZF = 3
 
+# how many bytes follow each integer encoding
+INT_ENCODING_BYTES = {
+    REDIS_RDB_ENC_INT8: 1,
+    REDIS_RDB_ENC_INT16: 2,
+    REDIS_RDB_ENC_INT32: 4,
+}
+
+# the value of these types is a single string, the others start with the
+# number of elements
+STRING_VALUE_TYPES = frozenset([
+    REDIS_RDB_TYPE_STRING,
+    REDIS_RDB_TYPE_HASH_ZIPMAP,
+    REDIS_RDB_TYPE_LIST_ZIPLIST,
+    REDIS_RDB_TYPE_SET_INTSET,
+    REDIS_RDB_TYPE_ZSET_ZIPLIST,
+    REDIS_RDB_TYPE_HASH_ZIPLIST,
+])
+COUNTED_VALUE_TYPES = frozenset([
+    REDIS_RDB_TYPE_LIST,
+    REDIS_RDB_TYPE_SET,
+    REDIS_RDB_TYPE_ZSET,
+    REDIS_RDB_TYPE_ZSET_2,
+    REDIS_RDB_TYPE_HASH,
+    REDIS_RDB_TYPE_LIST_QUICKLIST,
+])
+
 REDIS_RDB_MODULE_OPCODE_EOF = 0  # End of module value.
 REDIS_RDB_MODULE_OPCODE_SINT = 1
 REDIS_RDB_MODULE_OPCODE_UINT = 2
@@ -50,16 +80,45 @@ REDIS_RDB_MODULE_OPCODE_FLOAT = 3
 REDIS_RDB_MODULE_OPCODE_DOUBLE = 4
 REDIS_RDB_MODULE_OPCODE_STRING = 5
 
+# the object type byte in front of a DUMP payload, and the rdb version and
+# crc64 behind it
+PAYLOAD_OVERHEAD = 1 + 2 + 8
+
+
+class ByteCount(object):
+    """
+    Stands in for the list the bytes of a value are collected in, and only
+    counts them.
+    """
+
+    def __init__(self):
+        self.n = 0
+
+    def append(self, buf):
+        self.n += len(buf)
+
+    def extend(self, bufs):
+        for buf in bufs:
+            self.n += len(buf)
+
+    def add(self, n):
+        self.n += n
+
 
 class RdbParser:
     """
     A Parser for Redis RDB Files
     """
 
-    def __init__(self, key_filter=None):
+    def __init__(self, key_filter=None, metrics=None, progress=None,
+                 predicate=None):
         self._key = None
-        self._pttl = None
+        self._expiry = None
         self._value = None
+        self._idle = None
+        self._freq = None
+        self._type = None
+        self._sizes = False
         self.version = None
         if key_filter is None:
             def matchall(x):
@@ -68,23 +127,46 @@ class RdbParser:
             key_filter = matchall
 
         self._filter = key_filter
+        self._progress = progress
+        self._predicate = predicate
+        self._seekable = False
+        self._crc64 = crc64
+        self._lzf_decompress = lzf_decompress
+        if metrics is not None:
+            self.read_key_and_object = timed(
+                metrics, 'parse', self.read_key_and_object)
+            self._crc64 = timed(metrics, 'crc', crc64)
+            self._lzf_decompress = timed(metrics, 'lzf', lzf_decompress)
 
     def parse(self, filename):
         """
-        Parse a redis rdb dump file and yield key, serialized dump, ttl
+        Parse a redis rdb dump file and yield key, serialized dump, ttl in ms
         """
         with sys.stdin if filename == '-' else open(filename, "rb") as f:
+            self._seekable = filename != '-'
             self.verify_magic_string(f.read(5))
             self.verify_version(f.read(4))
+            if self._progress is not None:
+                self._progress.reading(f)
             while True:
-                self._pttl = self._key = self._value = None
+                self._expiry = self._key = self._value = None
+                self._idle = self._freq = None
                 data_type = read_unsigned_char(f)
 
                 if data_type == REDIS_RDB_OPCODE_EXPIRETIME_MS:
-                    self._pttl = read_unsigned_long(f)
+                    self._expiry = read_unsigned_long(f)
                     data_type = read_unsigned_char(f)
                 elif data_type == REDIS_RDB_OPCODE_EXPIRETIME:
-                    self._pttl = read_unsigned_int(f) * 1000
+                    self._expiry = read_unsigned_int(f) * 1000
+                    data_type = read_unsigned_char(f)
+
+                # servers with an lru or lfu maxmemory-policy save the
+                # idle time or access frequency of each key.
+                if data_type == REDIS_RDB_OPCODE_IDLE:
+                    self._idle = self.read_length(f)
+                    data_type = read_unsigned_char(f)
+                elif data_type == REDIS_RDB_OPCODE_FREQ:
+                    self._freq = read_unsigned_char(f)
                     data_type = read_unsigned_char(f)
 
                 if data_type == REDIS_RDB_OPCODE_SELECTDB:
@@ -105,8 +187,43 @@ class RdbParser:
                     return
 
                 self.read_key_and_object(f, data_type)
-                if self._filter(self._key):
-                    yield self._key, self._value, self._pttl or 0
+                if self._value is None:
+                    continue
+
+                # the rdb stores an absolute unix time in ms but RESTORE
+                # takes the ttl. keys that already expired are dropped.
+                pttl = 0
+                if self._expiry:
+                    pttl = self._expiry - int(time.time() * 1000)
+                    if pttl <= 0:
+                        continue
+                yield self._key, self._value, pttl
+
+    def parse_with_hotness(self, filename):
+        """
+        Like parse, but yield each row with its hotness: the lfu counter,
+        or minus the idle seconds under lru, or None if the file has neither
+        """
+        for row in self.parse(filename):
+            if self._freq is not None:
+                yield row, self._freq
+            elif self._idle is not None:
+                yield row, -self._idle
+            else:
+                yield row, None
+
+    def parse_sizes(self, filename):
+        """
+        Like parse, but read past every value without building its payload
+        or checksum, and yield key, rdb object type, the bytes its DUMP
+        payload takes and ttl in ms
+        """
+        self._sizes = True
+        try:
+            for key, size, pttl in self.parse(filename):
+                yield key, self._type, size, pttl
+        finally:
+            self._sizes = False
 
     def read_length_with_encoding(self, f, out):
         is_encoded = False
@@ -135,7 +252,26 @@ class RdbParser:
 
     def read_key_and_object(self, f, data_type):
         self._key = self.read_string(f, decompress=True)
-        self._value = self.read_object(f, data_type)
+        # the values of keys that are dropped anyway are read past without
+        # building their payload or checksum
+        expired = self._expiry and self._expiry <= int(time.time() * 1000)
+        skip = expired or not self._filter(self._key)
+        header = raw = None
+        if not skip and self._predicate is not None:
+            # the predicate sees the length before the value is read, the
+            # bytes of a string value or the element count of the others
+            raw = []
+            header = self.read_value_header(f, data_type, raw)
+            length = header[0] if isinstance(header, tuple) else header
+            skip = not self._predicate(self._key, data_type, length,
+                                       self._expiry)
+        self._type = data_type
+        if self._sizes and not skip:
+            count = ByteCount()
+            self.read_object(f, data_type, True, header, raw, count)
+            self._value = count.n + PAYLOAD_OVERHEAD
+            return
+        self._value = self.read_object(f, data_type, skip, header, raw)
 
     def read_binary_double(self, f, out=None):
         read_bytes(f, 8, out)
@@ -145,74 +281,89 @@ class RdbParser:
         if dbl_length < 253:
             read_bytes(f, dbl_length, out)
 
-    def read_string(self, f, out=None, decompress=False):
-        tup = self.read_length_with_encoding(f, out)
-        length = tup[0]
-        is_encoded = tup[1]
-        bytes_to_read = 0
-        if is_encoded:
-            if length == REDIS_RDB_ENC_INT8:
-                bytes_to_read = 1
-            elif length == REDIS_RDB_ENC_INT16:
-                bytes_to_read = 2
-            elif length == REDIS_RDB_ENC_INT32:
-                bytes_to_read = 4
-            elif length == REDIS_RDB_ENC_LZF:
-                clen = self.read_length(f, out)
-                lzlen = self.read_length(f, out)
-                if decompress:
-                    return lzf_decompress(f.read(clen), lzlen)
-                else:
-                    bytes_to_read = clen
+    def read_string_header(self, f, out=None):
+        """
+        :return: tuple of the bytes the string takes in the file and, if it
+            is lzf compressed, its length once decompressed
+        """
+        length, is_encoded, _ = self.read_length_with_encoding(f, out)
+        if not is_encoded:
+            return length, None
+        if length == REDIS_RDB_ENC_LZF:
+            clen = self.read_length(f, out)
+            return clen, self.read_length(f, out)
+        return INT_ENCODING_BYTES.get(length, 0), None
+
+    def read_string(self, f, out=None, decompress=False, header=None):
+        nbytes, lzlen = header or self.read_string_header(f, out)
+        if decompress and lzlen is not None:
+            return self._lzf_decompress(f.read(nbytes), lzlen)
+        return read_bytes(f, nbytes, out)
+
+    def skip_string(self, f, out=None, header=None):
+        """
+        read past a string without keeping it. files are seeked over so
+        the bytes of large values aren't copied at all.
+        :param out: ByteCount to count the bytes in, or None
+        """
+        nbytes = (header or self.read_string_header(f, out))[0]
+        if out is not None:
+            out.add(nbytes)
+        if self._seekable:
+            f.seek(nbytes, 1)
         else:
-            bytes_to_read = length
-
-        return read_bytes(f, bytes_to_read, out)
-
-    def read_object(self, f, enc_type):
-        out = [struct.pack('B', enc_type)]
-        skip_strings = 0
-        if enc_type == REDIS_RDB_TYPE_STRING:
-            skip_strings = 1
-        elif enc_type == REDIS_RDB_TYPE_LIST:
-            skip_strings = self.read_length(f, out)
-        elif enc_type == REDIS_RDB_TYPE_SET:
-            skip_strings = self.read_length(f, out)
+            f.read(nbytes)
+
+    def read_value_header(self, f, enc_type, out=None):
+        """
+        :return: the string header of values that are a single string,
+            otherwise the number of elements
+        """
+        if enc_type in STRING_VALUE_TYPES:
+            return self.read_string_header(f, out)
+        if enc_type in COUNTED_VALUE_TYPES:
+            return self.read_length(f, out)
+        raise Exception(
+            'read_object',
+            'Invalid object type %d for key %s' % (enc_type, self._key))
+
+    def read_object(self, f, enc_type, skip=False, header=None, raw=None,
+                    count=None):
+        """
+        :param header: the value header if it was read already
+        :param raw: the bytes of that header
+        :param count: ByteCount given the bytes of a skipped value
+        :return: bytes the DUMP payload, or None if skip is set
+        """
+        out = count if skip else [struct.pack('B', enc_type)]
+        if header is None:
+            header = self.read_value_header(f, enc_type, out)
+        elif out is not None:
+            out.extend(raw)
+        read_string = self.skip_string if skip else self.read_string
+        if enc_type in STRING_VALUE_TYPES:
+            read_string(f, out, header=header)
         elif enc_type == REDIS_RDB_TYPE_ZSET:
-            length = self.read_length(f, out)
-            for x in range(length):
-                self.read_string(f, out)
+            for x in range(header):
+                read_string(f, out)
                 self.read_float(f, out)
         elif enc_type == REDIS_RDB_TYPE_ZSET_2:
-            length = self.read_length(f, out)
-            for x in range(length):
-                self.read_string(f, out)
+            for x in range(header):
+                read_string(f, out)
                 self.read_binary_double(f, out)
-        elif enc_type == REDIS_RDB_TYPE_HASH:
-            skip_strings = self.read_length(f, out) * 2
-        elif enc_type == REDIS_RDB_TYPE_HASH_ZIPMAP:
-            skip_strings = 1
-        elif enc_type == REDIS_RDB_TYPE_LIST_ZIPLIST:
-            skip_strings = 1
-        elif enc_type == REDIS_RDB_TYPE_SET_INTSET:
-            skip_strings = 1
-        elif enc_type == REDIS_RDB_TYPE_ZSET_ZIPLIST:
-            skip_strings = 1
-        elif enc_type == REDIS_RDB_TYPE_HASH_ZIPLIST:
-            skip_strings = 1
-        elif enc_type == REDIS_RDB_TYPE_LIST_QUICKLIST:
-            skip_strings = self.read_length(f, out)
         else:
-            raise Exception(
-                'read_object',
-                'Invalid object type %d for key %s' % (enc_type, self._key))
-        for x in range(0, skip_strings):
-            self.read_string(f, out)
-
-        out.append(struct.pack('I', self.version))
-        out.append(b'\x00')
+            if enc_type == REDIS_RDB_TYPE_HASH:
+                header *= 2
+            for x in range(header):
+                read_string(f, out)
+
+        if skip:
+            return None
+
+        # DUMP payload trailer: 2 byte rdb version, then the crc64
+        out.append(struct.pack('<H', self.version))
         res = b''.join(out)
-        checksum = crc64(res)
+        checksum = self._crc64(res)
         return res + struct.pack('<Q', checksum)
 
     def verify_magic_string(self, magic_string):
@@ -271,11 +422,27 @@ def ntohl(f, out=None):
     return new_val
 
 
-def parse_rdb(filename, key_filter=None):
-    parser = RdbParser(key_filter=key_filter)
+def parse_rdb(filename, key_filter=None, metrics=None, progress=None,
+              predicate=None):
+    parser = RdbParser(key_filter=key_filter, metrics=metrics,
+                       progress=progress, predicate=predicate)
     return parser.parse(filename)
 
 
+def parse_rdb_hotness(filename, key_filter=None, metrics=None,
+                      predicate=None):
+    parser = RdbParser(key_filter=key_filter, metrics=metrics,
+                       predicate=predicate)
+    return parser.parse_with_hotness(filename)
+
+
+def parse_rdb_sizes(filename, key_filter=None, progress=None,
+                    predicate=None):
+    parser = RdbParser(key_filter=key_filter, progress=progress,
+                       predicate=predicate)
+    return parser.parse_sizes(filename)
+
+
 def lzf_decompress(compressed, expected_length):
     if lzf:
         return lzf.decompress(compressed, expected_length)
@@ -0,0 +1,192 @@
+"""
+Write DUMP payloads straight into an RDB file.
+
+A DUMP payload is the object type, the serialized value, a 2 byte rdb version
+and a crc64. An rdb file entry is the optional expiry, the object type, the
+key and the same serialized value, so payloads from the rdb parser or from
+live sources can be streamed into a file without a redis server in between.
+"""
+import time
+import struct
+
+from .crc64 import crc64
+from .dedup import FingerprintSet
+from .rdbparser import (
+    REDIS_RDB_OPCODE_AUX,
+    REDIS_RDB_OPCODE_RESIZEDB,
+    REDIS_RDB_OPCODE_EXPIRETIME_MS,
+    REDIS_RDB_OPCODE_SELECTDB,
+    REDIS_RDB_OPCODE_EOF,
+    REDIS_RDB_32BITLEN,
+)
+from .version import __version__
+
+__all__ = ['RdbWriter']
+
+# the oldest version that has both the trailing checksum and AUX fields
+MIN_RDB_VERSION = 7
+
+
+def encode_length(length):
+    if length < 1 << 6:
+        return struct.pack('B', length)
+    if length < 1 << 14:
+        return struct.pack('>H', 0x4000 | length)
+    if length < 1 << 32:
+        return struct.pack('>BI', REDIS_RDB_32BITLEN, length)
+    return struct.pack('>BQ', REDIS_RDB_32BITLEN + 1, length)
+
+
+def encode_string(s):
+    if not isinstance(s, bytes):
+        s = str(s).encode('utf-8')
+    return encode_length(len(s)) + s
+
+
+class RdbWriter(object):
+    """
+    A destination that streams restored keys into an rdb file.
+
+    Rdb files can't contain the same key twice, so when a key shows up again
+    the first one written wins and the rest are skipped. The keys written
+    are remembered by fingerprint in a FingerprintSet, 11 to 21 bytes a
+    key. Set `checksum` to False to skip the crc64 of the whole file, which
+    redis treats as checksum disabled when loading.
+    """
+    supports_replace = True
+
+    def __init__(self, filename, version=MIN_RDB_VERSION, checksum=True,
+                 clock=time.time):
+        self.name = filename
+        self.version = version
+        self.checksum = checksum
+        self.keys = 0
+        self.expires = 0
+        self.skipped = 0
+        self._seen = FingerprintSet()
+        self._clock = clock
+        self._f = open(filename, 'w+b', 1 << 20)
+
+        self._f.write(b'REDIS%04d' % version)
+        self._aux(b'redis-bits', b'64')
+        self._aux(b'ctime', b'%d' % clock())
+        self._aux(b'redisimp-ver', __version__.encode('utf-8'))
+        self._f.write(struct.pack('B', REDIS_RDB_OPCODE_SELECTDB))
+        self._f.write(encode_length(0))
+
+        # the key counts are only known at the end; reserve fixed width
+        # lengths here and patch them in close().
+        self._f.write(struct.pack('B', REDIS_RDB_OPCODE_RESIZEDB))
+        self._resizedb_offset = self._f.tell()
+        self._f.write(struct.pack('>BIBI', REDIS_RDB_32BITLEN, 0,
+                                  REDIS_RDB_32BITLEN, 0))
+
+    def _aux(self, key, value):
+        self._f.write(struct.pack('B', REDIS_RDB_OPCODE_AUX))
+        self._f.write(encode_string(key))
+        self._f.write(encode_string(value))
+
+    def exists(self, key):
+        return key in self._seen
+
+    def write(self, key, data, pttl=0):
+        """
+        append a key.
+        :param key: bytes
+        :param data: bytes a DUMP payload
+        :param pttl: int ttl in ms, 0 for none
+        :return: bool False if the key was written before
+        """
+        if not self._seen.add(key):
+            self.skipped += 1
+            return False
+
+        version = struct.unpack('<H', data[-10:-8])[0]
+        if version > self.version:
+            self.version = version
+
+        if pttl and pttl > 0:
+            expiry = int(self._clock() * 1000) + int(pttl)
+            self._f.write(struct.pack(
+                '<BQ', REDIS_RDB_OPCODE_EXPIRETIME_MS, expiry))
+            self.expires += 1
+
+        self._f.write(data[0:1])
+        self._f.write(encode_string(key))
+        self._f.write(data[1:-10])
+        self.keys += 1
+        return True
+
+    def pipeline(self, transaction=False):
+        return RdbWriterPipeline(self)
+
+    def close(self):
+        """
+        write the EOF marker and checksum, then patch the header.
+        """
+        if self._f.closed:
+            return
+        self._f.write(struct.pack('B', REDIS_RDB_OPCODE_EOF))
+        self._f.seek(0)
+        self._f.write(b'REDIS%04d' % self.version)
+        self._f.seek(self._resizedb_offset)
+        self._f.write(struct.pack('>BIBI', REDIS_RDB_32BITLEN, self.keys,
+                                  REDIS_RDB_32BITLEN, self.expires))
+        crc = self._file_crc()
+        self._f.seek(0, 2)
+        self._f.write(struct.pack('<Q', crc))
+        self._f.close()
+
+    def _file_crc(self):
+        # the header gets patched at the end, so the checksum is taken in
+        # one pass over the finished file rather than as we go.
+        if not self.checksum:
+            return 0
+        self._f.flush()
+        self._f.seek(0)
+        crc = 0
+        while True:
+            buf = self._f.read(1 << 20)
+            if not buf:
+                break
+            crc = crc64(buf, crc)
+        return crc
+
+
+class RdbWriterPipeline(object):
+    """
+    Just enough of the redis pipeline interface for the copy functions.
+    Commands are buffered and written to the file on execute(). Works for
+    any writer with write() and exists().
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._commands = []
+
+    def execute_command(self, *args, **options):
+        command = args[0].upper()
+        if command != 'RESTORE':
+            raise ValueError('%s is not supported writing to %s' %
+                             (command, self.writer.name))
+        key, pttl, data = args[1:4]
+        self._commands.append((self.writer.write, (key, data, int(pttl))))
+        return self
+
+    def restore(self, name, ttl, value, replace=False, **kwargs):
+        return self.execute_command('RESTORE', name, ttl, value)
+
+    def exists(self, *names):
+        self._commands.append((self._exists, names))
+        return self
+
+    def _exists(self, *names):
+        return sum(1 for name in names if self.writer.exists(name))
+
+    def delete(self, *names):
+        self._commands.append((lambda *a: 0, names))
+        return self
+
+    def execute(self, raise_on_error=True):
+        commands, self._commands = self._commands, []
+        return [fn(*args) for fn, args in commands]
@@ -0,0 +1,221 @@
+"""
+Read a live source from its replicas instead of the primary.
+
+A ReplicaSource stands in for the source connection. SCAN stays on one
+node for a whole walk, since a cursor only means something to the node
+that handed it out, and the DUMP and PTTL pipelines of each batch go to
+the replicas in turn. Every `check_interval` seconds the offset each
+replica has applied is compared with master_repl_offset of the primary.
+Replicas more than `max_lag` bytes behind, or whose link to the primary
+is down, are left out until they catch up, and while none is usable the
+primary serves the reads. A pipeline whose replica drops the connection
+is sent to the primary instead.
+"""
+import time
+
+from .api import _conn_name
+
+__all__ = ['ReplicaSource', 'discover_replicas', 'connect_replica']
+
+
+def _connection_errors():
+    from redis.exceptions import ConnectionError, TimeoutError
+    return ConnectionError, TimeoutError
+
+
+def discover_replicas(conn):
+    """
+    :param conn: redis.StrictRedis the primary
+    :return: list of (host, port) of the online replicas it lists under
+        INFO replication
+    """
+    info = conn.info('replication')
+    replicas = []
+    for i in range(info.get('connected_slaves', 0)):
+        replica = info.get('slave%d' % i)
+        if not isinstance(replica, dict) or \
+                replica.get('state', 'online') != 'online':
+            continue
+        # replicas that only listen on a unix socket announce port 0
+        if int(replica.get('port', 0)):
+            replicas.append((replica['ip'], int(replica['port'])))
+    return replicas
+
+
+def connect_replica(conn, host, port):
+    """
+    connect to a replica with the settings of the primary connection.
+    """
+    import redis
+    pool = conn.connection_pool
+    kwargs = dict(pool.connection_kwargs)
+    kwargs.pop('path', None)
+    kwargs.update(host=host, port=port)
+    connection_class = pool.connection_class
+    if issubclass(connection_class, redis.UnixDomainSocketConnection):
+        connection_class = redis.Connection
+    return redis.StrictRedis(connection_pool=redis.ConnectionPool(
+        connection_class=connection_class, **kwargs))
+
+
+def _applied_offset(info):
+    return int(info.get('slave_repl_offset',
+                        info.get('master_repl_offset', 0)))
+
+
+class ReplicaSource(object):
+    """
+    A source wrapper that reads from replicas of the primary.
+
+    :param conn: redis.StrictRedis the primary
+    :param replicas: list of connections to its replicas, discovered with
+        INFO replication if not given
+    :param max_lag: int bytes of replication stream a replica may be
+        behind and still be read from
+    :param check_interval: float seconds between lag checks
+    """
+
+    def __init__(self, conn, replicas=None, max_lag=1 << 20,
+                 check_interval=1.0, clock=time.time):
+        self.conn = conn
+        if replicas is None:
+            replicas = [connect_replica(conn, host, port)
+                        for host, port in discover_replicas(conn)]
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lags = {}
+        self.reads = {}
+        self._clock = clock
+        self._checked = None
+        self._usable = []
+        self._turn = 0
+        self._scan_node = None
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    @property
+    def primary(self):
+        return self.conn
+
+    def _lag(self, replica, offset):
+        try:
+            info = replica.info('replication')
+        except _connection_errors():
+            return None
+        if info.get('master_link_status') != 'up':
+            return None
+        return max(0, offset - _applied_offset(info))
+
+    def usable(self):
+        """
+        :return: list of the replicas close enough to the primary, checked
+            at most once per interval
+        """
+        now = self._clock()
+        if self._checked is not None and \
+                now - self._checked < self.check_interval:
+            return self._usable
+        self._checked = now
+        offset = int(self.conn.info('replication').get(
+            'master_repl_offset', 0))
+        usable = []
+        for replica in self.replicas:
+            lag = self._lag(replica, offset)
+            self.lags[_conn_name(replica)] = lag
+            if lag is not None and lag <= self.max_lag:
+                usable.append(replica)
+        self._usable = usable
+        return usable
+
+    def _drop(self, replica):
+        if replica in self._usable:
+            self._usable = [r for r in self._usable if r is not replica]
+
+    def _next(self):
+        usable = self.usable()
+        if not usable:
+            return self.conn
+        self._turn = (self._turn + 1) % len(usable)
+        return usable[self._turn]
+
+    def _count(self, node):
+        name = _conn_name(node)
+        self.reads[name] = self.reads.get(name, 0) + 1
+
+    def scan(self, cursor=0, **kwargs):
+        if cursor == 0 or self._scan_node is None:
+            self._scan_node = self._next()
+        try:
+            return self._scan_node.scan(cursor=cursor, **kwargs)
+        except _connection_errors():
+            if self._scan_node is self.conn or cursor != 0:
+                raise
+            # nothing was read from it yet, start the walk elsewhere
+            self._drop(self._scan_node)
+            self._scan_node = self.conn
+            return self.conn.scan(cursor=cursor, **kwargs)
+
+    def scan_iter(self, match=None, count=None, **kwargs):
+        cursor = 0
+        while True:
+            cursor, keys = self.scan(cursor, match=match, count=count,
+                                     **kwargs)
+            for key in keys:
+                yield key
+            if cursor == 0:
+                break
+
+    def pipeline(self, transaction=False):
+        node = self._next()
+        self._count(node)
+        if node is self.conn:
+            return self.conn.pipeline(transaction=transaction)
+        return ReplicaPipeline(self, node)
+
+    def close(self):
+        for replica in self.replicas:
+            replica.close()
+        close = getattr(self.conn, 'close', None)
+        if close is not None:
+            close()
+
+
+class ReplicaPipeline(object):
+    """
+    A pipeline on a replica that remembers its commands, so they can be
+    sent to the primary if the replica goes away.
+    """
+
+    def __init__(self, source, replica):
+        self.source = source
+        self.replica = replica
+        self._pipe = replica.pipeline(transaction=False)
+        self._calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self._pipe, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            method(*args, **kwargs)
+            return self
+
+        return call
+
+    def __len__(self):
+        return len(self._pipe)
+
+    def execute(self, raise_on_error=True):
+        try:
+            return self._pipe.execute(raise_on_error=raise_on_error)
+        except _connection_errors():
+            self.source._drop(self.replica)
+            self.source._count(self.source.conn)
+            pipe = self.source.conn.pipeline(transaction=False)
+            for name, args, kwargs in self._calls:
+                getattr(pipe, name)(*args, **kwargs)
+            return pipe.execute(raise_on_error=raise_on_error)
@@ -0,0 +1,129 @@
+"""
+Write the commands of a copy as a raw RESP protocol stream.
+
+The output can be loaded later with `redis-cli --pipe`, the fastest bulk
+load path redis offers, from a machine that can reach the destination.
+"""
+import sys
+from six import string_types
+
+__all__ = ['RespWriter']
+
+CRLF = b'\r\n'
+
+
+def _to_bytes(arg):
+    if isinstance(arg, bytes):
+        return arg
+    if isinstance(arg, (int, float)):
+        return repr(arg).encode('ascii')
+    return arg.encode('utf-8')
+
+
+def pack_command(args):
+    """
+    encode a command as a list of buffers. payloads are passed through as
+    they are instead of being copied into a single string.
+    :param args: command name and arguments
+    :return: list of bytes
+    """
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        arg = _to_bytes(arg)
+        out.append(b'$%d\r\n' % len(arg))
+        out.append(arg)
+        out.append(CRLF)
+    return out
+
+
+class RespWriter(object):
+    """
+    A destination that writes RESTORE commands to a file instead of a
+    server. Commands are buffered and written in blocks of at least
+    `buffer_size` bytes.
+
+    There is no server to ask whether a key exists, so backfilling writes
+    RESTORE without REPLACE and lets the server refuse keys that exist when
+    the stream is replayed.
+    """
+    supports_replace = True
+
+    def __init__(self, out, buffer_size=1 << 20):
+        if out == '-':
+            self.name = '<stdout>'
+            self.out = getattr(sys.stdout, 'buffer', sys.stdout)
+            self._close = False
+        elif isinstance(out, string_types):
+            self.name = out
+            self.out = open(out, 'wb')
+            self._close = True
+        else:
+            self.name = getattr(out, 'name', '<stream>')
+            self.out = out
+            self._close = False
+        self.buffer_size = buffer_size
+        self.commands = 0
+        self._buffers = []
+        self._buffered = 0
+
+    @property
+    def to_stdout(self):
+        return self.out is getattr(sys.stdout, 'buffer', sys.stdout)
+
+    def write_command(self, *args):
+        buffers = pack_command(args)
+        self._buffers.extend(buffers)
+        self._buffered += sum(len(b) for b in buffers)
+        self.commands += 1
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffers:
+            self.out.write(b''.join(self._buffers))
+            self._buffers = []
+            self._buffered = 0
+        self.out.flush()
+
+    def close(self):
+        self.flush()
+        if self._close:
+            self.out.close()
+
+    def pipeline(self, transaction=False):
+        return RespWriterPipeline(self)
+
+
+class RespWriterPipeline(object):
+    """
+    Just enough of the redis pipeline interface for the copy functions.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._commands = []
+
+    def execute_command(self, *args, **options):
+        self._commands.append(args)
+        return self
+
+    def restore(self, name, ttl, value, replace=False, **kwargs):
+        args = ['RESTORE', name, ttl, value]
+        if replace:
+            args.append('REPLACE')
+        return self.execute_command(*args)
+
+    def exists(self, *names):
+        self._commands.append(None)
+        return self
+
+    def execute(self, raise_on_error=True):
+        commands, self._commands = self._commands, []
+        results = []
+        for args in commands:
+            if args is None:
+                results.append(0)
+                continue
+            self.writer.write_command(*args)
+            results.append(True)
+        return results
@@ -0,0 +1,199 @@
+"""
+Retry the writes a destination fails instead of giving up on the import.
+
+A batch is kept until the destination has answered for every key in it.
+The keys it refused are sent again on their own, after an exponential
+backoff, and a lost connection is dropped and opened again before the
+retry, which then replays the keys whose answers never came. Keys that
+already exist are left to the caller, and payloads the destination can't
+load are not retried, since sending them again won't change the answer.
+
+Keys that still fail after the last attempt are written to the failure
+log as json lines, so a long import can carry on and the stragglers be
+copied again later. Without a failure log the first of them is raised.
+A restore without REPLACE whose answer was lost may come back as busy on
+the retry, and is counted as skipped rather than written.
+"""
+import json
+import threading
+import time
+
+from .metrics import NULL_METRICS
+
+__all__ = ['Retry']
+
+# refusals that come back the same however often the key is sent
+PERMANENT = ('payload version or checksum', 'Bad data format')
+
+
+def _connection_errors():
+    from redis.exceptions import ConnectionError, TimeoutError
+    import socket
+    return ConnectionError, TimeoutError, socket.error
+
+
+def _is_busy(error):
+    # servers before 3.0 answer ERR Target key name is busy
+    message = str(error)
+    return message.startswith('BUSYKEY') or 'is busy' in message
+
+
+def _is_permanent(error):
+    message = str(error)
+    return any(text in message for text in PERMANENT)
+
+
+def _reconnect(dst):
+    """
+    drop the connections to the destination, and to each of its nodes,
+    so the next command opens a fresh one.
+    """
+    nodes = getattr(dst, 'nodes', None)
+    for node in (nodes if isinstance(nodes, list) else [dst]):
+        pool = getattr(node, 'connection_pool', None)
+        if pool is not None:
+            pool.disconnect()
+
+
+def _key_text(key):
+    if isinstance(key, bytes):
+        return key.decode('utf-8', 'backslashreplace')
+    return key
+
+
+class Retry(object):
+    """
+    How often, and how patiently, failed writes are sent again.
+
+    :param attempts: int how many times a key is sent before it is given up
+        on, the first time included
+    :param backoff: float seconds to wait before the first retry, doubling
+        with each one after it
+    :param max_backoff: float the longest wait between two attempts
+    :param failure_log: str path of the file keys that never made it are
+        appended to
+    """
+
+    def __init__(self, attempts=5, backoff=0.1, max_backoff=10.0,
+                 failure_log=None, sleep=time.sleep):
+        if attempts < 1:
+            raise ValueError('attempts must be at least 1, not %r' %
+                             attempts)
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_log = failure_log
+        self.failed = 0
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def delay(self, attempt):
+        """
+        :param attempt: int how many attempts were made so far
+        :return: float seconds to wait before the next one
+        """
+        return min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+
+    def _wait(self, dst, attempt, reconnect, metrics):
+        metrics.incr('retries')
+        self._sleep(self.delay(attempt))
+        if reconnect:
+            _reconnect(dst)
+
+    def _send(self, dst, rows, restore, metrics):
+        """
+        :return: list of the error for each row, or None if it was written
+        """
+        pipe = dst.pipeline(transaction=False)
+        for key, data, pttl in rows:
+            restore(pipe, key, pttl, data)
+        try:
+            with metrics.timer('restore'):
+                results = pipe.execute(raise_on_error=False)
+        except _connection_errors() as e:
+            return [e] * len(rows)
+        # the restore handler may send a DEL before each RESTORE
+        step = len(results) // len(rows)
+        return [result if isinstance(result, Exception) else None
+                for result in results[step - 1::step]]
+
+    def restore(self, dst, rows, restore, metrics=NULL_METRICS):
+        """
+        restore rows, sending the failed ones again until they are written
+        or out of attempts.
+        :param dst: destination
+        :param rows: list of (key, data, pttl)
+        :param restore: function(pipe, key, pttl, data) that queues a row
+        :param metrics: redisimp.Metrics
+        :return: tuple of the rows written, the keys that already exist
+            and (key, error) for the ones that never made it
+        """
+        written, busy, failed = [], [], []
+        pending = list(rows)
+        attempt = 0
+        while pending:
+            attempt += 1
+            errors = self._send(dst, pending, restore, metrics)
+            retry, reconnect = [], False
+            for row, error in zip(pending, errors):
+                if error is None:
+                    written.append(row)
+                elif _is_busy(error):
+                    metrics.incr('busykey_skips')
+                    busy.append(row[0])
+                elif attempt >= self.attempts or _is_permanent(error):
+                    failed.append((row[0], error))
+                else:
+                    retry.append(row)
+                    reconnect = reconnect or \
+                        isinstance(error, _connection_errors())
+            if retry:
+                self._wait(dst, attempt, reconnect, metrics)
+            pending = retry
+        return written, busy, failed
+
+    def call(self, dst, fn, metrics=NULL_METRICS):
+        """
+        call fn(), reconnecting and calling it again when the connection to
+        the destination is lost.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return fn()
+            except _connection_errors():
+                if attempt >= self.attempts:
+                    raise
+            self._wait(dst, attempt, True, metrics)
+
+    def record(self, failed):
+        """
+        append keys that never made it to the failure log.
+        :param failed: list of (key, error)
+        """
+        if not failed:
+            return
+        with self._lock:
+            self.failed += len(failed)
+            if self.failure_log is None:
+                return
+            with open(self.failure_log, 'a') as f:
+                for key, error in failed:
+                    f.write(json.dumps({
+                        'key': _key_text(key),
+                        'error': str(error),
+                    }) + '\n')
+
+    def give_up(self, failed):
+        """
+        record keys that never made it, raising the first error if there
+        is no failure log to keep them in.
+        """
+        if failed and self.failure_log is None:
+            raise failed[0][1]
+        self.record(failed)
+
+
+# the behavior without a policy, a single attempt that raises
+NO_RETRY = Retry(attempts=1)
@@ -0,0 +1,69 @@
+"""
+Copy a reproducible fraction of the keys.
+
+A key is in the sample when a seeded 64-bit hash of it falls below
+`fraction` of the hash space. The same seed picks the same keys on every
+run and from every kind of source, and a bigger fraction picks a superset
+of the keys a smaller one does. Only the `{hash tag}` of a key is hashed,
+so keys that share a tag are kept or left out together.
+
+The sampler is a plain key filter. rdb files apply it before the value of
+a key is read, so the values of keys left out are skipped over, and live
+sources apply it to the SCAN results before anything is dumped.
+"""
+import hashlib
+import struct
+
+from .sharded import hash_tag
+
+__all__ = ['Sampler', 'sampler_for']
+
+
+class Sampler(object):
+    """
+    Decides which keys are in the sample.
+
+    :param fraction: float between 0 and 1 of the keys to keep
+    :param seed: int picks a different sample of the same size
+    :param hash_tags: bool hash only the {hash tag} of keys that have one
+    """
+
+    def __init__(self, fraction, seed=0, hash_tags=True):
+        if not 0 <= fraction <= 1:
+            raise ValueError('the sample fraction must be between 0 and 1, '
+                             'not %r' % fraction)
+        self.fraction = fraction
+        self.seed = seed
+        self.hash_tags = hash_tags
+        self._key = struct.pack('<Q', seed)
+        self._limit = int(fraction * (1 << 64))
+
+    def hash(self, key):
+        """
+        :param key: bytes
+        :return: int the 64-bit hash the key is sampled by
+        """
+        if self.hash_tags:
+            key = hash_tag(key)
+        digest = hashlib.blake2b(key, digest_size=8, key=self._key).digest()
+        return struct.unpack('<Q', digest)[0]
+
+    def __call__(self, key):
+        return self.hash(key) < self._limit
+
+    def filter(self, keys):
+        """
+        :param keys: list of bytes
+        :return: list of the keys in the sample
+        """
+        return [key for key in keys if self.hash(key) < self._limit]
+
+
+def sampler_for(fraction, seed=0):
+    """
+    :param fraction: float of the keys to pick, or None
+    :return: Sampler, or None if every key is wanted
+    """
+    if fraction is None or fraction >= 1:
+        return None
+    return Sampler(fraction, seed)
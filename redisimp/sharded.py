@@ -0,0 +1,217 @@
+"""
+Client-side sharding over standalone redis nodes.
+
+Fleets that shard with a client library instead of redis cluster put each
+key on one of N nodes by hashing it. ShardedRedis routes every key the same
+way so an import can re-shard a source onto the nodes in one pass:
+
+    crc16   the redis cluster slot, with the 16384 slots split into N
+            contiguous ranges
+    ketama  the libketama / twemproxy consistent hash ring, 160 points per
+            node named host:port
+    modulo  crc32 of the key modulo N
+
+Hash tags are honoured by every scheme, so `{user1}:a` and `{user1}:b` land
+on the same node.
+"""
+import hashlib
+import struct
+import zlib
+from binascii import crc_hqx
+from bisect import bisect
+
+from .api import _conn_name, _supports_replace
+
+__all__ = ['ShardedRedis', 'SCHEMES']
+
+SCHEMES = ('crc16', 'ketama', 'modulo')
+
+KETAMA_POINTS = 160
+
+REDIS_CLUSTER_HASH_SLOTS = 16384
+
+
+def hash_tag(key):
+    """
+    the part of the key between the first { and the following }, if it
+    isn't empty, otherwise the whole key.
+    """
+    start = key.find(b'{')
+    if start >= 0:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def _ketama_ring(names):
+    ring = []
+    for index, name in enumerate(names):
+        for i in range(KETAMA_POINTS // 4):
+            digest = hashlib.md5(('%s-%d' % (name, i)).encode('utf-8'))
+            for point in struct.unpack('<4I', digest.digest()):
+                ring.append((point, index))
+    ring.sort()
+    return [p for p, _ in ring], [i for _, i in ring]
+
+
+class ShardedRedis(object):
+    """
+    A destination that spreads keys over standalone nodes.
+    Pipelines keep one pipeline per node and flush them in parallel.
+
+    :param nodes: list of redis connections
+    :param scheme: str crc16, ketama or modulo
+    :param hash_tags: bool hash only the {tag} part of keys that have one
+    """
+
+    def __init__(self, nodes, scheme='crc16', hash_tags=True):
+        if scheme not in SCHEMES:
+            raise ValueError('unknown shard scheme %s' % scheme)
+        if not nodes:
+            raise ValueError('no nodes to shard over')
+        self.nodes = list(nodes)
+        self.scheme = scheme
+        self.hash_tags = hash_tags
+        self.names = [_conn_name(node) for node in self.nodes]
+        self.name = ','.join(self.names)
+        self.supports_replace = all(_supports_replace(node)
+                                    for node in self.nodes)
+        if scheme == 'ketama':
+            self._points, self._owners = _ketama_ring(self.names)
+        self._executor = None
+
+    def node_index(self, key):
+        """
+        :param key: bytes
+        :return: int index of the node that owns the key
+        """
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        if self.hash_tags:
+            key = hash_tag(key)
+        n = len(self.nodes)
+        if self.scheme == 'crc16':
+            slot = crc_hqx(key, 0) % REDIS_CLUSTER_HASH_SLOTS
+            return slot * n // REDIS_CLUSTER_HASH_SLOTS
+        if self.scheme == 'modulo':
+            return (zlib.crc32(key) & 0xffffffff) % n
+        point = struct.unpack('<I', hashlib.md5(key).digest()[:4])[0]
+        i = bisect(self._points, point)
+        return self._owners[i % len(self._owners)]
+
+    def node_for(self, key):
+        return self.nodes[self.node_index(key)]
+
+    def node_name(self, key):
+        return self.names[self.node_index(key)]
+
+    def pipeline(self, transaction=False):
+        return ShardedPipeline(self)
+
+    def map(self, fn, items):
+        """
+        run fn over items with a thread per node.
+        """
+        if len(items) < 2:
+            return [fn(item) for item in items]
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=len(self.nodes))
+        return [f.result() for f in
+                [self._executor.submit(fn, item) for item in items]]
+
+    def ping(self):
+        return all(self.map(lambda node: node.ping(), self.nodes))
+
+    def info(self, section=None):
+        """
+        :return: dict of node name to the info of that node, the way
+            cluster clients return it
+        """
+        infos = self.map(lambda node: node.info(section), self.nodes)
+        return dict(zip(self.names, infos))
+
+    def scan_iter(self, match=None, count=None):
+        for node in self.nodes:
+            for key in node.scan_iter(match=match, count=count):
+                yield key
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+class ShardedPipeline(object):
+    """
+    Just enough of the redis pipeline interface for the copy functions.
+    Keys are routed as commands are added, multi key EXISTS and DEL are
+    split by node and their replies summed.
+    """
+
+    def __init__(self, sharded):
+        self.sharded = sharded
+        self._pipes = {}
+        self._counts = {}
+        self._order = []
+
+    def _route(self, args):
+        index = self.sharded.node_index(args[1])
+        pipe = self._pipes.get(index)
+        if pipe is None:
+            pipe = self._pipes[index] = \
+                self.sharded.nodes[index].pipeline(transaction=False)
+            self._counts[index] = 0
+        pipe.execute_command(*args)
+        self._counts[index] += 1
+        return index, self._counts[index] - 1
+
+    def execute_command(self, *args, **options):
+        self._order.append([self._route(args)])
+        return self
+
+    def restore(self, name, ttl, value, replace=False, **kwargs):
+        args = ('RESTORE', name, ttl, value)
+        if replace:
+            args += ('REPLACE',)
+        return self.execute_command(*args)
+
+    def _multi_key(self, command, names):
+        self._order.append([self._route((command, name))
+                            for name in names])
+        return self
+
+    def exists(self, *names):
+        return self._multi_key('EXISTS', names)
+
+    def delete(self, *names):
+        return self._multi_key('DEL', names)
+
+    def execute(self, raise_on_error=True):
+        pipes, self._pipes = self._pipes, {}
+        order, self._order = self._order, []
+        self._counts = {}
+        indexes = list(pipes)
+
+        def flush(index):
+            try:
+                return pipes[index].execute(raise_on_error=raise_on_error)
+            except Exception as e:
+                return e
+
+        # let every node finish before raising for one of them
+        replies = dict(zip(indexes, self.sharded.map(flush, indexes)))
+        for reply in replies.values():
+            if isinstance(reply, Exception):
+                raise reply
+
+        results = []
+        for routes in order:
+            if len(routes) == 1:
+                index, pos = routes[0]
+                results.append(replies[index][pos])
+            else:
+                results.append(sum(replies[index][pos]
+                                   for index, pos in routes))
+        return results
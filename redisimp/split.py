@@ -0,0 +1,235 @@
+"""
+Write large keys in bounded pieces instead of a single RESTORE.
+
+Restoring a huge hash or sorted set in one command blocks the destination
+for as long as it takes to build it, and a payload over
+`proto-max-bulk-len` is refused outright. Above a size threshold the
+payload is decoded and its elements are written to a temporary key with
+HSET/SADD/RPUSH/ZADD/APPEND commands of at most `chunk_elements` elements
+or `chunk_bytes` bytes each. The temporary key gets the ttl and is then
+renamed over the real key, so readers never see it half built.
+
+The temporary key keeps the hash tag of the key, so it lives on the same
+cluster slot or shard.
+"""
+import os
+import time
+
+from .api import _supports_replace, _takes_commands
+from .decode import decode_payload, UnsupportedPayload
+from .sharded import hash_tag
+
+__all__ = ['SplitLargeKeys', 'split_large_keys']
+
+# the reply RESTORE gives without REPLACE, which the copy functions check for
+BUSYKEY = 'BUSYKEY Target key name is busy.'
+
+COMMANDS = {
+    'hash': 'HSET',
+    'set': 'SADD',
+    'list': 'RPUSH',
+    'zset': 'ZADD',
+}
+
+
+def temporary_key(key):
+    """
+    a key name in the same hash slot as `key`.
+    :return: bytes or None if there is no such name
+    """
+    suffix = b':redisimp-split:' + os.urandom(6).hex().encode('ascii')
+    if hash_tag(key) != key:
+        return key + suffix
+    if b'}' in key:
+        return None
+    return b'{' + key + b'}' + suffix
+
+
+def _chunks(kind, items, chunk_elements, chunk_bytes):
+    """
+    group the elements into argument lists for one command each.
+    """
+    args = []
+    size = 0
+    for item in items:
+        if kind == 'zset':
+            member, score = item
+            args.extend((score, member))
+            size += len(member) + len(score)
+        elif kind == 'hash':
+            args.extend(item)
+            size += len(item[0]) + len(item[1])
+        else:
+            args.append(item)
+            size += len(item)
+        if len(args) >= chunk_elements * (2 if kind in ('zset', 'hash')
+                                          else 1) or size >= chunk_bytes:
+            yield args
+            args = []
+            size = 0
+    if args:
+        yield args
+
+
+class SplitLargeKeys(object):
+    """
+    A destination wrapping a redis connection, cluster or ShardedRedis.
+    RESTOREs of payloads of at least `threshold` bytes are written in
+    pieces, everything else passes through.
+
+    :param conn: destination
+    :param threshold: int payload size in bytes
+    :param chunk_elements: int max elements per command
+    :param chunk_bytes: int max bytes per command
+    """
+
+    def __init__(self, conn, threshold=64 << 20, chunk_elements=1000,
+                 chunk_bytes=1 << 20, clock=time.time):
+        self.conn = conn
+        self.threshold = threshold
+        self.chunk_elements = chunk_elements
+        self.chunk_bytes = chunk_bytes
+        self.supports_replace = _supports_replace(conn)
+        self.split = 0
+        self._clock = clock
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def pipeline(self, transaction=False):
+        return SplitLargeKeysPipeline(self)
+
+    def _run(self, *commands):
+        """
+        :return: tuple of the replies and the first error reply, or None
+        """
+        pipe = self.conn.pipeline(transaction=False)
+        for args in commands:
+            pipe.execute_command(*args)
+        replies = pipe.execute(raise_on_error=False)
+        for reply in replies:
+            if isinstance(reply, Exception):
+                return replies, reply
+        return replies, None
+
+    def write(self, key, pttl, data, replace=True):
+        """
+        write one key in pieces.
+        :return: True, or a ResponseError if the key exists and replace is
+            False, or the error reply a command got, e.g. OOM
+        :raises UnsupportedPayload: if the key can't be split
+        """
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        kind, items = decode_payload(data)
+        tmp = temporary_key(key)
+        if tmp is None:
+            raise UnsupportedPayload('no temporary key in the same slot')
+        try:
+            for args in self._commands(kind, items):
+                _, error = self._run((args[0], tmp) + args[1:])
+                if error is not None:
+                    break
+            else:
+                commands = []
+                if pttl:
+                    at = int(self._clock() * 1000) + int(pttl)
+                    commands.append(('PEXPIREAT', tmp, at))
+                commands.append(('RENAME' if replace else 'RENAMENX', tmp,
+                                 key))
+                replies, error = self._run(*commands)
+                renamed = replies[-1]
+        except Exception:
+            self._run(('DEL', tmp))
+            raise
+        if error is not None:
+            # handed back like the error of any other command in the batch
+            self._run(('DEL', tmp))
+            return error
+        self.split += 1
+        if not renamed:
+            from redis.exceptions import ResponseError
+            self._run(('DEL', tmp))
+            return ResponseError(BUSYKEY)
+        return True
+
+    def _commands(self, kind, items):
+        if kind == 'string':
+            value = next(items)
+            for start in range(0, len(value), self.chunk_bytes):
+                yield ('APPEND', value[start:start + self.chunk_bytes])
+            return
+        command = COMMANDS[kind]
+        for args in _chunks(kind, items, self.chunk_elements,
+                            self.chunk_bytes):
+            yield (command,) + tuple(args)
+
+
+class SplitLargeKeysPipeline(object):
+    """
+    Just enough of the redis pipeline interface for the copy functions.
+    Small commands are sent in one pipeline, then the large keys are
+    written one after another.
+    """
+
+    def __init__(self, splitter):
+        self.splitter = splitter
+        self._pipe = splitter.conn.pipeline(transaction=False)
+        self._order = []
+
+    def execute_command(self, *args, **options):
+        command = args[0].upper() if isinstance(args[0], str) else args[0]
+        if command == 'RESTORE' and len(args[3]) >= self.splitter.threshold:
+            self._order.append((args[1], args[2], args[3],
+                                'REPLACE' in args[4:]))
+            return self
+        self._pipe.execute_command(*args, **options)
+        self._order.append(None)
+        return self
+
+    def restore(self, name, ttl, value, replace=False, **kwargs):
+        args = ('RESTORE', name, ttl, value)
+        if replace:
+            args += ('REPLACE',)
+        return self.execute_command(*args)
+
+    def exists(self, *names):
+        return self.execute_command('EXISTS', *names)
+
+    def delete(self, *names):
+        return self.execute_command('DEL', *names)
+
+    def _write(self, key, pttl, data, replace, raise_on_error):
+        try:
+            result = self.splitter.write(key, pttl, data, replace)
+        except UnsupportedPayload:
+            pipe = self.splitter.conn.pipeline(transaction=False)
+            pipe.restore(key, pttl, data, replace=replace)
+            result = pipe.execute(raise_on_error=raise_on_error)[0]
+        if raise_on_error and isinstance(result, Exception):
+            raise result
+        return result
+
+    def execute(self, raise_on_error=True):
+        order, self._order = self._order, []
+        pipe = self._pipe
+        self._pipe = self.splitter.conn.pipeline(transaction=False)
+        replies = iter(pipe.execute(raise_on_error=raise_on_error))
+        results = []
+        for item in order:
+            if item is None:
+                results.append(next(replies))
+            else:
+                results.append(self._write(*(item + (raise_on_error,))))
+        return results
+
+
+def split_large_keys(conn, threshold, chunk_elements=1000,
+                     chunk_bytes=1 << 20):
+    """
+    wrap a destination in SplitLargeKeys if it takes redis commands,
+    otherwise return it as it is.
+    """
+    if _takes_commands(conn):
+        return SplitLargeKeys(conn, threshold, chunk_elements, chunk_bytes)
+    return conn
@@ -0,0 +1,145 @@
+"""
+Rate limits for reading from the source and writing to the destination.
+"""
+import time
+
+__all__ = ['Throttle', 'TokenBucket', 'LatencyGovernor']
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` units per second with bursts of up to `burst` units.
+    Consuming more than is available puts the bucket into debt and sleeps
+    until the debt is paid off, so large batches are smoothed out over time.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.tokens = self.burst
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+
+    def consume(self, amount, scale=1.0):
+        """
+        take `amount` tokens, sleeping if the bucket runs dry.
+        :param amount: int
+        :param scale: float multiplier applied to the rate
+        :return: float seconds slept
+        """
+        rate = self.rate * scale
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * rate)
+        self._last = now
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+
+        wait = -self.tokens / rate
+        self._sleep(wait)
+        return wait
+
+
+class LatencyGovernor(object):
+    """
+    Samples the round trip time of a PING against the destination every
+    `interval` seconds. When it goes over the target, the copy slows down
+    by halving its scale. When it recovers the scale creeps back up.
+    """
+
+    def __init__(self, conn, target_ms, interval=1.0, min_scale=0.05,
+                 clock=time.time):
+        self.conn = conn
+        self.target_ms = float(target_ms)
+        self.interval = interval
+        self.min_scale = min_scale
+        self.scale = 1.0
+        self.latency_ms = None
+        self._clock = clock
+        self._last = None
+
+    def sample(self):
+        start = self._clock()
+        self.conn.ping()
+        self.latency_ms = (self._clock() - start) * 1000.0
+
+        if self.latency_ms > self.target_ms:
+            self.scale = max(self.min_scale, self.scale / 2)
+        else:
+            self.scale = min(1.0, self.scale + 0.1)
+
+    def check(self):
+        """
+        sample the destination if the interval elapsed.
+        :return: float the current scale
+        """
+        now = self._clock()
+        if self._last is None or now - self._last >= self.interval:
+            self._last = now
+            self.sample()
+        return self.scale
+
+
+class Throttle(object):
+    """
+    Keys/sec and bytes/sec limits for source reads and destination writes,
+    optionally scaled down by a LatencyGovernor watching the destination.
+    With no limits configured every call is a no-op.
+    """
+
+    def __init__(self, read_keys=None, read_bytes=None, write_keys=None,
+                 write_bytes=None, governor=None, clock=time.time,
+                 sleep=time.sleep):
+        def bucket(rate):
+            return TokenBucket(rate, clock=clock, sleep=sleep) \
+                if rate else None
+
+        self._read = [bucket(read_keys), bucket(read_bytes)]
+        self._write = [bucket(write_keys), bucket(write_bytes)]
+        self.governor = governor
+        self._clock = clock
+        self._sleep = sleep
+        self._last_write = None
+
+    @staticmethod
+    def _consume(buckets, keys, nbytes, scale=1.0):
+        keys_bucket, bytes_bucket = buckets
+        if keys_bucket is not None:
+            keys_bucket.consume(keys, scale)
+        if bytes_bucket is not None:
+            bytes_bucket.consume(nbytes, scale)
+
+    def read(self, keys, nbytes=0):
+        """
+        account for a batch read from the source.
+        :param keys: int
+        :param nbytes: int
+        """
+        self._consume(self._read, keys, nbytes)
+
+    def write(self, keys, nbytes=0):
+        """
+        account for a batch about to be written to the destination.
+        :param keys: int
+        :param nbytes: int
+        """
+        scale = 1.0
+        if self.governor is not None:
+            scale = self.governor.check()
+            now = self._clock()
+            if scale < 1.0 and self._last_write is not None \
+                    and self._write == [None, None]:
+                # no explicit rate to scale; stretch the time between
+                # batches instead.
+                self._sleep((now - self._last_write) * (1.0 / scale - 1))
+            self._last_write = self._clock()
+
+        self._consume(self._write, keys, nbytes, scale)
+
+
+def payload_bytes(rows):
+    """
+    total size of the DUMP payloads in a batch of (key, data, pttl) rows.
+    """
+    return sum(len(row[1]) for row in rows)
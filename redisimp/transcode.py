@@ -0,0 +1,220 @@
+"""
+Make DUMP payloads from newer redis versions restorable on older ones.
+
+RESTORE refuses a payload whose rdb version is newer than the server's.
+Most of the time the serialized value itself is still one the older server
+understands, only the version stamp is too new. Those payloads are
+re-stamped, and since the crc64 redis uses is linear, the new checksum is
+worked out from the old one without reading the payload again. Values in
+an encoding the destination doesn't know, like the listpacks of redis 7,
+are decoded and written back as plain lists, sets, sorted sets and hashes,
+which every version loads.
+"""
+import re
+import struct
+
+from .api import _supports_replace, _takes_commands
+from .crc64 import crc64
+from .decode import decode_payload, UnsupportedPayload
+from .rdbwriter import encode_length, encode_string
+from .rdbparser import (
+    REDIS_RDB_TYPE_LIST,
+    REDIS_RDB_TYPE_SET,
+    REDIS_RDB_TYPE_ZSET,
+    REDIS_RDB_TYPE_ZSET_2,
+    REDIS_RDB_TYPE_HASH,
+)
+
+__all__ = ['Transcoder', 'transcode_payload', 'transcoding',
+           'rdb_version_for']
+
+# the newest rdb version each redis release loads, newest release first
+RDB_VERSIONS = [
+    ((7, 4), 12),
+    ((7, 2), 11),
+    ((7, 0), 10),
+    ((5, 0), 9),
+    ((4, 0), 8),
+    ((3, 2), 7),
+    ((2, 6), 6),
+]
+
+# the oldest rdb version that knows each object type
+TYPE_RDB_VERSIONS = {
+    0: 1, 1: 1, 2: 1, 3: 1, 4: 1,
+    5: 8,
+    9: 1, 10: 1, 11: 1, 12: 1, 13: 1,
+    14: 7,
+    16: 10, 17: 10, 18: 10,
+    20: 11,
+}
+
+
+def rdb_version_for(redis_version):
+    """
+    :param redis_version: str e.g. 6.2.14
+    :return: int the newest rdb version that release can restore
+    """
+    release = tuple(int(x) for x in re.findall(r'\d+', redis_version)[:2])
+    for since, version in RDB_VERSIONS:
+        if release >= since:
+            return version
+    return RDB_VERSIONS[-1][1]
+
+
+def destination_rdb_version(conn):
+    """
+    :return: int the rdb version the oldest node of the destination
+        restores, or None if it doesn't say
+    """
+    info = conn.info('server')
+    if 'redis_version' in info:
+        versions = [info['redis_version']]
+    else:
+        # clusters return the info of each node
+        versions = [v['redis_version'] for v in info.values()
+                    if isinstance(v, dict) and 'redis_version' in v]
+    if not versions:
+        return None
+    return min(rdb_version_for(v) for v in versions)
+
+
+def _payload_version(data):
+    return struct.unpack('<H', data[-10:-8])[0]
+
+
+def restamp(data, version):
+    """
+    change the rdb version of a payload and fix up its checksum.
+    """
+    old = data[-10:-8]
+    new = struct.pack('<H', version)
+    crc = struct.unpack('<Q', data[-8:])[0]
+    # with a zero initial value the crc of leading zero bytes is zero, so
+    # the crc of the change is the crc of the two bytes that differ.
+    crc ^= crc64(bytes(a ^ b for a, b in zip(old, new)))
+    return data[:-10] + new + struct.pack('<Q', crc)
+
+
+def _encode_score(score, version):
+    if version >= TYPE_RDB_VERSIONS[REDIS_RDB_TYPE_ZSET_2]:
+        return struct.pack('<d', float(score))
+    if score in (b'nan', b'inf', b'-inf'):
+        return struct.pack('B', {b'nan': 253, b'inf': 254,
+                                 b'-inf': 255}[score])
+    return struct.pack('B', len(score)) + score
+
+
+def _encode_plain(data, version):
+    kind, items = decode_payload(data)
+    items = list(items)
+    out = []
+    if kind == 'list' or kind == 'set':
+        enc_type = REDIS_RDB_TYPE_LIST if kind == 'list' else \
+            REDIS_RDB_TYPE_SET
+        for item in items:
+            out.append(encode_string(item))
+    elif kind == 'zset':
+        enc_type = REDIS_RDB_TYPE_ZSET_2 if version >= TYPE_RDB_VERSIONS[
+            REDIS_RDB_TYPE_ZSET_2] else REDIS_RDB_TYPE_ZSET
+        for member, score in items:
+            out.append(encode_string(member))
+            out.append(_encode_score(score, version))
+    elif kind == 'hash':
+        enc_type = REDIS_RDB_TYPE_HASH
+        for field, value in items:
+            out.append(encode_string(field))
+            out.append(encode_string(value))
+    else:
+        raise UnsupportedPayload('%s values are never re-encoded' % kind)
+    return struct.pack('B', enc_type) + encode_length(len(items)) + \
+        b''.join(out)
+
+
+def transcode_payload(data, version):
+    """
+    :param data: bytes a DUMP payload
+    :param version: int the rdb version the destination restores
+    :return: bytes a payload that version restores. payloads that are
+        already old enough, or can't be transcoded, come back unchanged.
+    """
+    if _payload_version(data) <= version:
+        return data
+    needs = TYPE_RDB_VERSIONS.get(data[0])
+    if needs is None:
+        return data
+    if needs <= version:
+        return restamp(data, version)
+    try:
+        body = _encode_plain(data, version) + struct.pack('<H', version)
+    except UnsupportedPayload:
+        return data
+    return body + struct.pack('<Q', crc64(body))
+
+
+class Transcoder(object):
+    """
+    A destination wrapper that transcodes RESTORE payloads for destinations
+    older than the source.
+
+    :param conn: destination
+    :param version: int the rdb version to transcode to, read from the
+        destination's INFO if not given
+    """
+
+    def __init__(self, conn, version=None):
+        self.conn = conn
+        self.version = version or destination_rdb_version(conn)
+        self.supports_replace = _supports_replace(conn)
+        self.transcoded = 0
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def transcode(self, data):
+        result = transcode_payload(data, self.version)
+        if result is not data:
+            self.transcoded += 1
+        return result
+
+    def pipeline(self, transaction=False):
+        return TranscoderPipeline(self)
+
+
+class TranscoderPipeline(object):
+    """
+    Passes everything through to the wrapped pipeline, transcoding the
+    payloads of RESTORE on the way.
+    """
+
+    def __init__(self, transcoder):
+        self.transcoder = transcoder
+        self._pipe = transcoder.conn.pipeline(transaction=False)
+
+    def __getattr__(self, name):
+        return getattr(self._pipe, name)
+
+    def execute_command(self, *args, **options):
+        if args[0] == 'RESTORE':
+            args = args[:3] + (self.transcoder.transcode(args[3]),) + args[4:]
+        self._pipe.execute_command(*args, **options)
+        return self
+
+    def restore(self, name, ttl, value, replace=False, **kwargs):
+        self._pipe.restore(name, ttl, self.transcoder.transcode(value),
+                           replace=replace, **kwargs)
+        return self
+
+
+def transcoding(conn, version=None):
+    """
+    wrap a destination in a Transcoder. redis destinations are wrapped to
+    match their own version, others only when a version is given.
+    """
+    if version:
+        return Transcoder(conn, version)
+    if _takes_commands(conn):
+        version = destination_rdb_version(conn)
+        if version:
+            return Transcoder(conn, version)
+    return conn
@@ -0,0 +1,276 @@
+"""
+Compare the keys in a source with the destination after a copy.
+"""
+from collections import namedtuple, deque
+
+from six import string_types
+
+from .api import (
+    _read_keys,
+    _chunks,
+    _get_restore_handler,
+    _is_cluster,
+    rdb_regex_pattern,
+)
+from .rdbparser import parse_rdb
+from .archive import ArchiveReader, is_archive
+from .sampler import sampler_for
+
+__all__ = ['verify', 'Mismatch']
+
+# repaired tells if the key was rewritten from the source
+Mismatch = namedtuple('Mismatch', ['key', 'reason', 'repaired'])
+Mismatch.__new__.__defaults__ = (False,)
+
+MISSING_DIGEST = b'0' * 40
+
+LENGTH_COMMANDS = {
+    b'string': 'STRLEN',
+    b'list': 'LLEN',
+    b'set': 'SCARD',
+    b'zset': 'ZCARD',
+    b'hash': 'HLEN',
+    b'stream': 'XLEN',
+}
+
+
+def _supports_digest(conn):
+    from redis.exceptions import ResponseError
+    if _is_cluster(conn):
+        return False
+    try:
+        conn.execute_command('DEBUG', 'DIGEST-VALUE', '__redisimp_probe__')
+    except ResponseError:
+        return False
+    return True
+
+
+def _ttl_differs(src_pttl, dst_pttl):
+    return (int(src_pttl) > 0) != (int(dst_pttl) > 0)
+
+
+def _payload_differs(a, b):
+    # the trailer is a 2 byte rdb version and the crc64 of the payload. if
+    # both sides serialized with the same version the crc is enough,
+    # otherwise compare the bodies.
+    if a[-10:-8] == b[-10:-8]:
+        return a[-8:] != b[-8:]
+    return a[:-10] != b[:-10]
+
+
+def _rewrite(dst, restore, rows):
+    """
+    restore rows over the keys in the destination.
+    :return: set of the keys rewritten
+    """
+    if not rows:
+        return set()
+    pipe = dst.pipeline(transaction=False)
+    for key, data, pttl in rows:
+        restore(pipe, key, max(int(pttl), 0), data)
+    results = pipe.execute(raise_on_error=False)
+    # the restore handler may send a DEL before each RESTORE
+    step = len(results) // len(rows)
+    return set(row[0] for row, result in zip(rows, results[step - 1::step])
+               if not isinstance(result, Exception))
+
+
+def _repaired(mismatches, keys):
+    return [m._replace(repaired=True) if m.key in keys else m
+            for m in mismatches]
+
+
+def _repair(src, dst, restore, mismatches):
+    """
+    rewrite the mismatched keys from the source.
+    :return: list of the mismatches, marked if they were repaired
+    """
+    if not mismatches:
+        return mismatches
+    keys = [m.key for m in mismatches]
+    pipe = src.pipeline(transaction=False)
+    for key in keys:
+        pipe.dump(key)
+        pipe.pttl(key)
+    res = pipe.execute()
+    rows = [(key, res[i * 2], res[i * 2 + 1]) for i, key in enumerate(keys)
+            if res[i * 2] is not None]
+    return _repaired(mismatches, _rewrite(dst, restore, rows))
+
+
+def _compare_rows(dst, rows, restore=None):
+    pipe = dst.pipeline(transaction=False)
+    for key, data, pttl in rows:
+        pipe.dump(key)
+        pipe.pttl(key)
+    res = pipe.execute()
+
+    mismatches = []
+    for i, (key, data, pttl) in enumerate(rows):
+        dst_data, dst_pttl = res[i * 2], res[i * 2 + 1]
+        if dst_data is None:
+            mismatches.append((Mismatch(key, 'missing'), data, pttl))
+        elif _payload_differs(data, dst_data):
+            mismatches.append((Mismatch(key, 'value'), data, pttl))
+        elif _ttl_differs(pttl, dst_pttl):
+            mismatches.append((Mismatch(key, 'ttl'), data, pttl))
+
+    found = [m for m, _, _ in mismatches]
+    if restore is not None and mismatches:
+        rows = [(m.key, data, pttl) for m, data, pttl in mismatches]
+        return _repaired(found, _rewrite(dst, restore, rows))
+    return found
+
+
+def _dump_batch(src, dst, keys, restore=None):
+    pipe = src.pipeline(transaction=False)
+    for key in keys:
+        pipe.dump(key)
+        pipe.pttl(key)
+    res = pipe.execute()
+    rows = [(key, res[i * 2], res[i * 2 + 1]) for i, key in enumerate(keys)
+            if res[i * 2] is not None]
+    return _compare_rows(dst, rows, restore)
+
+
+def _digest_batch(src, dst, keys, restore=None):
+    results = []
+    for conn in (src, dst):
+        pipe = conn.pipeline(transaction=False)
+        for key in keys:
+            pipe.execute_command('DEBUG', 'DIGEST-VALUE', key)
+            pipe.pttl(key)
+        results.append(pipe.execute())
+    src_res, dst_res = results
+
+    mismatches = []
+    for i, key in enumerate(keys):
+        src_digest, src_pttl = src_res[i * 2][0], src_res[i * 2 + 1]
+        dst_digest, dst_pttl = dst_res[i * 2][0], dst_res[i * 2 + 1]
+        if src_digest == MISSING_DIGEST:
+            continue
+        if dst_digest == MISSING_DIGEST:
+            mismatches.append(Mismatch(key, 'missing'))
+        elif src_digest != dst_digest:
+            mismatches.append(Mismatch(key, 'value'))
+        elif _ttl_differs(src_pttl, dst_pttl):
+            mismatches.append(Mismatch(key, 'ttl'))
+
+    if restore is not None:
+        return _repair(src, dst, restore, mismatches)
+    return mismatches
+
+
+def _lengths(conn, keys):
+    pipe = conn.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+        pipe.pttl(key)
+    res = pipe.execute()
+    types = res[0::2]
+
+    pipe = conn.pipeline(transaction=False)
+    for key, t in zip(keys, types):
+        command = LENGTH_COMMANDS.get(t)
+        if command:
+            pipe.execute_command(command, key)
+        else:
+            pipe.exists(key)
+    return zip(types, pipe.execute(), res[1::2])
+
+
+def _length_batch(src, dst, keys, restore=None):
+    mismatches = []
+    for key, s, d in zip(keys, _lengths(src, keys), _lengths(dst, keys)):
+        if s[0] == b'none':
+            continue
+        if d[0] == b'none':
+            mismatches.append(Mismatch(key, 'missing'))
+        elif s[0] != d[0]:
+            mismatches.append(Mismatch(key, 'type'))
+        elif s[1] != d[1]:
+            mismatches.append(Mismatch(key, 'length'))
+        elif _ttl_differs(s[2], d[2]):
+            mismatches.append(Mismatch(key, 'ttl'))
+
+    if restore is not None:
+        return _repair(src, dst, restore, mismatches)
+    return mismatches
+
+
+def _verify_method(src, dst, method):
+    if method == 'auto':
+        if _supports_digest(src) and _supports_digest(dst):
+            method = 'digest'
+        else:
+            method = 'dump'
+    return {
+        'digest': _digest_batch,
+        'dump': _dump_batch,
+        'length': _length_batch,
+    }[method]
+
+
+def _in_order(executor, fn, batches, window):
+    pending = deque()
+    for batch in batches:
+        pending.append(executor.submit(fn, batch))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def verify(src, dst, pattern=None, sample=None, repair=False, method='auto',
+           workers=4, batch_size=500):
+    """
+    Compare every key in the source with the destination.
+    yields a Mismatch for each key that is missing or differs, with
+    `repaired` set if it was rewritten from the source.
+    The comparison uses DEBUG DIGEST-VALUE if both sides support it,
+    otherwise the crc64 trailer of DUMP. The `length` method only compares
+    type, length and ttl which is cheapest but least precise.
+    RDB file and archive sources are always compared by payload.
+    :param src: redis.StrictRedis or str path to an rdb file or archive
+    :param dst: redis.StrictRedis or redis.RedisCluster
+    :param pattern: str
+    :param sample: float fraction of keys to check, chosen by key hash
+    :param repair: bool restore mismatched keys from the source
+    :param method: str auto, digest, dump or length
+    :param workers: int how many batches to check concurrently
+    :param batch_size: int
+    :return: generator
+    """
+    restore = _get_restore_handler(dst) if repair else None
+    sampled = sampler_for(sample)
+
+    if isinstance(src, string_types):
+        key_filter = rdb_regex_pattern(pattern)
+        if is_archive(src):
+            rows = (row for row in ArchiveReader(src)
+                    if key_filter(row[0]))
+        else:
+            rows = parse_rdb(src, key_filter)
+        if sampled:
+            rows = (row for row in rows if sampled(row[0]))
+        batches = ([row for row in chunk if row is not None]
+                   for chunk in _chunks(rows, batch_size))
+
+        def check(rows):
+            return _compare_rows(dst, rows, restore)
+    else:
+        batches = _read_keys(src, batch_size=batch_size, pattern=pattern)
+        if sampled:
+            batches = ([key for key in keys if sampled(key)]
+                       for keys in batches)
+        fn = _verify_method(src, dst, method)
+
+        def check(keys):
+            return fn(src, dst, keys, restore)
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for mismatches in _in_order(executor, check, batches, workers * 2):
+            for mismatch in mismatches:
+                yield mismatch
@@ -2,8 +2,18 @@
 
 # std lib
 import os
+import json
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from six import StringIO
+from six import StringIO, BytesIO
+from six.moves.urllib.request import urlopen
 
 # 3rd party
 import redis
@@ -11,6 +21,8 @@ import redislite.patch
 
 # our package
 import redisimp  # noqa
+from redisimp import transcode
+from redisimp.crc64 import crc64
 
 TEST_DIR = os.path.dirname(__file__)
 SRC_RDB = os.path.join(TEST_DIR, '.redis_src.db')
@@ -224,6 +236,52 @@ class MultiCopyWithFilter(unittest.TestCase):
         self.assertEqual(DST.zrange('bar', 0, -1), [])
 
 
+class OpenedSource(object):
+    def __init__(self, conn, log):
+        self.conn = conn
+        self.log = log
+        log.append(('open', conn))
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def close(self):
+        self.log.append(('close', self.conn))
+
+
+class MultiCopyOpeners(unittest.TestCase):
+    def setUp(self):
+        clean()
+        SRC.set('foo', 'a')
+        SRC_ALT.set('bar', 'b')
+
+    def tearDown(self):
+        clean()
+        SRC_ALT.flushdb()
+
+    def test(self):
+        log = []
+        keys = redisimp.multi_copy(
+            [lambda: OpenedSource(SRC, log),
+             lambda: OpenedSource(SRC_ALT, log)], DST)
+        self.assertEqual(log, [])
+        self.assertEqual(next(keys), b'foo')
+        self.assertEqual(log, [('open', SRC)])
+        self.assertEqual(list(keys), [b'bar'])
+        self.assertEqual(log, [('open', SRC), ('close', SRC),
+                               ('open', SRC_ALT), ('close', SRC_ALT)])
+        self.assertEqual(DST.get('bar'), b'b')
+
+
+class TestImport(unittest.TestCase):
+    def test_lazy(self):
+        # redis-py pulls in asyncio; a copy between files never needs it
+        code = 'import sys, redisimp; print("redis" in sys.modules)'
+        out = subprocess.check_output([sys.executable, '-c', code],
+                                      cwd=TEST_DIR or '.')
+        self.assertEqual(out.strip(), b'False')
+
+
 class TestParseArgs(unittest.TestCase):
     def test_minimal(self):
         args = redisimp.cli.parse_args(['-s', '0:6379', '-d', '0:6380'])
@@ -241,6 +299,30 @@ class TestParseArgs(unittest.TestCase):
             ['-s', '0:6379', '-d', '0:6380', '-v'])
         self.assertEqual(args.verbose, True)
 
+    def test_manifest_delete(self):
+        with self.assertRaises(SystemExit):
+            redisimp.cli.parse_args(
+                ['-s', '0:6379', '-d', '0:6380', '--manifest-delete'])
+
+    def test_manifest_file(self):
+        for args in (['--manifest', 'm'],
+                     ['--manifest', 'm', '--manifest-delete']):
+            with self.assertRaises(SystemExit):
+                redisimp.cli.parse_args(
+                    ['-s', '0:6379', '-d', '0:6380,rdb://out.rdb'] + args)
+            with self.assertRaises(SystemExit):
+                redisimp.cli.parse_args(
+                    ['-s', '0:6379', '-d', 'archive://out.rimp'] + args)
+
+    def test_target_latency(self):
+        args = redisimp.cli.parse_args(
+            ['-s', '0:6379', '-d', 'redis://0:6380', '--target-latency', '5'])
+        self.assertEqual(args.target_latency, 5)
+        for dst in ('rdb://out.rdb', 'resp://-', 'archive://out.arc'):
+            with self.assertRaises(SystemExit):
+                redisimp.cli.parse_args(
+                    ['-s', '0:6379', '-d', dst, '--target-latency', '5'])
+
 
 class TestMain(unittest.TestCase):
     def setUp(self):
@@ -391,5 +473,1817 @@ class TestRDBParserBigSortedSet(unittest.TestCase):
                          self.values)
 
 
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        clean()
+        self.filename = os.path.join(TEST_DIR, '.redis_manifest')
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+        SRC.set('foo', 'a')
+        SRC.set('bar', 'b')
+        SRC.set('bazz', 'c')
+
+    def tearDown(self):
+        clean()
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    def copy(self, src=SRC):
+        manifest = redisimp.Manifest(self.filename)
+        keys = set(redisimp.copy(src, DST, manifest=manifest))
+        manifest.save()
+        return keys
+
+    def test(self):
+        self.assertEqual(self.copy(), {b'foo', b'bar', b'bazz'})
+        self.assertEqual(self.copy(), set())
+        SRC.set('foo', 'changed')
+        self.assertEqual(self.copy(), {b'foo'})
+        self.assertEqual(DST.get('foo'), b'changed')
+
+    def test_rdb(self):
+        SRC.save()
+        self.assertEqual(self.copy(SRC.dbfilename), {b'foo', b'bar', b'bazz'})
+        SRC.set('bar', 'changed')
+        SRC.save()
+        self.assertEqual(self.copy(SRC.dbfilename), {b'bar'})
+
+    def test_delete_stale(self):
+        self.copy()
+        SRC.delete('bar')
+        manifest = redisimp.Manifest(self.filename)
+        self.assertEqual(set(redisimp.copy(SRC, DST, manifest=manifest)),
+                         set())
+        self.assertEqual(list(manifest.delete_stale(DST)), [b'bar'])
+        self.assertEqual(DST.get('bar'), None)
+        self.assertEqual(DST.get('foo'), b'a')
+
+    def test_backfill_delete_stale(self):
+        for i in range(10):
+            SRC.set('key%d' % i, i)
+        src = 'unix://' + SRC.socket_file
+        args = ['-s', src, '-d', DST_RDB, '--manifest', self.filename,
+                '--manifest-delete']
+        redisimp.main(args, out=StringIO())
+        self.assertEqual(DST.dbsize(), 13)
+
+        # the keys a backfill finds in place are still part of the import
+        SRC.delete('bar')
+        out = StringIO()
+        redisimp.main(args + ['--backfill'], out=out)
+        self.assertIn('deleted 1 stale keys', out.getvalue())
+        self.assertEqual(DST.dbsize(), 12)
+        self.assertEqual(DST.get('bar'), None)
+        redisimp.main(args + ['--backfill'], out=out)
+        self.assertEqual(DST.dbsize(), 12)
+
+
+class TestVerify(unittest.TestCase):
+    def setUp(self):
+        clean()
+        SRC.set('foo', 'a')
+        SRC.set('bar', 'b')
+        SRC.zadd('zset1', dict(one=1, two=2))
+        list(redisimp.copy(SRC, DST))
+        DST.set('foo', 'changed')
+        DST.delete('bar')
+
+    def tearDown(self):
+        clean()
+
+    def verify(self, src=SRC, **kwargs):
+        return {(m.key, m.reason) for m in redisimp.verify(src, DST, **kwargs)}
+
+    def test(self):
+        expected = {(b'foo', 'value'), (b'bar', 'missing')}
+        for method in ['digest', 'dump']:
+            self.assertEqual(self.verify(method=method), expected)
+        self.assertEqual(self.verify(method='length'),
+                         {(b'foo', 'length'), (b'bar', 'missing')})
+
+    def test_rdb(self):
+        SRC.save()
+        self.assertEqual(self.verify(SRC.dbfilename),
+                         {(b'foo', 'value'), (b'bar', 'missing')})
+
+    def test_sample(self):
+        self.assertEqual(self.verify(sample=0.0), set())
+
+    def test_repair(self):
+        mismatches = list(redisimp.verify(SRC, DST, repair=True))
+        self.assertEqual([m.repaired for m in mismatches], [True, True])
+        self.assertEqual(self.verify(), set())
+        self.assertEqual(DST.get('foo'), b'a')
+        self.assertEqual(DST.get('bar'), b'b')
+
+    def test_main(self):
+        SRC.save()
+        out = StringIO()
+        with self.assertRaises(SystemExit):
+            redisimp.main(['-s', SRC_RDB, '-d', DST_RDB, '--verify'],
+                          out=out)
+        self.assertIn('found 2 mismatched keys', out.getvalue())
+
+        out = StringIO()
+        redisimp.main(['-s', SRC_RDB, '-d', DST_RDB, '--verify', '--repair'],
+                      out=out)
+        self.assertIn('found 2 mismatched keys', out.getvalue())
+        self.assertIn('repaired 2 keys', out.getvalue())
+
+    def test_repair_refused(self):
+        # keys the destination won't take are reported, not counted
+        DST.config_set('maxmemory', 1)
+        try:
+            mismatches = list(redisimp.verify(SRC, DST, repair=True))
+        finally:
+            DST.config_set('maxmemory', 0)
+        self.assertEqual(len(mismatches), 2)
+        self.assertFalse(any(m.repaired for m in mismatches))
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.slept += secs
+        self.now += secs
+
+
+class TestThrottle(unittest.TestCase):
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = redisimp.TokenBucket(100, clock=clock.time,
+                                      sleep=clock.sleep)
+        bucket.consume(100)
+        self.assertEqual(clock.slept, 0)
+        bucket.consume(200)
+        self.assertAlmostEqual(clock.slept, 2.0)
+        clock.now += 1.0
+        bucket.consume(100)
+        self.assertAlmostEqual(clock.slept, 2.0)
+
+    def test_governor(self):
+        clock = FakeClock()
+        governor = redisimp.LatencyGovernor(DST, target_ms=-1,
+                                            clock=clock.time)
+        self.assertEqual(governor.check(), 0.5)
+        self.assertEqual(governor.check(), 0.5)
+        clock.now += 1
+        self.assertEqual(governor.check(), 0.25)
+
+    def test_copy(self):
+        clean()
+        for i in range(10):
+            SRC.set('foo%s' % i, 'a')
+        clock = FakeClock()
+        throttle = redisimp.Throttle(write_keys=5, clock=clock.time,
+                                     sleep=clock.sleep)
+        keys = list(redisimp.copy(SRC, DST, throttle=throttle))
+        self.assertEqual(len(keys), 10)
+        self.assertAlmostEqual(clock.slept, 1.0)
+        clean()
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        clean()
+        SRC.set('foo', 'a')
+        SRC.set('bar', 'b')
+        DST.set('bar', 'b')
+
+    def tearDown(self):
+        clean()
+
+    def test(self):
+        metrics = redisimp.Metrics()
+        self.assertEqual(len(list(redisimp.copy(SRC, DST, metrics=metrics))),
+                         2)
+        snapshot = metrics.snapshot()
+        name = redisimp.api._conn_name(DST)
+        self.assertEqual(snapshot['counters']['keys_written'], {name: 2})
+        self.assertEqual(set(snapshot['phases']), {'scan', 'dump', 'restore'})
+        self.assertIn('redisimp_keys_read_total{node=', metrics.prometheus())
+
+    def test_rdb_backfill(self):
+        SRC.save()
+        metrics = redisimp.Metrics()
+        keys = list(redisimp.copy(SRC.dbfilename, DST, backfill=True,
+                                  metrics=metrics))
+        self.assertEqual(keys, [b'foo'])
+        phases = metrics.snapshot()['phases']
+        self.assertEqual(phases['parse']['count'], 2)
+        self.assertEqual(phases['crc']['count'], 2)
+        self.assertIn('exists', phases)
+
+    def test_reporter_and_server(self):
+        metrics = redisimp.Metrics()
+        metrics.incr('busykey_skips')
+        out = StringIO()
+        reporter = redisimp.MetricsReporter(metrics, out, interval=60)
+        reporter.start()
+        reporter.stop()
+        line = json.loads(out.getvalue())
+        self.assertEqual(line['counters'], {'busykey_skips': 1})
+
+        server = redisimp.serve_metrics(metrics, 0)
+        try:
+            url = 'http://127.0.0.1:%s/metrics' % server.server_address[1]
+            body = urlopen(url).read().decode('utf-8')
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn('redisimp_busykey_skips_total 1', body)
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        clean()
+        SRC.set('foo', 'a')
+        SRC.save()
+
+    def tearDown(self):
+        clean()
+
+    def test(self):
+        out = StringIO()
+        with redisimp.profiling(out=out) as p:
+            list(redisimp.copy(SRC.dbfilename, DST, metrics=p.metrics))
+        report = out.getvalue()
+        self.assertIn('phase split', report)
+        self.assertIn('crc', report)
+        self.assertIn('hot functions', report)
+
+    def test_main(self):
+        filename = os.path.join(TEST_DIR, '.redis_profile')
+        try:
+            redisimp.main(['-s', SRC_RDB, '-d', DST_RDB,
+                           '--profile', filename], out=StringIO())
+            with open(filename) as f:
+                self.assertIn('hot functions', f.read())
+        finally:
+            os.unlink(filename)
+        self.assertEqual(DST.get('foo'), b'a')
+
+
+class TestRdbWriter(unittest.TestCase):
+    def setUp(self):
+        clean()
+        self.filename = os.path.join(TEST_DIR, '.redis_written.rdb')
+        SRC.set('strfoo', 'foo')
+        SRC.set('expiring', 'bar', px=100000)
+        SRC.zadd('zset1', dict(one=1, two=2))
+        SRC.hset('hash1', 'foo', '1')
+        SRC.rpush('list1', *['x' * 100 for _ in range(10)])
+        SRC.save()
+
+    def tearDown(self):
+        clean()
+        # redislite leaves its settings next to the file check() loads
+        for filename in (self.filename, self.filename + '.settings'):
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+    def write(self, src):
+        writer = redisimp.RdbWriter(self.filename)
+        keys = set(redisimp.copy(src, writer))
+        writer.close()
+        return keys
+
+    def check(self):
+        conn = redislite.StrictRedis(self.filename)
+        try:
+            self.assertEqual(conn.get('strfoo'), b'foo')
+            self.assertEqual(conn.get('expiring'), b'bar')
+            self.assertTrue(0 < conn.pttl('expiring') <= 100000)
+            self.assertEqual(conn.pttl('strfoo'), -1)
+            self.assertEqual(conn.zrange('zset1', 0, -1, withscores=True),
+                             [(b'one', 1), (b'two', 2)])
+            self.assertEqual(conn.hgetall('hash1'), {b'foo': b'1'})
+            self.assertEqual(conn.llen('list1'), 10)
+        finally:
+            conn.shutdown()
+
+    def test_from_rdb(self):
+        self.assertEqual(len(self.write(SRC.dbfilename)), 5)
+        rows = list(redisimp.rdbparser.parse_rdb(self.filename))
+        self.assertEqual(len(rows), 5)
+        self.check()
+
+    def test_from_live(self):
+        self.assertEqual(len(self.write(SRC)), 5)
+        self.check()
+
+    def test_duplicates(self):
+        writer = redisimp.RdbWriter(self.filename)
+        keys = list(redisimp.multi_copy([SRC, SRC], writer, backfill=True))
+        writer.close()
+        self.assertEqual(len(keys), 5)
+        self.check()
+
+    def test_main(self):
+        redisimp.main(['-s', SRC_RDB, '-d', 'rdb://%s' % self.filename],
+                      out=StringIO())
+        self.check()
+
+
+class TestRDBParserTtl(unittest.TestCase):
+    def setUp(self):
+        clean()
+
+    def tearDown(self):
+        clean()
+
+    def test(self):
+        SRC.set('foo', 'a', px=100000)
+        SRC.set('bar', 'b')
+        SRC.save()
+        list(redisimp.copy(SRC.dbfilename, DST))
+        self.assertTrue(0 < DST.pttl('foo') <= 100000)
+        self.assertEqual(DST.pttl('bar'), -1)
+
+
+class TestRespWriter(unittest.TestCase):
+    def setUp(self):
+        clean()
+        SRC.set('foo', 'a')
+        SRC.zadd('zset1', dict(one=1, two=2))
+        SRC.save()
+
+    def tearDown(self):
+        clean()
+
+    def test(self):
+        out = BytesIO()
+        writer = redisimp.RespWriter(out, buffer_size=10)
+        keys = set(redisimp.copy(SRC, writer))
+        writer.flush()
+        self.assertEqual(keys, {b'foo', b'zset1'})
+        self.assertEqual(writer.commands, 2)
+        stream = out.getvalue()
+        self.assertTrue(stream.startswith(b'*5\r\n$7\r\nRESTORE\r\n'))
+
+        # replay the stream the way redis-cli --pipe would
+        conn = DST.connection_pool.get_connection('RESTORE')
+        try:
+            conn.send_packed_command([stream])
+            self.assertEqual([conn.read_response() for _ in range(2)],
+                             [b'OK', b'OK'])
+        finally:
+            DST.connection_pool.release(conn)
+        self.assertEqual(DST.get('foo'), b'a')
+        self.assertEqual(DST.zrange('zset1', 0, -1), [b'one', b'two'])
+
+    def test_backfill(self):
+        out = BytesIO()
+        writer = redisimp.RespWriter(out)
+        list(redisimp.copy(SRC.dbfilename, writer, backfill=True))
+        writer.close()
+        self.assertNotIn(b'REPLACE', out.getvalue())
+
+
+class TestFastRestore(unittest.TestCase):
+    def setUp(self):
+        clean()
+        SRC.set('foo', 'a')
+        SRC.set('big', b'x' * 100000 + os.urandom(100000))
+        SRC.zadd('zset1', dict(one=1, two=2))
+        SRC.save()
+
+    def tearDown(self):
+        clean()
+
+    def test(self):
+        dst = redisimp.fast_restore(DST)
+        self.assertIsInstance(dst, redisimp.FastRestore)
+        keys = set(redisimp.copy(SRC.dbfilename, dst))
+        self.assertEqual(keys, {b'foo', b'big', b'zset1'})
+        self.assertEqual(DST.get('big'), SRC.get('big'))
+        self.assertEqual(DST.zrange('zset1', 0, -1), [b'one', b'two'])
+        dst.close()
+
+    def test_backfill(self):
+        DST.set('foo', 'b')
+        dst = redisimp.fast_restore(DST)
+        keys = set(redisimp.copy(SRC, dst, backfill=True))
+        self.assertEqual(keys, {b'big', b'zset1'})
+        self.assertEqual(DST.get('foo'), b'b')
+        dst.close()
+
+    def test_errors_fall_back(self):
+        dst = redisimp.fast_restore(DST)
+        pipe = dst.pipeline()
+        pipe.restore('foo', 0, b'not a payload')
+        self.assertRaises(redis.ResponseError, pipe.execute)
+        pipe.restore('foo', 0, b'not a payload')
+        pipe.exists('foo')
+        result = pipe.execute(raise_on_error=False)
+        self.assertIsInstance(result[0], redis.ResponseError)
+        self.assertEqual(result[1], 0)
+
+    def test_reconnect(self):
+        dst = redisimp.fast_restore(DST)
+        list(redisimp.copy(SRC, dst))
+        dst._sock.close()
+        DST.flushdb()
+        self.assertEqual(len(list(redisimp.copy(SRC, dst))), 3)
+        self.assertEqual(DST.get('foo'), b'a')
+        dst.close()
+
+    def test_main(self):
+        redisimp.main(['-s', SRC_RDB, '-d', DST_RDB,
+                       '--fast-restore'], out=StringIO())
+        self.assertEqual(DST.get('big'), SRC.get('big'))
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        clean()
+        for i in range(25):
+            SRC.set('s{%d}' % i, 'v%d' % i)
+        SRC.zadd('zset1', dict(one=1, two=2))
+        SRC.set('ttl', 'a', ex=3600)
+        SRC.save()
+        self.filename = os.path.join(TEST_DIR, '.redis_archive.rimp')
+        self.journal = os.path.join(TEST_DIR, '.redis_archive.journal')
+
+    def tearDown(self):
+        clean()
+        for filename in (self.filename, self.journal):
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+    def export(self, src=None):
+        writer = redisimp.ArchiveWriter(self.filename, chunk_keys=10)
+        keys = list(redisimp.copy(src or SRC, writer))
+        writer.close()
+        return keys
+
+    def test(self):
+        self.assertEqual(len(self.export()), 27)
+        self.assertTrue(redisimp.is_archive(self.filename))
+        reader = redisimp.ArchiveReader(self.filename)
+        self.assertEqual(len(reader.chunks), 3)
+        self.assertEqual(reader.keys, 27)
+        for chunk in reader.chunks:
+            self.assertLessEqual(chunk.first, chunk.last)
+
+        keys = set(redisimp.copy(self.filename, DST))
+        self.assertEqual(len(keys), 27)
+        self.assertEqual(DST.get('s{3}'), b'v3')
+        self.assertEqual(DST.zrange('zset1', 0, -1), [b'one', b'two'])
+        self.assertGreater(DST.ttl('ttl'), 3500)
+        self.assertEqual(DST.ttl('s{3}'), -1)
+        self.assertEqual(list(redisimp.verify(self.filename, DST)), [])
+
+    def test_from_rdb(self):
+        self.export(SRC.dbfilename)
+        self.assertEqual(set(redisimp.copy(self.filename, None,
+                                           pattern='s{*')),
+                         set(('s{%d}' % i).encode() for i in range(25)))
+
+    def test_shard_and_resume(self):
+        self.export()
+        journal = redisimp.ArchiveJournal(self.journal)
+        reader = redisimp.ArchiveReader(self.filename, shard=(0, 2),
+                                        journal=journal)
+        self.assertEqual(reader.selected(), [0, 2])
+        copied = redisimp.copy(reader, DST)
+        # the first key of the next chunk, chunk 0 has been written
+        for _ in range(11):
+            next(copied)
+        del copied
+        journal.close()
+
+        journal = redisimp.ArchiveJournal(self.journal)
+        self.assertEqual(journal.done, {0})
+        reader = redisimp.ArchiveReader(self.filename, journal=journal)
+        self.assertEqual(reader.selected(), [1, 2])
+        self.assertEqual(len(list(redisimp.copy(reader, DST))), 17)
+        journal.close()
+        self.assertEqual(DST.dbsize(), 27)
+
+    def test_truncated(self):
+        self.export()
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        chunks = redisimp.ArchiveReader(self.filename).chunks
+        with open(self.filename, 'wb') as f:
+            f.write(data[:chunks[2].offset + 5])
+        reader = redisimp.ArchiveReader(self.filename)
+        self.assertEqual(reader.chunks, chunks[:2])
+        self.assertEqual(len(list(reader)), 20)
+
+    def test_main(self):
+        redisimp.main(['-s', SRC_RDB, '-d', 'archive://%s' % self.filename],
+                      out=StringIO())
+        for shard in ('0/2', '1/2'):
+            redisimp.main(['-s', self.filename, '-d', DST_RDB,
+                           '--archive-shard', shard,
+                           '--archive-journal', self.journal],
+                          out=StringIO())
+        self.assertEqual(DST.dbsize(), 27)
+        out = StringIO()
+        redisimp.main(['-s', self.filename, '-d', DST_RDB,
+                       '--archive-journal', self.journal], out=out)
+        self.assertIn('processed 0 keys', out.getvalue())
+
+
+class BrokenDestination(object):
+    name = 'broken'
+    supports_replace = True
+
+    def __init__(self, release=None):
+        self.release = release
+
+    def pipeline(self, transaction=False):
+        return self
+
+    def execute_command(self, *args, **kwargs):
+        pass
+
+    def execute(self, raise_on_error=True):
+        if self.release is not None:
+            self.release.wait()
+            return []
+        raise redis.ConnectionError('gone')
+
+
+class TestFanOut(unittest.TestCase):
+    def setUp(self):
+        clean()
+        with SRC.pipeline(transaction=False) as pipe:
+            for i in range(1200):
+                pipe.set('s{%d}' % i, 'v%d' % i)
+            pipe.execute()
+        SRC.save()
+        self.filename = os.path.join(TEST_DIR, '.redis_fanout.rimp')
+
+    def tearDown(self):
+        clean()
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    def archived(self):
+        return set(row[0] for row in redisimp.ArchiveReader(self.filename))
+
+    def test(self):
+        writer = redisimp.ArchiveWriter(self.filename)
+        fan = redisimp.FanOut([DST, writer])
+        keys = set(redisimp.copy(SRC, fan))
+        fan.close()
+        writer.close()
+        self.assertEqual(len(keys), 1200)
+        self.assertEqual(DST.dbsize(), 1200)
+        self.assertEqual(self.archived(), keys)
+
+    def test_backfill(self):
+        DST.set('s{1}', 'b')
+        writer = redisimp.ArchiveWriter(self.filename)
+        fan = redisimp.FanOut([DST, writer])
+        list(redisimp.copy(SRC.dbfilename, fan, backfill=True))
+        fan.close()
+        writer.close()
+        self.assertEqual(DST.get('s{1}'), b'b')
+        self.assertEqual(DST.dbsize(), 1200)
+        self.assertEqual(len(self.archived()), 1200)
+
+    def test_error_isolation(self):
+        fan = redisimp.FanOut([BrokenDestination(), DST])
+        list(redisimp.copy(SRC, fan))
+        with self.assertRaises(redisimp.FanOutError) as cm:
+            fan.close()
+        self.assertEqual(list(cm.exception.failures), ['broken'])
+        self.assertEqual(DST.dbsize(), 1200)
+
+    def test_stall(self):
+        release = threading.Event()
+        fan = redisimp.FanOut([BrokenDestination(release), DST],
+                              buffer_batches=1, stall_timeout=0.1)
+        metrics = redisimp.Metrics()
+        list(redisimp.copy(SRC.dbfilename, fan, metrics=metrics))
+        with self.assertRaises(redisimp.FanOutError) as cm:
+            fan.close()
+        release.set()
+        self.assertIn('behind', str(cm.exception))
+        self.assertEqual(DST.dbsize(), 1200)
+        self.assertEqual(
+            metrics.snapshot()['counters']['fanout_stalls'], {'broken': 1})
+
+    def test_main(self):
+        redisimp.main(['-s', SRC_RDB,
+                       '-d', '%s,archive://%s' % (DST_RDB, self.filename)],
+                      out=StringIO())
+        self.assertEqual(DST.dbsize(), 1200)
+        self.assertEqual(len(self.archived()), 1200)
+
+
+class TestSharded(unittest.TestCase):
+    def setUp(self):
+        clean()
+        flush_redis_data(SRC_ALT)
+        with SRC.pipeline(transaction=False) as pipe:
+            for i in range(200):
+                pipe.set('s%d' % i, 'v%d' % i)
+            pipe.set('{user1}:a', 'a')
+            pipe.set('{user1}:b', 'b')
+            pipe.execute()
+        SRC.save()
+
+    def tearDown(self):
+        clean()
+        flush_redis_data(SRC_ALT)
+
+    def check(self, sharded):
+        for key in SRC.scan_iter():
+            node = sharded.node_for(key)
+            self.assertEqual(node.get(key), SRC.get(key))
+        self.assertGreater(DST.dbsize(), 0)
+        self.assertGreater(SRC_ALT.dbsize(), 0)
+        self.assertEqual(DST.dbsize() + SRC_ALT.dbsize(), 202)
+        self.assertIs(sharded.node_for(b'{user1}:a'),
+                      sharded.node_for(b'{user1}:b'))
+
+    def test_schemes(self):
+        for scheme in redisimp.SCHEMES:
+            flush_redis_data(DST)
+            flush_redis_data(SRC_ALT)
+            sharded = redisimp.ShardedRedis([DST, SRC_ALT], scheme=scheme)
+            keys = list(redisimp.copy(SRC.dbfilename, sharded))
+            self.assertEqual(len(keys), 202)
+            self.check(sharded)
+            sharded.close()
+
+    def test_crc16_slots(self):
+        sharded = redisimp.ShardedRedis([DST, SRC_ALT])
+        # foo is in slot 12182, the upper half
+        self.assertEqual(sharded.node_index(b'foo'), 1)
+        self.assertEqual(sharded.node_index(b'{foo}bar'), 1)
+        self.assertEqual(sharded.node_index(b'bar'), 0)
+
+    def test_backfill_and_metrics(self):
+        sharded = redisimp.ShardedRedis([DST, SRC_ALT], scheme='ketama')
+        sharded.node_for(b's1').set('s1', 'x')
+        metrics = redisimp.Metrics()
+        keys = list(redisimp.copy(SRC, sharded, backfill=True,
+                                  metrics=metrics))
+        self.assertEqual(len(keys), 201)
+        self.assertEqual(sharded.node_for(b's1').get('s1'), b'x')
+        written = metrics.snapshot()['counters']['keys_written']
+        self.assertEqual(sorted(written), sorted(sharded.names))
+        self.assertEqual(sum(written.values()), 201)
+
+    def test_main(self):
+        redisimp.main(['-s', SRC_RDB, '-d', '%s,%s' % (DST_RDB, SRC_ALT_RDB),
+                       '--shard-scheme', 'modulo'], out=StringIO())
+        self.assertEqual(DST.dbsize() + SRC_ALT.dbsize(), 202)
+
+
+class TestDecode(unittest.TestCase):
+    def setUp(self):
+        clean()
+
+    def tearDown(self):
+        clean()
+
+    def decode(self, key):
+        kind, items = redisimp.decode_payload(SRC.dump(key))
+        return kind, list(items)
+
+    def test(self):
+        SRC.set('str', 'hello')
+        SRC.set('int', 12345)
+        SRC.rpush('list', 'a', 1, -5, 300, 70000, 2 ** 40, 'y' * 70)
+        SRC.sadd('intset', 1, -40000, 2 ** 33)
+        SRC.hset('hash', mapping={'a': 'b', 'n': -70000})
+        SRC.zadd('zset', {'a': 1.5, 'b': -2})
+        SRC.zadd('bigzset', {'m%d' % i: i * 0.5 for i in range(200)})
+        SRC.hset('bighash', mapping={'f%d' % i: 'v' * i for i in range(600)})
+
+        self.assertEqual(self.decode('str'), ('string', [b'hello']))
+        self.assertEqual(self.decode('int'), ('string', [b'12345']))
+        self.assertEqual(self.decode('list'), ('list', [
+            b'a', b'1', b'-5', b'300', b'70000', b'1099511627776',
+            b'y' * 70]))
+        self.assertEqual(self.decode('intset'),
+                         ('set', [b'-40000', b'1', b'8589934592']))
+        self.assertEqual(dict(self.decode('hash')[1]),
+                         {b'a': b'b', b'n': b'-70000'})
+        self.assertEqual(dict(self.decode('zset')[1]),
+                         {b'a': b'1.5', b'b': b'-2'})
+        scores = dict(self.decode('bigzset')[1])
+        self.assertEqual(len(scores), 200)
+        self.assertEqual(float(scores[b'm3']), 1.5)
+        self.assertEqual(dict(self.decode('bighash')[1])[b'f599'],
+                         b'v' * 599)
+
+    def test_listpack(self):
+        # a redis 7.2 set listpack of 'a', 5 and -100
+        entries = b'\x81a\x02' + b'\x05\x01' + b'\xdf\x9c\x02'
+        listpack = struct.pack('<IH', 6 + len(entries) + 1, 3) + \
+            entries + b'\xff'
+        payload = b'\x14' + bytes([len(listpack)]) + listpack + b'\x00' * 10
+        kind, items = redisimp.decode_payload(payload)
+        self.assertEqual((kind, list(items)), ('set', [b'a', b'5', b'-100']))
+
+    def test_listpack_backlen(self):
+        # an entry of 16383 bytes has a 3 byte backlen
+        big = b'x' * 16378
+        entries = b'\xf0' + struct.pack('<I', len(big)) + big + \
+            b'\x7f\x7f\x03' + b'\x81b\x02'
+        listpack = struct.pack('<IH', 6 + len(entries) + 1, 2) + \
+            entries + b'\xff'
+        payload = b'\x14\x80' + struct.pack('>I', len(listpack)) + \
+            listpack + b'\x00' * 10
+        kind, items = redisimp.decode_payload(payload)
+        self.assertEqual((kind, list(items)), ('set', [big, b'b']))
+
+    def test_unsupported(self):
+        self.assertRaises(redisimp.UnsupportedPayload,
+                          redisimp.decode_payload, b'\x0f' + b'\x00' * 10)
+
+
+class TestSplitLargeKeys(unittest.TestCase):
+    def setUp(self):
+        clean()
+        SRC.hset('hash', mapping={'f%d' % i: 'v%d' % i for i in range(300)})
+        SRC.zadd('zset', {'m%d' % i: i * 0.25 for i in range(300)})
+        SRC.sadd('set', *range(300))
+        SRC.rpush('list', *['x%d' % i for i in range(300)])
+        SRC.set('string', os.urandom(3000))
+        SRC.set('small', 'a')
+        SRC.expire('hash', 3600)
+        SRC.save()
+
+    def tearDown(self):
+        clean()
+
+    def check(self):
+        for key in ('hash', 'zset', 'set', 'list', 'string', 'small'):
+            self.assertEqual(DST.type(key), SRC.type(key))
+        self.assertEqual(DST.get('small'), b'a')
+        self.assertEqual(DST.hgetall('hash'), SRC.hgetall('hash'))
+        self.assertEqual(DST.zrange('zset', 0, -1, withscores=True),
+                         SRC.zrange('zset', 0, -1, withscores=True))
+        self.assertEqual(DST.smembers('set'), SRC.smembers('set'))
+        self.assertEqual(DST.lrange('list', 0, -1), SRC.lrange('list', 0, -1))
+        self.assertEqual(DST.get('string'), SRC.get('string'))
+        self.assertGreater(DST.ttl('hash'), 3500)
+        self.assertEqual(DST.ttl('zset'), -1)
+        self.assertEqual(DST.dbsize(), 6)
+
+    def test(self):
+        DST.set('hash', 'old')
+        dst = redisimp.SplitLargeKeys(DST, threshold=100, chunk_elements=50,
+                                      chunk_bytes=1000)
+        keys = set(redisimp.copy(SRC.dbfilename, dst))
+        self.assertEqual(len(keys), 6)
+        self.assertEqual(dst.split, 5)
+        self.check()
+
+    def test_backfill(self):
+        DST.set('hash', 'old')
+        dst = redisimp.SplitLargeKeys(DST, threshold=100, chunk_elements=50)
+        keys = set(redisimp.copy(SRC, dst, backfill=True))
+        self.assertEqual(len(keys), 5)
+        self.assertEqual(DST.get('hash'), b'old')
+
+        # a key created after the exists check is left alone
+        pipe = dst.pipeline()
+        pipe.restore('hash', 0, SRC.dump('hash'))
+        result = pipe.execute(raise_on_error=False)
+        self.assertIn('is busy', str(result[0]))
+        self.assertEqual(DST.get('hash'), b'old')
+        self.assertEqual(DST.dbsize(), 6)
+
+    def test_error_replies(self):
+        # errors come back per key, for the retry policy to deal with
+        dst = redisimp.SplitLargeKeys(DST, threshold=100)
+        DST.config_set('maxmemory', 1)
+        try:
+            results = list(redisimp.Copier(dst).copy_batches(SRC_RDB))
+        finally:
+            DST.config_set('maxmemory', 0)
+        failed = [f for r in results for f in r.failed]
+        self.assertEqual(len(failed), 6)
+        for _, error in failed:
+            self.assertIsInstance(error, redis.exceptions.OutOfMemoryError)
+        self.assertEqual(dst.split, 0)
+        self.assertEqual(DST.dbsize(), 0)
+
+    def test_sharded(self):
+        flush_redis_data(SRC_ALT)
+        sharded = redisimp.ShardedRedis([DST, SRC_ALT], scheme='modulo')
+        dst = redisimp.SplitLargeKeys(sharded, threshold=100)
+        list(redisimp.copy(SRC, dst))
+        for key in ('hash', 'zset', 'set', 'list', 'string', 'small'):
+            self.assertTrue(sharded.node_for(key.encode()).exists(key))
+        self.assertEqual(DST.dbsize() + SRC_ALT.dbsize(), 6)
+        flush_redis_data(SRC_ALT)
+
+    def test_transcoded(self):
+        # transcoding wraps the destination before the split does
+        dst = redisimp.split_large_keys(redisimp.Transcoder(DST), 100)
+        self.assertIsInstance(dst, redisimp.SplitLargeKeys)
+        list(redisimp.copy(SRC, dst))
+        self.assertEqual(dst.split, 5)
+        self.check()
+
+        # a cluster is found under the wrapper without connecting to it
+        cluster = redis.cluster.RedisCluster.__new__(redis.cluster.RedisCluster)
+        dst = redisimp.split_large_keys(redisimp.Transcoder(cluster, 9), 100)
+        self.assertIsInstance(dst, redisimp.SplitLargeKeys)
+        self.assertIsInstance(dst.conn, redisimp.Transcoder)
+
+    def test_main(self):
+        redisimp.main(['-s', SRC_RDB, '-d', DST_RDB,
+                       '--split-large-keys', '100',
+                       '--split-chunk-elements', '10'], out=StringIO())
+        self.check()
+
+
+class TestTranscode(unittest.TestCase):
+    def setUp(self):
+        clean()
+
+    def tearDown(self):
+        clean()
+
+    def listpack(self, enc_type, entries, count, version):
+        listpack = struct.pack('<IH', 6 + len(entries) + 1, count) + \
+            entries + b'\xff'
+        body = bytes([enc_type, len(listpack)]) + listpack + \
+            struct.pack('<H', version)
+        return body + struct.pack('<Q', crc64(body))
+
+    def restore(self, dst, key, payload):
+        pipe = dst.pipeline()
+        pipe.restore(key, 0, payload)
+        pipe.execute()
+
+    def test_rdb_version_for(self):
+        self.assertEqual(redisimp.rdb_version_for('6.2.14'), 9)
+        self.assertEqual(redisimp.rdb_version_for('7.0.15'), 10)
+        self.assertEqual(redisimp.rdb_version_for('7.2.4'), 11)
+        self.assertEqual(redisimp.rdb_version_for('8.0.0'), 12)
+        self.assertEqual(redisimp.rdb_version_for('3.2.12'), 7)
+        self.assertEqual(redisimp.Transcoder(DST).version, 9)
+
+    def test_restamp(self):
+        SRC.hset('hash', mapping={'a': 'b'})
+        payload = transcode.restamp(SRC.dump('hash'), 11)
+        self.assertRaises(redis.ResponseError, DST.restore, 'hash', 0,
+                          payload)
+        dst = redisimp.Transcoder(DST)
+        self.restore(dst, 'hash', payload)
+        self.assertEqual(DST.hgetall('hash'), {b'a': b'b'})
+        self.assertEqual(dst.transcoded, 1)
+        self.assertEqual(transcode.restamp(payload, 9), SRC.dump('hash'))
+
+    def test_listpack(self):
+        dst = redisimp.Transcoder(DST)
+        # a redis 7.2 set listpack of 'a', 5 and -100
+        self.restore(dst, 'set', self.listpack(
+            20, b'\x81a\x02' + b'\x05\x01' + b'\xdf\x9c\x02', 3, 11))
+        self.assertEqual(DST.smembers('set'), {b'a', b'5', b'-100'})
+        # a redis 7.0 hash listpack of a=b and n=5
+        self.restore(dst, 'hash', self.listpack(
+            16, b'\x81a\x02\x81b\x02\x81n\x02\x05\x01', 4, 10))
+        self.assertEqual(DST.hgetall('hash'), {b'a': b'b', b'n': b'5'})
+        # a redis 7.0 zset listpack of a=1.5 and b=inf
+        self.restore(dst, 'zset', self.listpack(
+            17, b'\x81a\x02\x831.5\x04\x81b\x02\x83inf\x04', 4, 10))
+        self.assertEqual(DST.zrange('zset', 0, -1, withscores=True),
+                         [(b'a', 1.5), (b'b', float('inf'))])
+
+    def test_zset_2(self):
+        SRC.zadd('zset', {'m%d' % i: i * 0.25 for i in range(200)})
+        SRC.zadd('zset', {'inf': float('inf')})
+        payload = redisimp.transcode_payload(SRC.dump('zset'), 7)
+        self.assertEqual(payload[0], 3)
+        self.restore(DST, 'zset', payload)
+        self.assertEqual(DST.zrange('zset', 0, -1, withscores=True),
+                         SRC.zrange('zset', 0, -1, withscores=True))
+
+    def test_main(self):
+        SRC.rpush('list', 'a', 'b')
+        SRC.save()
+        filename = os.path.join(TEST_DIR, '.redis_written.rdb')
+        try:
+            redisimp.main(['-s', SRC_RDB, '-d', 'rdb://%s' % filename,
+                           '--target-rdb-version', '7'], out=StringIO())
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(9), b'REDIS0007')
+            rows = list(redisimp.rdbparser.parse_rdb(filename))
+            self.assertEqual([row[0] for row in rows], [b'list'])
+        finally:
+            for name in (filename, filename + '.settings'):
+                if os.path.exists(name):
+                    os.unlink(name)
+
+
+class TestHotFirst(unittest.TestCase):
+    def setUp(self):
+        clean()
+        SRC.config_set('maxmemory-policy', 'allkeys-lfu')
+        # count every access
+        SRC.config_set('lfu-log-factor', 0)
+        for i in range(20):
+            SRC.set('key%d' % i, i)
+        for _ in range(30):
+            SRC.get('key7')
+        for _ in range(10):
+            SRC.get('key13')
+
+    def tearDown(self):
+        SRC.config_set('maxmemory-policy', 'noeviction')
+        SRC.config_set('lfu-log-factor', 10)
+        clean()
+
+    def test_hot_keys(self):
+        hot = redisimp.HotKeys(2)
+        for key, hotness in [('a', 1), ('b', None), ('c', 5), ('d', 1)]:
+            hot.add(key, hotness)
+        self.assertEqual(hot.hottest(), [('c', None), ('a', None)])
+        self.assertIn('a', hot)
+        self.assertNotIn('d', hot)
+
+    def check(self, keys):
+        self.assertEqual(keys[:2], [b'key7', b'key13'])
+        self.assertEqual(sorted(keys), sorted(SRC.keys()))
+        self.assertEqual(DST.dbsize(), 20)
+
+    def test_live(self):
+        self.check(list(redisimp.copy(SRC, DST, hot_first=2)))
+
+    def test_rdb(self):
+        SRC.save()
+        rows = list(redisimp.rdbparser.parse_rdb_hotness(SRC_RDB))
+        hotness = dict((row[0], hotness) for row, hotness in rows)
+        self.assertGreater(hotness[b'key7'], hotness[b'key13'])
+        self.assertGreater(hotness[b'key13'], hotness[b'key0'])
+        self.check(list(redisimp.copy(SRC_RDB, DST, hot_first=2)))
+
+    def test_backfill(self):
+        DST.set('key7', 'old')
+        keys = list(redisimp.copy(SRC, DST, backfill=True, hot_first=2))
+        self.assertEqual(keys[0], b'key13')
+        self.assertEqual(len(keys), 19)
+        self.assertEqual(DST.get('key7'), b'old')
+
+    def test_main(self):
+        SRC.save()
+        out = StringIO()
+        redisimp.main(['-s', SRC_RDB, '-d', DST_RDB, '--hot-first', '5',
+                       '--verbose'], out=out)
+        self.assertEqual(out.getvalue().split()[:2], ["b'key7'", "b'key13'"])
+
+
+class TestDedup(unittest.TestCase):
+    def setUp(self):
+        clean()
+        flush_redis_data(SRC_ALT)
+        SRC.set('shared', 'src')
+        SRC.set('only_src', 'a')
+        SRC_ALT.set('shared', 'alt')
+        SRC_ALT.set('only_alt', 'b')
+
+    def tearDown(self):
+        flush_redis_data(SRC_ALT)
+        clean()
+
+    def test_fingerprint_set(self):
+        seen = redisimp.FingerprintSet(expected_keys=4)
+        for i in range(5000):
+            self.assertTrue(seen.add(b'key%d' % i))
+        self.assertFalse(seen.add(b'key42'))
+        self.assertFalse(seen.add('key42'))
+        self.assertIn(b'key4999', seen)
+        self.assertNotIn(b'key5000', seen)
+        self.assertEqual(len(seen), 5000)
+        self.assertEqual(seen.nbytes, 8 * 8192)
+
+    def test_first(self):
+        dedup = redisimp.Dedup('first')
+        keys = list(redisimp.multi_copy([SRC, SRC_ALT], DST, dedup=dedup))
+        self.assertEqual(sorted(keys), [b'only_alt', b'only_src', b'shared'])
+        self.assertEqual(DST.get('shared'), b'src')
+        self.assertEqual(dedup.skipped, 1)
+
+    def test_last(self):
+        dedup = redisimp.Dedup('last')
+        keys = list(redisimp.multi_copy([SRC, SRC_ALT], DST, dedup=dedup))
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(DST.get('shared'), b'alt')
+
+    def test_rdb(self):
+        SRC.save()
+        dedup = redisimp.Dedup()
+        keys = list(redisimp.multi_copy([SRC_RDB, SRC_RDB, SRC], DST,
+                                        backfill=True, dedup=dedup))
+        self.assertEqual(sorted(keys), [b'only_src', b'shared'])
+        self.assertEqual(dedup.skipped, 4)
+
+    def test_rejected_keys(self):
+        # a copy left out of the first source doesn't block the second
+        SRC.set('shared', os.urandom(1000))
+        SRC.save()
+        SRC_ALT.save()
+        predicate = redisimp.Predicate(max_value_bytes=100)
+        for srclist in ([SRC, SRC_ALT], [SRC_RDB, SRC_ALT_RDB]):
+            DST.flushall()
+            dedup = redisimp.Dedup()
+            keys = list(redisimp.multi_copy(srclist, DST, dedup=dedup,
+                                            predicate=predicate))
+            self.assertEqual(sorted(keys),
+                             [b'only_alt', b'only_src', b'shared'])
+            self.assertEqual(DST.get('shared'), b'alt')
+            self.assertEqual(dedup.skipped, 0)
+
+    def test_scan_repeats(self):
+        dedup = redisimp.Dedup()
+        self.assertEqual(dedup.filter([b'a', b'b', b'a']), [b'a', b'b'])
+        self.assertEqual(dedup.filter([b'b', b'c']), [b'c'])
+
+    def test_main(self):
+        SRC.save()
+        SRC_ALT.save()
+        out = StringIO()
+        redisimp.main(['-s', '%s,%s' % (SRC_RDB, SRC_ALT_RDB), '-d', DST_RDB,
+                       '--dedup', 'last'], out=out)
+        self.assertIn('processed 3 keys', out.getvalue())
+        self.assertIn('skipped 1 duplicate keys', out.getvalue())
+        self.assertEqual(DST.get('shared'), b'alt')
+
+
+class TestSample(unittest.TestCase):
+    def setUp(self):
+        clean()
+        for i in range(200):
+            SRC.set('key%d' % i, 'x' * 100)
+        SRC.zadd('zset', {'a': 1, 'b': 2})
+        SRC.hset('hash', 'field', 'value')
+        SRC.rpush('list', 'a', 'b')
+        for i in range(20):
+            SRC.set('{user1}:%d' % i, i)
+
+    def tearDown(self):
+        clean()
+
+    def test_sampler(self):
+        keys = [b'key%d' % i for i in range(10000)]
+        sampler = redisimp.Sampler(0.1)
+        picked = sampler.filter(keys)
+        self.assertTrue(900 < len(picked) < 1100)
+        self.assertEqual(redisimp.Sampler(0.1).filter(keys), picked)
+        self.assertNotEqual(redisimp.Sampler(0.1, seed=1).filter(keys),
+                            picked)
+        self.assertTrue(set(picked) <= set(redisimp.Sampler(0.2)
+                                           .filter(keys)))
+        self.assertEqual(redisimp.Sampler(0).filter(keys), [])
+        self.assertEqual(redisimp.Sampler(1).filter(keys), keys)
+        self.assertRaises(ValueError, redisimp.Sampler, 1.5)
+
+    def test_hash_tags(self):
+        tagged = [b'{user%d}:%s' % (i, kind) for i in range(100)
+                  for kind in (b'name', b'mail')]
+        picked = set(redisimp.Sampler(0.5).filter(tagged))
+        for i in range(100):
+            self.assertEqual(b'{user%d}:name' % i in picked,
+                             b'{user%d}:mail' % i in picked)
+
+    def test_rdb_and_live_agree(self):
+        SRC.save()
+        sampler = redisimp.Sampler(0.3, seed=7)
+        live = sorted(redisimp.copy(SRC, DST, sampler=sampler))
+        expected = sorted(sampler.filter(SRC.keys()))
+        self.assertEqual(live, expected)
+        flush_redis_data(DST)
+        rdb = sorted(redisimp.copy(SRC_RDB, DST, sampler=sampler))
+        self.assertEqual(rdb, expected)
+        self.assertEqual(sorted(DST.keys()), expected)
+        for key in expected:
+            self.assertEqual(DST.dump(key), SRC.dump(key))
+
+    def test_skipped_values_are_read_past(self):
+        SRC.save()
+        sampler = redisimp.Sampler(0.5)
+        rows = list(redisimp.rdbparser.parse_rdb(SRC_RDB, sampler))
+        keys = sorted(row[0] for row in rows)
+        self.assertEqual(keys, sorted(sampler.filter(SRC.keys())))
+        for key, data, pttl in rows:
+            self.assertEqual(data, SRC.dump(key))
+
+    def test_main(self):
+        SRC.save()
+        out = StringIO()
+        redisimp.main(['-s', SRC_RDB, '-d', DST_RDB, '--sample', '0.25',
+                       '--sample-seed', '3'], out=out)
+        expected = redisimp.Sampler(0.25, seed=3).filter(SRC.keys())
+        self.assertIn('processed %d keys' % len(expected), out.getvalue())
+        self.assertEqual(sorted(DST.keys()), sorted(expected))
+
+
+class OldScan(object):
+    """
+    A source that doesn't know SCAN TYPE, like redis before 6.0.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.scans = 0
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def scan(self, cursor=0, match=None, count=None, _type=None):
+        self.scans += 1
+        if _type is not None:
+            raise redis.exceptions.ResponseError('syntax error')
+        return self.conn.scan(cursor=cursor, match=match, count=count)
+
+
+class TestPredicates(unittest.TestCase):
+    def setUp(self):
+        clean()
+        SRC.set('small', 'x')
+        SRC.set('large', os.urandom(5000))
+        SRC.hset('hash', mapping={'a': '1', 'b': '2'})
+        SRC.zadd('zset', {'a': 1})
+        SRC.rpush('list', *['item%d' % i for i in range(10)])
+        SRC.set('expiring', 'x', ex=60)
+        SRC.set('lasting', 'x', ex=3600)
+
+    def tearDown(self):
+        clean()
+
+    def test_header(self):
+        clock = FakeClock()
+        clock.now = 1000.0
+        predicate = redisimp.Predicate(types=['hash', 'zset'],
+                                       max_value_bytes=100, min_ttl=60,
+                                       clock=clock.time)
+        self.assertEqual(predicate.scan_type, None)
+        self.assertTrue(predicate(b'k', 4, 2, None))
+        self.assertTrue(predicate(b'k', 13, 100, None))
+        self.assertFalse(predicate(b'k', 0, 1, None))
+        self.assertFalse(predicate(b'k', 13, 101, None))
+        self.assertFalse(predicate(b'k', 4, 2, 1059999))
+        self.assertTrue(predicate(b'k', 4, 2, 1060000))
+        self.assertEqual(redisimp.Predicate(types=['hash']).scan_type, 'hash')
+        self.assertRaises(ValueError, redisimp.Predicate, types=['blob'])
+
+    def test_large_values_are_skipped_by_their_header(self):
+        SRC.save()
+        seen = []
+
+        def predicate(key, enc_type, length, expiry):
+            seen.append((key, length))
+            return length < 1000
+
+        rows = list(redisimp.rdbparser.parse_rdb(SRC_RDB,
+                                                 predicate=predicate))
+        self.assertNotIn(b'large', [row[0] for row in rows])
+        self.assertIn((b'large', 5000), seen)
+        self.assertEqual(len(seen), 7)
+        for key, data, pttl in rows:
+            self.assertEqual(data, SRC.dump(key))
+
+    def test_rdb_and_live_agree(self):
+        SRC.save()
+        for predicate in (redisimp.Predicate(types=['hash']),
+                          redisimp.Predicate(types=['string', 'list']),
+                          redisimp.Predicate(max_value_bytes=100),
+                          redisimp.Predicate(min_ttl=600)):
+            flush_redis_data(DST)
+            live = sorted(redisimp.copy(SRC, DST, predicate=predicate))
+            flush_redis_data(DST)
+            rdb = sorted(redisimp.copy(SRC_RDB, DST, predicate=predicate))
+            self.assertEqual(live, rdb)
+            self.assertEqual(sorted(DST.keys()), rdb)
+        self.assertEqual(sorted(redisimp.copy(
+            SRC_RDB, None, predicate=redisimp.Predicate(min_ttl=600))),
+            [b'hash', b'large', b'lasting', b'list', b'small', b'zset'])
+
+    def test_scan_type_fallback(self):
+        src = OldScan(SRC)
+        keys = list(redisimp.copy(src, DST,
+                                  predicate=redisimp.Predicate(['zset'])))
+        self.assertEqual(keys, [b'zset'])
+        self.assertEqual(DST.keys(), [b'zset'])
+        self.assertGreater(src.scans, 1)
+
+    def test_main(self):
+        SRC.save()
+        out = StringIO()
+        redisimp.main(['-s', SRC_RDB, '-d', DST_RDB, '--type', 'string,hash',
+                       '--max-value-bytes', '1000', '--min-ttl', '600'],
+                      out=out)
+        self.assertIn('processed 3 keys', out.getvalue())
+        self.assertEqual(sorted(DST.keys()), [b'hash', b'lasting', b'small'])
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for_sync(primary, replica):
+    offset = primary.info('replication')['master_repl_offset']
+    for _ in range(100):
+        info = replica.info('replication')
+        if info.get('master_link_status') == 'up' and \
+                info.get('slave_repl_offset', 0) >= offset:
+            return
+        time.sleep(0.05)
+    raise AssertionError('the replica never caught up')
+
+
+class GoneReplica(object):
+    """
+    A replica whose connection is lost at the first pipeline.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.connection_pool = conn.connection_pool
+
+    def info(self, section=None):
+        return self.conn.info(section)
+
+    def scan(self, *args, **kwargs):
+        return self.conn.scan(*args, **kwargs)
+
+    def pipeline(self, transaction=False):
+        pipe = self.conn.pipeline(transaction=False)
+
+        def execute(raise_on_error=True):
+            raise redis.exceptions.ConnectionError('gone')
+
+        pipe.execute = execute
+        return pipe
+
+    def close(self):
+        pass
+
+
+class TestReplicas(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        port = free_port()
+        cls.primary = redislite.StrictRedis(
+            os.path.join(cls.dir, 'primary.db'),
+            serverconfig={'port': str(port)})
+        cls.replica = redislite.StrictRedis(
+            os.path.join(cls.dir, 'replica.db'),
+            serverconfig={'replicaof': '127.0.0.1 %d' % port})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.replica.shutdown(nosave=True)
+        cls.primary.shutdown(nosave=True)
+        shutil.rmtree(cls.dir, ignore_errors=True)
+
+    def setUp(self):
+        clean()
+        self.primary.flushall()
+        for i in range(100):
+            self.primary.set('key%d' % i, i)
+        wait_for_sync(self.primary, self.replica)
+
+    def tearDown(self):
+        clean()
+
+    def test_discover(self):
+        # a replica on a unix socket announces port 0 and can't be reached
+        self.assertEqual(redisimp.discover_replicas(self.primary), [])
+        self.assertEqual(redisimp.discover_replicas(self.replica), [])
+
+    def test_reads_from_the_replica(self):
+        src = redisimp.ReplicaSource(self.primary, [self.replica])
+        keys = list(redisimp.copy(src, DST))
+        self.assertEqual(len(keys), 100)
+        self.assertEqual(DST.get('key42'), b'42')
+        self.assertEqual(src.reads, {redisimp.api._conn_name(self.replica):
+                                     1})
+        self.assertEqual(list(src.lags.values()), [0])
+
+    def test_lagging_replica(self):
+        clock = FakeClock()
+        src = redisimp.ReplicaSource(self.primary, [self.replica],
+                                     max_lag=-1, clock=clock.time)
+        list(redisimp.copy(src, DST))
+        self.assertEqual(DST.dbsize(), 100)
+        self.assertEqual(list(src.reads),
+                         [redisimp.api._conn_name(self.primary)])
+        src.max_lag = 0
+        self.assertEqual(src.usable(), [])
+        clock.now += 1
+        self.assertEqual(src.usable(), [self.replica])
+
+    def test_replica_goes_away(self):
+        gone = GoneReplica(self.replica)
+        src = redisimp.ReplicaSource(self.primary, [gone])
+        keys = list(redisimp.copy(src, DST))
+        self.assertEqual(len(keys), 100)
+        self.assertEqual(DST.dbsize(), 100)
+        self.assertEqual(src.usable(), [])
+
+    def test_main(self):
+        out = StringIO()
+        redisimp.main(['-s', 'unix://' + self.primary.socket_file,
+                       '-d', DST_RDB,
+                       '--replicas', 'unix://' + self.replica.socket_file],
+                      out=out)
+        self.assertIn('processed 100 keys', out.getvalue())
+        self.assertEqual(DST.dbsize(), 100)
+
+
+class TestCopier(unittest.TestCase):
+    def setUp(self):
+        clean()
+        for i in range(1200):
+            SRC.set('key%d' % i, i)
+        SRC.save()
+        self.filename = os.path.join(TEST_DIR, '.redis_copier.rimp')
+
+    def tearDown(self):
+        clean()
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    def keys(self, results):
+        return sorted(key for result in results for key in result.keys)
+
+    def test(self):
+        copier = redisimp.Copier(DST)
+        for src in (SRC, SRC_RDB):
+            results = list(copier.copy_batches(src))
+            self.assertEqual(len(self.keys(results)), 1200)
+            self.assertGreater(len(results), 1)
+            self.assertEqual(sum(r.bytes for r in results),
+                             sum(len(SRC.dump(k)) for k in SRC.keys()))
+            for result in results:
+                self.assertEqual((result.skipped, result.failed), ([], []))
+                self.assertGreaterEqual(result.read_time, 0)
+        self.assertEqual(DST.dbsize(), 1200)
+
+    def test_backfill(self):
+        DST.set('key7', 'old')
+        copier = redisimp.Copier(DST, pattern='key1*', backfill=True)
+        results = list(copier.copy_batches(SRC))
+        self.assertEqual(len(self.keys(results)), 311)
+        self.assertEqual(sum(len(r.skipped) for r in results), 0)
+
+        DST.set('key10', 'old')
+        DST.delete('key11')
+        results = list(copier.copy_batches(SRC_RDB))
+        self.assertEqual(self.keys(results), [b'key11'])
+        self.assertEqual(len([k for r in results for k in r.skipped]), 310)
+        self.assertEqual(DST.get('key10'), b'old')
+
+    def test_failed(self):
+        writer = redisimp.ArchiveWriter(self.filename)
+        pipe = writer.pipeline()
+        pipe.restore(b'good', 0, SRC.dump('key1'))
+        pipe.restore(b'bad', 0, b'not a payload')
+        pipe.execute()
+        writer.close()
+        results = list(redisimp.Copier(DST).copy_batches(self.filename))
+        self.assertEqual(self.keys(results), [b'good'])
+        failed = [f for r in results for f in r.failed]
+        self.assertEqual([key for key, _ in failed], [b'bad'])
+        self.assertIsInstance(failed[0][1], redis.ResponseError)
+
+    def test_dry_run(self):
+        results = list(redisimp.Copier(None, pattern='key11*').copy(
+            [SRC, SRC_RDB]))
+        self.assertEqual(len(self.keys(results)), 222)
+        self.assertEqual(DST.dbsize(), 0)
+
+
+class TestProgress(unittest.TestCase):
+    def setUp(self):
+        clean()
+        for i in range(1000):
+            SRC.set('key%d' % i, 'x' * 100)
+        SRC.save()
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        clean()
+
+    def progress(self, sources=1):
+        out = StringIO()
+        return out, redisimp.Progress(out, sources, interval=1.0,
+                                      clock=self.clock.time)
+
+    def test_source_size(self):
+        self.assertEqual(redisimp.source_size(SRC),
+                         (1000, None))
+        self.assertEqual(redisimp.source_size(SRC_RDB),
+                         (1000, os.path.getsize(SRC_RDB)))
+
+    def test_rdb_offset(self):
+        out, progress = self.progress()
+        progress.start(SRC_RDB)
+        keys = redisimp.copy(SRC_RDB, DST, progress=progress)
+        next(keys)
+        # the first batch of 500 keys was parsed
+        self.assertAlmostEqual(progress.fraction(), 0.5, delta=0.05)
+        for _ in keys:
+            pass
+
+        out, progress = self.progress()
+        progress.start(SRC_RDB)
+        for _ in redisimp.copy(SRC_RDB, DST, pattern='key1*',
+                               progress=progress):
+            progress.advance()
+        # only a ninth of the keys matched, but the whole file was read
+        self.assertEqual(progress.fraction(), 1.0)
+        self.clock.now = 2.0
+        self.assertTrue(progress.status().startswith('100.0%  111/1000 keys'),
+                        progress.status())
+
+    def test_live(self):
+        out, progress = self.progress(sources=2)
+        progress.start(SRC)
+        for i, _ in enumerate(redisimp.copy(SRC, DST, progress=progress)):
+            self.clock.now = (i + 1) / 500.0
+            progress.advance()
+        # a line a second
+        self.assertEqual(out.getvalue().count('\r'), 2)
+        self.assertEqual(progress.fraction(), 1.0)
+        self.assertEqual(progress.status(), '[1/2]   50.0%  1000/1000 keys  '
+                         '500 keys/s  0.0 MB/s  eta 0:00:02')
+
+    def test_interval(self):
+        out, progress = self.progress()
+        progress.start(SRC)
+        progress.advance(10)
+        self.assertEqual(out.getvalue(), '')
+        self.clock.now = 1.0
+        progress.advance(10)
+        self.assertEqual(out.getvalue().count('\r'), 1)
+
+    def test_key_log(self):
+        out = StringIO()
+        log = redisimp.KeyLog(out, size=3)
+        log.write(b'a')
+        log.write(b'b')
+        self.assertEqual(out.getvalue(), '')
+        log.write(b'c')
+        log.write(b'd')
+        self.assertEqual(out.getvalue().splitlines(),
+                         ["b'a'", "b'b'", "b'c'"])
+        log.flush()
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        clean()
+        flush_redis_data(SRC_ALT)
+        with SRC.pipeline(transaction=False) as pipe:
+            for i in range(600):
+                pipe.set('key%d' % i, 'v%d' % i)
+            pipe.zadd('big', dict(('m%d' % i, i) for i in range(300)))
+            pipe.hset('small', 'f', 'v')
+            pipe.execute()
+        SRC.save()
+        self.dumps = dict((key, len(SRC.dump(key)))
+                          for key in SRC.scan_iter())
+
+    def tearDown(self):
+        clean()
+        flush_redis_data(SRC_ALT)
+
+    def test_rdb(self):
+        plan = redisimp.Plan(DST)
+        keys = list(plan.read_sources([SRC_RDB]))
+        self.assertEqual(len(keys), 602)
+        self.assertEqual(plan.keys, 602)
+        self.assertEqual(plan.sized, 602)
+        self.assertEqual(plan.bytes, sum(self.dumps.values()))
+        self.assertEqual(plan.types['hash'], (1, self.dumps[b'small'], 0))
+        self.assertEqual(plan.largest[0],
+                         (self.dumps[b'big'], b'big', 'zset', 'payload'))
+        self.assertEqual(len(plan.largest), 10)
+        self.assertEqual(plan.dst_round_trips, 2)
+        self.assertEqual(DST.dbsize(), 0)
+
+    def test_live_sample(self):
+        plan = redisimp.Plan(pattern='key*', sample=0.25)
+        self.assertEqual(len(list(plan.read(SRC))), 600)
+        self.assertEqual(plan.keys, 600)
+        self.assertGreater(plan.sized, 100)
+        self.assertLess(plan.sized, 300)
+        self.assertEqual(list(plan.types), ['string'])
+        self.assertGreater(plan.memory, 0)
+        self.assertEqual(plan.bytes, 0)
+        self.assertIsNone(plan.seconds)
+        self.assertEqual(plan.src_round_trips, 2 + 2)
+
+    def test_scale_per_source(self):
+        # the exact sizes of the rdb file are not scaled by the live sample
+        with SRC_ALT.pipeline(transaction=False) as pipe:
+            for i in range(100, 300):
+                pipe.set('alt%d' % i, 'x%d' % i)
+            pipe.execute()
+        plan = redisimp.Plan(sample=0.25)
+        self.assertEqual(len(list(plan.read_sources([SRC_RDB, SRC_ALT]))),
+                         802)
+        self.assertLess(plan.sized, 802)
+        self.assertEqual(plan.types['hash'], (1, self.dumps[b'small'], 0))
+        self.assertEqual(plan.types['zset'], (1, self.dumps[b'big'], 0))
+        # payload bytes and memory bytes are kept apart
+        self.assertEqual(plan.bytes, sum(self.dumps.values()))
+        memory = sum(SRC_ALT.memory_usage(key) for key in SRC_ALT.keys())
+        self.assertAlmostEqual(plan.memory, memory, delta=memory * 0.05)
+
+    def test_default_sample(self):
+        # live keys are probed with MEMORY USAGE, a sample of them
+        with SRC.pipeline(transaction=False) as pipe:
+            for i in range(600, 3000):
+                pipe.set('key%d' % i, 'v%d' % i)
+            pipe.execute()
+        SRC.config_resetstat()
+        plan = redisimp.Plan()
+        self.assertEqual(len(list(plan.read(SRC))), 3002)
+        self.assertLess(plan.sized, 300)
+        stats = SRC.info('commandstats')
+        self.assertNotIn('cmdstat_dump', stats)
+        self.assertEqual(stats['cmdstat_memory']['calls'], plan.sized)
+
+    def test_nodes(self):
+        sharded = redisimp.ShardedRedis([DST, SRC_ALT], scheme='crc16')
+        plan = redisimp.Plan(sharded, backfill=True)
+        list(plan.read(SRC_RDB))
+        sharded.close()
+        self.assertEqual(sorted(plan.nodes), sorted(sharded.names))
+        self.assertEqual(sum(n[0] for n in plan.nodes.values()), plan.bytes)
+        self.assertEqual(plan.dst_round_trips, 4)
+        self.assertGreater(plan.seconds, 0)
+
+    def test_main(self):
+        out = StringIO()
+        redisimp.main(['-s', SRC_RDB, '-d', DST_RDB, '--dry-run'], out=out)
+        output = out.getvalue()
+        self.assertIn('processed 602 keys', output)
+        self.assertIn('keys: 602', output)
+        self.assertIn("payload  zset     big\n", output)
+        self.assertIn('round trips: 0 to the source', output)
+        self.assertEqual(DST.dbsize(), 0)
+
+
+class TestAnalyze(unittest.TestCase):
+    def setUp(self):
+        clean()
+        with SRC.pipeline(transaction=False) as pipe:
+            for i in range(100):
+                pipe.set('user:%d:name' % i, 'n%d' % i)
+            for i in range(10):
+                pipe.set('session:%d' % i, 's', px=120000)
+            pipe.rpush('queue:jobs', *range(1000))
+            pipe.hset('plain', 'f', 'v')
+            pipe.execute()
+        SRC.save()
+
+    def tearDown(self):
+        clean()
+
+    def test_prefixes(self):
+        analyzer = redisimp.Analyzer(top=3)
+        analyzer.read(SRC_RDB)
+        result = analyzer.result()
+        self.assertEqual(result['keys'], 112)
+        self.assertEqual(sorted(result['prefixes']),
+                         ['(none)', 'queue', 'session', 'user'])
+        user = result['prefixes']['user']
+        self.assertEqual(user['keys'], 100)
+        self.assertEqual(user['types'], {'string': 100})
+        self.assertEqual(user['ttls'], {'none': 100})
+        self.assertEqual(result['prefixes']['session']['ttls'], {'<1h': 10})
+        self.assertEqual(result['prefixes']['(none)']['types'], {'hash': 1})
+        self.assertEqual(len(result['largest']), 3)
+        self.assertEqual(result['largest'][0]['key'], 'queue:jobs')
+        self.assertEqual(result['largest'][0]['type'], 'list')
+        self.assertEqual(result['largest'][0]['bytes'],
+                         len(SRC.dump('queue:jobs')))
+        self.assertEqual(sum(b['keys'] for b in result['value_sizes']), 112)
+        self.assertEqual(result['bytes'], sum(
+            len(SRC.dump(key)) for key in SRC.scan_iter()))
+
+    def test_sizes(self):
+        # values are read past, their sizes match the payloads exactly
+        SRC.set('big', os.urandom(5000))
+        SRC.set('lzf', 'a' * 5000, px=600000)
+        SRC.zadd('zset', {'m%d' % i: i * 0.5 for i in range(200)})
+        SRC.sadd('intset', *range(10))
+        SRC.save()
+        payloads = dict((key, data) for key, data, _ in
+                        redisimp.rdbparser.parse_rdb(SRC_RDB))
+        sizes = list(redisimp.rdbparser.parse_rdb_sizes(SRC_RDB))
+        self.assertEqual(len(sizes), len(payloads))
+        for key, enc_type, size, pttl in sizes:
+            self.assertEqual(size, len(payloads[key]))
+            self.assertEqual(enc_type, bytearray(payloads[key])[0])
+        self.assertLess(len(payloads[b'lzf']), 5000)
+
+    def test_depth_and_limit(self):
+        analyzer = redisimp.Analyzer(depth=2, max_prefixes=5)
+        analyzer.read(SRC_RDB, pattern='user:*')
+        result = analyzer.result()
+        self.assertEqual(len(result['prefixes']), 6)
+        self.assertEqual(result['prefixes']['(other)']['keys'], 95)
+
+    def test_main(self):
+        out = StringIO()
+        redisimp.main(['-s', SRC_RDB, '--analyze', '--analyze-top', '1'],
+                      out=out)
+        result = json.loads(out.getvalue())
+        self.assertEqual(result['keys'], 112)
+        self.assertEqual([k['key'] for k in result['largest']],
+                         ['queue:jobs'])
+        with self.assertRaises(SystemExit):
+            redisimp.main(['-s', SRC_RDB], out=out)
+
+
+class FlakyDestination(object):
+    """
+    A destination that loses the connection to the pipelines numbered in
+    `drops` after running them, and refuses the keys in `refuse` the
+    first `refusals` times they are sent.
+    """
+
+    def __init__(self, conn, drops=(), refuse=(), refusals=1):
+        self.conn = conn
+        self.connection_pool = conn.connection_pool
+        self.drops = drops
+        self.refuse = dict((key, refusals) for key in refuse)
+        self.sent = []
+
+    def info(self, section=None):
+        return self.conn.info(section)
+
+    def pipeline(self, transaction=False):
+        return FlakyPipeline(self)
+
+
+class FlakyPipeline(object):
+    def __init__(self, dst):
+        self.dst = dst
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+
+        return call
+
+    def execute(self, raise_on_error=True):
+        dst = self.dst
+        pipe = dst.conn.pipeline(transaction=False)
+        refused, keys = [], []
+        for name, args, kwargs in self.calls:
+            key = args[1] if name == 'execute_command' else args[0]
+            keys.append(key)
+            if dst.refuse.get(key):
+                dst.refuse[key] -= 1
+                refused.append(True)
+            else:
+                getattr(pipe, name)(*args, **kwargs)
+                refused.append(False)
+        dst.sent.append(keys)
+        replies = iter(pipe.execute(raise_on_error=False))
+        results = [redis.ResponseError('LOADING Redis is loading the '
+                                       'dataset in memory')
+                   if r else next(replies) for r in refused]
+        if len(dst.sent) - 1 in dst.drops:
+            raise redis.ConnectionError('Connection closed by server.')
+        return results
+
+
+class TestRetry(unittest.TestCase):
+    def setUp(self):
+        clean()
+        for i in range(100):
+            SRC.set('key%d' % i, i)
+        SRC.save()
+        self.sleeps = []
+        self.log = os.path.join(TEST_DIR, '.redis_failures.log')
+
+    def tearDown(self):
+        clean()
+        if os.path.exists(self.log):
+            os.unlink(self.log)
+
+    def retry(self, **kwargs):
+        return redisimp.Retry(sleep=self.sleeps.append, **kwargs)
+
+    def failures(self):
+        with open(self.log) as f:
+            return [json.loads(line) for line in f]
+
+    def test_connection_lost(self):
+        dst = FlakyDestination(DST, drops=(0, 1))
+        metrics = redisimp.Metrics()
+        keys = list(redisimp.copy(SRC, dst, retry=self.retry(),
+                                  metrics=metrics))
+        self.assertEqual(len(keys), 100)
+        self.assertEqual(DST.dbsize(), 100)
+        self.assertEqual([len(keys) for keys in dst.sent], [100] * 3)
+        self.assertEqual(self.sleeps, [0.1, 0.2])
+        self.assertEqual(metrics.snapshot()['counters']['retries'], 2)
+
+        # without a retry policy the first lost connection stops the copy
+        DST.flushall()
+        with self.assertRaises(redis.ConnectionError):
+            list(redisimp.copy(SRC, FlakyDestination(DST, drops=(0,))))
+
+    def test_only_failed_keys_are_replayed(self):
+        dst = FlakyDestination(DST, refuse=[b'key3', b'key7'], refusals=2)
+        keys = list(redisimp.copy(SRC_RDB, dst, retry=self.retry()))
+        self.assertEqual(len(keys), 100)
+        self.assertEqual(DST.dbsize(), 100)
+        self.assertEqual(len(dst.sent[0]), 100)
+        self.assertEqual([sorted(keys) for keys in dst.sent[1:]],
+                         [[b'key3', b'key7']] * 2)
+
+    def test_failure_log(self):
+        dst = FlakyDestination(DST, refuse=[b'key3'], refusals=100)
+        retry = self.retry(attempts=3, failure_log=self.log)
+        keys = list(redisimp.copy(SRC, dst, retry=retry))
+        self.assertEqual(len(keys), 99)
+        self.assertNotIn(b'key3', keys)
+        self.assertEqual(retry.failed, 1)
+        self.assertEqual(len(self.sleeps), 2)
+        failures = self.failures()
+        self.assertEqual([f['key'] for f in failures], ['key3'])
+        self.assertIn('LOADING', failures[0]['error'])
+
+        dst = FlakyDestination(DST, refuse=[b'key3'], refusals=100)
+        with self.assertRaises(redis.ResponseError):
+            list(redisimp.copy(SRC, dst, retry=self.retry(attempts=2)))
+
+    def test_backfill(self):
+        DST.set('key1', 'old')
+        dst = FlakyDestination(DST, drops=(0, 2))
+        metrics = redisimp.Metrics()
+        keys = list(redisimp.copy(SRC, dst, backfill=True, metrics=metrics,
+                                  retry=self.retry()))
+        # the exists check is lost once, the first restore then goes
+        # through without an answer and comes back as busy keys
+        self.assertEqual(keys, [])
+        self.assertEqual(DST.dbsize(), 100)
+        self.assertEqual(DST.get('key1'), b'old')
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(counters['busykey_skips'], 99)
+        self.assertEqual(counters['retries'], 2)
+
+    def test_copier_and_fanout(self):
+        dst = FlakyDestination(DST, refuse=[b'key3'], refusals=100)
+        retry = self.retry(attempts=2, failure_log=self.log)
+        results = list(redisimp.Copier(dst, retry=retry).copy_batches(SRC))
+        self.assertEqual([key for r in results for key, _ in r.failed],
+                         [b'key3'])
+        self.assertEqual([f['key'] for f in self.failures()], ['key3'])
+
+        DST.flushall()
+        fanout = redisimp.FanOut([FlakyDestination(DST, drops=(0,))])
+        list(redisimp.copy(SRC, fanout, retry=self.retry()))
+        fanout.close()
+        self.assertEqual(DST.dbsize(), 100)
+
+    def test_main(self):
+        filename = os.path.join(TEST_DIR, '.redis_retry.rimp')
+        writer = redisimp.ArchiveWriter(filename)
+        pipe = writer.pipeline()
+        pipe.restore(b'good', 0, SRC.dump('key1'))
+        pipe.restore(b'bad', 0, b'not a payload')
+        pipe.execute()
+        writer.close()
+        out = StringIO()
+        try:
+            with self.assertRaises(SystemExit):
+                redisimp.main(['-s', filename, '-d', DST_RDB, '--retries',
+                               '3', '--failure-log', self.log], out=out)
+        finally:
+            os.unlink(filename)
+        self.assertEqual(DST.keys(), [b'good'])
+        self.assertIn('failed writing 1 keys', out.getvalue())
+        # a payload that can't be loaded isn't sent again
+        self.assertEqual([f['key'] for f in self.failures()], ['bad'])
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)